@@ -8,6 +8,9 @@ import fnmatch
 import sys
 import subprocess
 import datetime
+import hashlib
+import json
+import multiprocessing
 import os
 
 ################################################################################
@@ -150,7 +153,6 @@ def gather_file_info(filename):
     info = {}
     info['filename'] = filename
     c = read_file(filename)
-    info['contents'] = c
 
     info['all_copyrights'] = get_count_of_copyrights_of_any_style_any_holder(c)
 
@@ -172,6 +174,82 @@ def gather_file_info(filename):
             info['classified_copyrights'] = info['classified_copyrights'] + 1
     return info
 
+################################################################################
+# gather info of many files, in parallel and cached by git blob hash
+################################################################################
+
+GIT_LS_STAGE_CMD = 'git ls-files -s -z'
+GIT_DIFF_NAMES_CMD = 'git diff --name-only -z'
+GIT_DIR_CMD = 'git rev-parse --git-dir'
+CACHE_FILENAME = 'copyright_header_cache.json'
+
+# Cached infos are only valid for the same patterns
+CACHE_VERSION = hashlib.sha1(repr((ANY_COPYRIGHT_STYLE_OR_YEAR_STYLE,
+                                   COPYRIGHT_WITH_C, COPYRIGHT_WITHOUT_C,
+                                   YEAR_RANGE, YEAR_LIST, ANY_YEAR_STYLE,
+                                   EXPECTED_HOLDER_NAMES)).encode('utf-8')).hexdigest()
+
+def get_blob_hashes():
+    """Blob hashes of the tracked files that have no unstaged changes"""
+    out = subprocess.check_output(GIT_LS_STAGE_CMD.split(' '))
+    blob_hashes = {}
+    for entry in out.decode("utf-8").split('\0'):
+        if entry == '':
+            continue
+        # <mode> SP <object> SP <stage> TAB <file>
+        meta, filename = entry.split('\t', 1)
+        blob_hashes[filename] = meta.split(' ')[1]
+    out = subprocess.check_output(GIT_DIFF_NAMES_CMD.split(' '))
+    for filename in out.decode("utf-8").split('\0'):
+        blob_hashes.pop(filename, None)
+    return blob_hashes
+
+def get_cache_path():
+    out = subprocess.check_output(GIT_DIR_CMD.split(' '))
+    return os.path.join(out.decode("utf-8").strip(), CACHE_FILENAME)
+
+def read_cache(path):
+    try:
+        with open(path, 'r') as f:
+            cache = json.load(f)
+    except (IOError, ValueError):
+        return {}
+    if cache.get('version') != CACHE_VERSION:
+        return {}
+    return cache['infos']
+
+def write_cache(path, infos):
+    with open(path, 'w') as f:
+        json.dump({'version': CACHE_VERSION, 'infos': infos}, f)
+
+def gather_file_infos(filenames):
+    blob_hashes = get_blob_hashes()
+    cache_path = get_cache_path()
+    cache = read_cache(cache_path)
+
+    file_infos = {}
+    for filename in filenames:
+        blob_hash = blob_hashes.get(filename)
+        if blob_hash in cache:
+            file_infos[filename] = dict(cache[blob_hash], filename=filename)
+    missing = [f for f in filenames if f not in file_infos]
+    if missing:
+        pool = multiprocessing.Pool()
+        for info in pool.imap(gather_file_info, missing, chunksize=16):
+            file_infos[info['filename']] = info
+        pool.close()
+
+    # Only keep the entries of the current files, so the cache does not grow
+    # without bound.
+    new_cache = {}
+    for filename in filenames:
+        blob_hash = blob_hashes.get(filename)
+        if blob_hash is not None:
+            new_cache[blob_hash] = dict(file_infos[filename])
+            del new_cache[blob_hash]['filename']
+    write_cache(cache_path, new_cache)
+    return [file_infos[f] for f in filenames]
+
 ################################################################################
 # report execution
 ################################################################################
@@ -261,7 +339,7 @@ def exec_report(base_directory, verbose):
     original_cwd = os.getcwd()
     os.chdir(base_directory)
     filenames = get_filenames_to_examine()
-    file_infos = [gather_file_info(f) for f in filenames]
+    file_infos = gather_file_infos(filenames)
     print_report(file_infos, verbose)
     os.chdir(original_cwd)
 
@@ -318,6 +396,32 @@ def get_git_change_years(filename):
 def get_most_recent_git_change_year(filename):
     return max(get_git_change_years(filename))
 
+GIT_LOG_NAMES_CMD = "git log --pretty=format:%x00%ai --name-only -z"
+
+def get_all_git_change_years():
+    """
+    Map every file in the history to the years it was changed in, with a
+    single 'git log' for the whole repository.
+    """
+    out = subprocess.check_output(GIT_LOG_NAMES_CMD.split(' '))
+    change_years = {}
+    # Every commit: "\0<date>[\n<file>\0<file>\0...]\0", with the file
+    # names unquoted. The date is the first field after an empty one.
+    year = None
+    after_empty = False
+    for field in out.decode("utf-8").split('\0'):
+        if field == '':
+            after_empty = True
+            continue
+        if after_empty:
+            date, _, field = field.partition('\n')
+            year = date.split(' ')[0].split('-')[0]
+            after_empty = False
+            if field == '':
+                continue
+        change_years.setdefault(field, set()).add(year)
+    return change_years
+
 ################################################################################
 # read and write to file
 ################################################################################
@@ -380,13 +484,16 @@ def create_updated_copyright_line(line, last_git_change_year):
             year_range_to_str(start_year, last_git_change_year) + ' ' +
             ' '.join(space_split[1:]))
 
-def update_updatable_copyright(filename):
+def update_updatable_copyright(filename, change_years):
     file_lines = read_file_lines(filename)
     index, line = get_updatable_copyright_line(file_lines)
     if not line:
         print_file_action_message(filename, "No updatable copyright.")
         return
-    last_git_change_year = get_most_recent_git_change_year(filename)
+    if filename in change_years:
+        last_git_change_year = max(change_years[filename])
+    else:
+        last_git_change_year = str(datetime.date.today().year)
     new_line = create_updated_copyright_line(line, last_git_change_year)
     if line == new_line:
         print_file_action_message(filename, "Copyright up-to-date.")
@@ -399,8 +506,9 @@ def update_updatable_copyright(filename):
 def exec_update_header_year(base_directory):
     original_cwd = os.getcwd()
     os.chdir(base_directory)
+    change_years = get_all_git_change_years()
     for filename in get_filenames_to_examine():
-        update_updatable_copyright(filename)
+        update_updatable_copyright(filename, change_years)
     os.chdir(original_cwd)
 
 ################################################################################
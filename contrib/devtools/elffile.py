@@ -0,0 +1,201 @@
+#!/usr/bin/env python
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+'''
+Minimal ELF reader for security-check.py and symbol-check.py.
+
+Reads the ELF header, the program headers, the dynamic section and the
+dynamic symbol table with symbol versions straight from the (memory-mapped)
+file, so that the checks do not need to run and parse `readelf`. 32 and 64
+bit, little and big endian files are supported.
+'''
+from __future__ import division,print_function,unicode_literals
+import mmap
+import struct
+from collections import namedtuple
+
+# e_type
+ET_DYN = 3
+
+# p_type
+PT_LOAD = 1
+PT_DYNAMIC = 2
+PT_GNU_STACK = 0x6474e551
+PT_GNU_RELRO = 0x6474e552
+
+# p_flags
+PF_X = 1
+PF_W = 2
+PF_R = 4
+
+# sh_type
+SHT_DYNSYM = 11
+SHT_GNU_verdef = 0x6ffffffd
+SHT_GNU_verneed = 0x6ffffffe
+SHT_GNU_versym = 0x6fffffff
+
+# d_tag
+DT_NULL = 0
+DT_NEEDED = 1
+DT_STRTAB = 5
+DT_FLAGS = 30
+DT_BIND_NOW = 24
+
+# DT_FLAGS bits
+DF_BIND_NOW = 8
+
+# st_shndx of undefined (imported) symbols
+SHN_UNDEF = 0
+
+# Version indices below this have no version name (local, global)
+VER_NDX_NAMED = 2
+
+ProgramHeader = namedtuple('ProgramHeader', ['type', 'flags', 'offset', 'vaddr', 'filesz'])
+Section = namedtuple('Section', ['name', 'type', 'offset', 'size', 'link', 'entsize'])
+# version is the version name (b'' if none), is_import whether the symbol is undefined
+Symbol = namedtuple('Symbol', ['name', 'version', 'is_import'])
+
+class ELFFile(object):
+    def __init__(self, filename):
+        with open(filename, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.data[:4] != b'\x7fELF':
+            raise ValueError('%s: not an ELF file' % filename)
+        self.is64 = self.data[4:5] == b'\x02'
+        self.endian = '<' if self.data[5:6] == b'\x01' else '>'
+        if self.is64:
+            (self.type, self.machine, _, _, self.phoff, self.shoff, _, _,
+             self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = self.unpack('HHIQQQIHHHHHH', 16)
+        else:
+            (self.type, self.machine, _, _, self.phoff, self.shoff, _, _,
+             self.phentsize, self.phnum, self.shentsize, self.shnum, self.shstrndx) = self.unpack('HHIIIIIHHHHHH', 16)
+        self.program_headers = self._read_program_headers()
+        self.sections = self._read_sections()
+
+    def close(self):
+        self.data.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def unpack(self, fmt, offset):
+        return struct.unpack_from(self.endian + fmt, self.data, offset)
+
+    def cstring(self, offset):
+        return self.data[offset:self.data.find(b'\0', offset)]
+
+    def _read_program_headers(self):
+        headers = []
+        for i in range(self.phnum):
+            offset = self.phoff + i * self.phentsize
+            if self.is64:
+                (p_type, p_flags, p_offset, p_vaddr, _, p_filesz, _, _) = self.unpack('IIQQQQQQ', offset)
+            else:
+                (p_type, p_offset, p_vaddr, _, p_filesz, _, p_flags, _) = self.unpack('IIIIIIII', offset)
+            headers.append(ProgramHeader(p_type, p_flags, p_offset, p_vaddr, p_filesz))
+        return headers
+
+    def _read_sections(self):
+        raw = []
+        for i in range(self.shnum):
+            offset = self.shoff + i * self.shentsize
+            if self.is64:
+                (name, typ, _, _, sh_offset, size, link, _, _, entsize) = self.unpack('IIQQQQIIQQ', offset)
+            else:
+                (name, typ, _, _, sh_offset, size, link, _, _, entsize) = self.unpack('IIIIIIIIII', offset)
+            raw.append((name, typ, sh_offset, size, link, entsize))
+        if not raw:
+            return []
+        names_offset = raw[self.shstrndx][2]
+        return [Section(self.cstring(names_offset + name), typ, sh_offset, size, link, entsize)
+                for (name, typ, sh_offset, size, link, entsize) in raw]
+
+    def vaddr_to_offset(self, vaddr):
+        for ph in self.program_headers:
+            if ph.type == PT_LOAD and ph.vaddr <= vaddr < ph.vaddr + ph.filesz:
+                return vaddr - ph.vaddr + ph.offset
+        raise ValueError('Address %x not in any loaded segment' % vaddr)
+
+    def dynamic(self):
+        '''Return the (tag, value) entries of the dynamic section'''
+        entries = []
+        for ph in self.program_headers:
+            if ph.type != PT_DYNAMIC:
+                continue
+            (fmt, size) = ('qQ', 16) if self.is64 else ('iI', 8)
+            for offset in range(ph.offset, ph.offset + ph.filesz - size + 1, size):
+                (tag, value) = self.unpack(fmt, offset)
+                if tag == DT_NULL:
+                    break
+                entries.append((tag, value))
+        return entries
+
+    def needed_libraries(self):
+        '''Return the names of the NEEDED libraries'''
+        dynamic = self.dynamic()
+        strtab = [value for (tag, value) in dynamic if tag == DT_STRTAB]
+        if not strtab:
+            return []
+        strtab_offset = self.vaddr_to_offset(strtab[0])
+        return [self.cstring(strtab_offset + value) for (tag, value) in dynamic if tag == DT_NEEDED]
+
+    def _version_names(self):
+        '''Map version index to version name, from the verneed and verdef sections'''
+        names = {}
+        for section in self.sections:
+            strtab = self.sections[section.link].offset
+            if section.type == SHT_GNU_verneed:
+                offset = section.offset
+                while True:
+                    (_, vn_cnt, _, vn_aux, vn_next) = self.unpack('HHIII', offset)
+                    aux = offset + vn_aux
+                    for _ in range(vn_cnt):
+                        (_, _, vna_other, vna_name, vna_next) = self.unpack('IHHII', aux)
+                        names[vna_other] = self.cstring(strtab + vna_name)
+                        aux += vna_next
+                    if vn_next == 0:
+                        break
+                    offset += vn_next
+            elif section.type == SHT_GNU_verdef:
+                offset = section.offset
+                while True:
+                    (_, _, vd_ndx, vd_cnt, _, vd_aux, vd_next) = self.unpack('HHHHIII', offset)
+                    if vd_cnt:
+                        (vda_name, _) = self.unpack('II', offset + vd_aux)
+                        names[vd_ndx] = self.cstring(strtab + vda_name)
+                    if vd_next == 0:
+                        break
+                    offset += vd_next
+        return names
+
+    def dynamic_symbols(self):
+        '''Return the named dynamic symbols'''
+        dynsym = [s for s in self.sections if s.type == SHT_DYNSYM]
+        if not dynsym:
+            return []
+        dynsym = dynsym[0]
+        strtab = self.sections[dynsym.link].offset
+        versym = [s for s in self.sections if s.type == SHT_GNU_versym]
+        version_names = self._version_names()
+        symbols = []
+        for i in range(dynsym.size // dynsym.entsize):
+            offset = dynsym.offset + i * dynsym.entsize
+            if self.is64:
+                (st_name, _, _, st_shndx, _, _) = self.unpack('IBBHQQ', offset)
+            else:
+                (st_name, _, _, _, _, st_shndx) = self.unpack('IIIBBH', offset)
+            name = self.cstring(strtab + st_name)
+            if not name:
+                continue
+            version = b''
+            if versym:
+                (ndx,) = self.unpack('H', versym[0].offset + 2 * i)
+                ndx &= 0x7fff # without the hidden bit
+                if ndx >= VER_NDX_NAMED:
+                    version = version_names.get(ndx, b'')
+            symbols.append(Symbol(name, version, st_shndx == SHN_UNDEF))
+        return symbols
@@ -6,113 +6,69 @@
 Perform basic ELF security checks on a series of executables.
 Exit status will be 0 if successful, and the program will be silent.
 Otherwise the exit status will be 1 and it will log which executables failed which checks.
-Needs `readelf` (for ELF) and `objdump` (for PE).
+ELF files are parsed directly (see elffile.py), PE files need `objdump`.
+Executables are checked in parallel.
 '''
 from __future__ import division,print_function,unicode_literals
+import multiprocessing
+import struct
 import subprocess
 import sys
 import os
 
-READELF_CMD = os.getenv('READELF', '/usr/bin/readelf')
+from elffile import ELFFile, ET_DYN, PT_GNU_STACK, PT_GNU_RELRO, PF_W, PF_X, DT_BIND_NOW, DT_FLAGS, DF_BIND_NOW
+
 OBJDUMP_CMD = os.getenv('OBJDUMP', '/usr/bin/objdump')
 NONFATAL = {'HIGH_ENTROPY_VA'} # checks which are non-fatal for now but only generate a warning
 
-def check_ELF_PIE(executable):
+def check_ELF_PIE(elf):
     '''
     Check for position independent executable (PIE), allowing for address space randomization.
     '''
-    p = subprocess.Popen([READELF_CMD, '-h', '-W', executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
+    return elf.type == ET_DYN
 
-    ok = False
-    for line in stdout.split(b'\n'):
-        line = line.split()
-        if len(line)>=2 and line[0] == b'Type:' and line[1] == b'DYN':
-            ok = True
-    return ok
-
-def get_ELF_program_headers(executable):
-    '''Return type and flags for ELF program headers'''
-    p = subprocess.Popen([READELF_CMD, '-l', '-W', executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    in_headers = False
-    count = 0
-    headers = []
-    for line in stdout.split(b'\n'):
-        if line.startswith(b'Program Headers:'):
-            in_headers = True
-        if line == b'':
-            in_headers = False
-        if in_headers:
-            if count == 1: # header line
-                ofs_typ = line.find(b'Type')
-                ofs_offset = line.find(b'Offset')
-                ofs_flags = line.find(b'Flg')
-                ofs_align = line.find(b'Align')
-                if ofs_typ == -1 or ofs_offset == -1 or ofs_flags == -1 or ofs_align  == -1:
-                    raise ValueError('Cannot parse elfread -lW output')
-            elif count > 1:
-                typ = line[ofs_typ:ofs_offset].rstrip()
-                flags = line[ofs_flags:ofs_align].rstrip()
-                headers.append((typ, flags))
-            count += 1
-    return headers
-
-def check_ELF_NX(executable):
+def check_ELF_NX(elf):
     '''
     Check that no sections are writable and executable (including the stack)
     '''
     have_wx = False
     have_gnu_stack = False
-    for (typ, flags) in get_ELF_program_headers(executable):
-        if typ == b'GNU_STACK':
+    for ph in elf.program_headers:
+        if ph.type == PT_GNU_STACK:
             have_gnu_stack = True
-        if b'W' in flags and b'E' in flags: # section is both writable and executable
+        if (ph.flags & PF_W) and (ph.flags & PF_X): # section is both writable and executable
             have_wx = True
     return have_gnu_stack and not have_wx
 
-def check_ELF_RELRO(executable):
+def check_ELF_RELRO(elf):
     '''
     Check for read-only relocations.
     GNU_RELRO program header must exist
     Dynamic section must have BIND_NOW flag
     '''
     have_gnu_relro = False
-    for (typ, flags) in get_ELF_program_headers(executable):
+    for ph in elf.program_headers:
         # Note: not checking flags == 'R': here as linkers set the permission differently
         # This does not affect security: the permission flags of the GNU_RELRO program header are ignored, the PT_LOAD header determines the effective permissions.
         # However, the dynamic linker need to write to this area so these are RW.
         # Glibc itself takes care of mprotecting this area R after relocations are finished.
         # See also http://permalink.gmane.org/gmane.comp.gnu.binutils/71347
-        if typ == b'GNU_RELRO':
+        if ph.type == PT_GNU_RELRO:
             have_gnu_relro = True
 
     have_bindnow = False
-    p = subprocess.Popen([READELF_CMD, '-d', '-W', executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    for line in stdout.split(b'\n'):
-        tokens = line.split()
-        if len(tokens)>1 and tokens[1] == b'(BIND_NOW)' or (len(tokens)>2 and tokens[1] == b'(FLAGS)' and b'BIND_NOW' in tokens[2]):
+    for (tag, value) in elf.dynamic():
+        if tag == DT_BIND_NOW or (tag == DT_FLAGS and (value & DF_BIND_NOW)):
             have_bindnow = True
     return have_gnu_relro and have_bindnow
 
-def check_ELF_Canary(executable):
+def check_ELF_Canary(elf):
     '''
     Check for use of stack canary
     '''
-    p = subprocess.Popen([READELF_CMD, '--dyn-syms', '-W', executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
     ok = False
-    for line in stdout.split(b'\n'):
-        if b'__stack_chk_fail' in line:
+    for sym in elf.dynamic_symbols():
+        if b'__stack_chk_fail' in sym.name:
             ok = True
     return ok
 
@@ -178,7 +134,7 @@ CHECKS = {
 }
 
 def identify_executable(executable):
-    with open(filename, 'rb') as f:
+    with open(executable, 'rb') as f:
         magic = f.read(4)
     if magic.startswith(b'MZ'):
         return 'PE'
@@ -186,31 +142,54 @@ def identify_executable(executable):
         return 'ELF'
     return None
 
-if __name__ == '__main__':
-    retval = 0
-    for filename in sys.argv[1:]:
+def check_executable(filename):
+    '''
+    Run the checks on one executable. Returns the lines to print, and whether it
+    failed.
+    '''
+    try:
+        etype = identify_executable(filename)
+        if etype is None:
+            return (['%s: unknown format' % filename], True)
+
+        failed = []
+        warning = []
+        if etype == 'ELF':
+            subject = ELFFile(filename)
+        else:
+            subject = filename
         try:
-            etype = identify_executable(filename)
-            if etype is None:
-                print('%s: unknown format' % filename)
-                retval = 1
-                continue
-
-            failed = []
-            warning = []
             for (name, func) in CHECKS[etype]:
-                if not func(filename):
+                if not func(subject):
                     if name in NONFATAL:
                         warning.append(name)
                     else:
                         failed.append(name)
-            if failed:
-                print('%s: failed %s' % (filename, ' '.join(failed)))
-                retval = 1
-            if warning:
-                print('%s: warning %s' % (filename, ' '.join(warning)))
-        except IOError:
-            print('%s: cannot open' % filename)
+        finally:
+            if etype == 'ELF':
+                subject.close()
+        output = []
+        if failed:
+            output.append('%s: failed %s' % (filename, ' '.join(failed)))
+        if warning:
+            output.append('%s: warning %s' % (filename, ' '.join(warning)))
+        return (output, bool(failed))
+    except (IOError, ValueError, IndexError, struct.error):
+        # A truncated or malformed file only fails its own check
+        return (['%s: cannot open' % filename], True)
+
+if __name__ == '__main__':
+    retval = 0
+    filenames = sys.argv[1:]
+    if len(filenames) > 1:
+        pool = multiprocessing.Pool()
+        results = pool.map(check_executable, filenames)
+        pool.close()
+    else:
+        results = [check_executable(filename) for filename in filenames]
+    for (output, failed) in results:
+        for line in output:
+            print(line)
+        if failed:
             retval = 1
     exit(retval)
-
@@ -10,13 +10,18 @@ still compatible with the minimum supported Linux distribution versions.
 Example usage:
 
     find ../gitian-builder/build -type f -executable | xargs python contrib/devtools/symbol-check.py
+
+The executables are parsed directly (see elffile.py) and in parallel; the
+offending symbols of all of them are demangled with a single `c++filt` call.
 '''
 from __future__ import division, print_function, unicode_literals
+import multiprocessing
 import subprocess
-import re
 import sys
 import os
 
+from elffile import ELFFile
+
 # Debian 6.0.9 (Squeeze) has:
 #
 # - g++ version 4.4.5 (https://packages.debian.org/search?suite=default&section=all&arch=any&searchon=names&keywords=g%2B%2B)
@@ -49,7 +54,6 @@ MAX_VERSIONS = {
 IGNORE_EXPORTS = {
 b'_edata', b'_end', b'_init', b'__bss_start', b'_fini', b'_IO_stdin_used'
 }
-READELF_CMD = os.getenv('READELF', '/usr/bin/readelf')
 CPPFILT_CMD = os.getenv('CPPFILT', '/usr/bin/c++filt')
 # Allowed NEEDED libraries
 ALLOWED_LIBRARIES = {
@@ -71,45 +75,27 @@ b'libfreetype.so.6', # font parsing
 b'libdl.so.2' # programming interface to dynamic linker
 }
 
-class CPPFilt(object):
+def cppfilt(mangled):
     '''
-    Demangle C++ symbol names.
+    Demangle a list of C++ symbol names.
 
-    Use a pipe to the 'c++filt' command.
+    All names are passed to a single 'c++filt' process at once.
     '''
-    def __init__(self):
-        self.proc = subprocess.Popen(CPPFILT_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
-
-    def __call__(self, mangled):
-        self.proc.stdin.write(mangled + b'\n')
-        self.proc.stdin.flush()
-        return self.proc.stdout.readline().rstrip()
-
-    def close(self):
-        self.proc.stdin.close()
-        self.proc.stdout.close()
-        self.proc.wait()
+    if not mangled:
+        return []
+    p = subprocess.Popen(CPPFILT_CMD, stdin=subprocess.PIPE, stdout=subprocess.PIPE)
+    (stdout, _) = p.communicate(b'\n'.join(mangled) + b'\n')
+    demangled = stdout.split(b'\n')[:len(mangled)]
+    if p.returncode or len(demangled) != len(mangled):
+        raise IOError('Could not demangle symbols')
+    return demangled
 
-def read_symbols(executable, imports=True):
+def read_symbols(elf, imports=True):
     '''
-    Parse an ELF executable and return a list of (symbol,version) tuples
-    for dynamic, imported symbols.
+    Return a list of (symbol,version) tuples for dynamic, imported (or
+    exported) symbols of an ELFFile.
     '''
-    p = subprocess.Popen([READELF_CMD, '--dyn-syms', '-W', executable], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Could not read symbols for %s: %s' % (executable, stderr.strip()))
-    syms = []
-    for line in stdout.split(b'\n'):
-        line = line.split()
-        if len(line)>7 and re.match(b'[0-9]+:$', line[0]):
-            (sym, _, version) = line[7].partition(b'@')
-            is_import = line[6] == b'UND'
-            if version.startswith(b'@'):
-                version = version[1:]
-            if is_import == imports:
-                syms.append((sym, version))
-    return syms
+    return [(sym.name, sym.version) for sym in elf.dynamic_symbols() if sym.is_import == imports]
 
 def check_version(max_versions, version):
     if b'_' in version:
@@ -122,43 +108,50 @@ def check_version(max_versions, version):
         return False
     return ver <= max_versions[lib]
 
-def read_libraries(filename):
-    p = subprocess.Popen([READELF_CMD, '-d', '-W', filename], stdout=subprocess.PIPE, stderr=subprocess.PIPE, stdin=subprocess.PIPE)
-    (stdout, stderr) = p.communicate()
-    if p.returncode:
-        raise IOError('Error opening file')
-    libraries = []
-    for line in stdout.split(b'\n'):
-        tokens = line.split()
-        if len(tokens)>2 and tokens[1] == b'(NEEDED)':
-            match = re.match(b'^Shared library: \[(.*)\]$', b' '.join(tokens[2:]))
-            if match:
-                libraries.append(match.group(1))
-            else:
-                raise ValueError('Unparseable (NEEDED) specification')
-    return libraries
+def read_libraries(elf):
+    return elf.needed_libraries()
 
-if __name__ == '__main__':
-    cppfilt = CPPFilt()
-    retval = 0
-    for filename in sys.argv[1:]:
+def check_executable(filename):
+    '''
+    Check one executable. Returns a list of (format, symbol, version or
+    library) problems, where the symbol (to be demangled) may be None.
+    '''
+    problems = []
+    with ELFFile(filename) as elf:
         # Check imported symbols
-        for sym,version in read_symbols(filename, True):
+        for sym,version in read_symbols(elf, True):
             if version and not check_version(MAX_VERSIONS, version):
-                print('%s: symbol %s from unsupported version %s' % (filename, cppfilt(sym).decode('utf-8'), version.decode('utf-8')))
-                retval = 1
+                problems.append(('%s: symbol %s from unsupported version %s', sym, version))
         # Check exported symbols
-        for sym,version in read_symbols(filename, False):
+        for sym,version in read_symbols(elf, False):
             if sym in IGNORE_EXPORTS:
                 continue
-            print('%s: export of symbol %s not allowed' % (filename, cppfilt(sym).decode('utf-8')))
-            retval = 1
+            problems.append(('%s: export of symbol %s not allowed', sym, None))
         # Check dependency libraries
-        for library_name in read_libraries(filename):
+        for library_name in read_libraries(elf):
             if library_name not in ALLOWED_LIBRARIES:
-                print('%s: NEEDED library %s is not allowed' % (filename, library_name.decode('utf-8')))
-                retval = 1
+                problems.append(('%s: NEEDED library %s is not allowed', None, library_name))
+    return problems
 
-    exit(retval)
+if __name__ == '__main__':
+    retval = 0
+    filenames = sys.argv[1:]
+    if len(filenames) > 1:
+        pool = multiprocessing.Pool()
+        results = pool.map(check_executable, filenames)
+        pool.close()
+    else:
+        results = [check_executable(filename) for filename in filenames]
 
+    demangled = iter(cppfilt([sym for problems in results for (_, sym, _) in problems if sym is not None]))
+    for (filename, problems) in zip(filenames, results):
+        for (fmt, sym, detail) in problems:
+            args = [filename]
+            if sym is not None:
+                args.append(next(demangled).decode('utf-8'))
+            if detail is not None:
+                args.append(detail.decode('utf-8'))
+            print(fmt % tuple(args))
+            retval = 1
 
+    exit(retval)
@@ -16,7 +16,10 @@ import sys
 import hashlib
 import datetime
 import time
-from collections import namedtuple
+import mmap
+import multiprocessing
+import heapq
+from collections import namedtuple, OrderedDict
 from binascii import hexlify, unhexlify
 
 settings = {}
@@ -27,27 +30,6 @@ def hex_switchEndian(s):
 	pairList = [s[i:i+2].encode() for i in range(0, len(s), 2)]
 	return b''.join(pairList[::-1]).decode()
 
-def uint32(x):
-	return x & 0xffffffff
-
-def bytereverse(x):
-	return uint32(( ((x) << 24) | (((x) << 8) & 0x00ff0000) |
-		       (((x) >> 8) & 0x0000ff00) | ((x) >> 24) ))
-
-def bufreverse(in_buf):
-	out_words = []
-	for i in range(0, len(in_buf), 4):
-		word = struct.unpack('@I', in_buf[i:i+4])[0]
-		out_words.append(struct.pack('@I', bytereverse(word)))
-	return b''.join(out_words)
-
-def wordreverse(in_buf):
-	out_words = []
-	for i in range(0, len(in_buf), 4):
-		out_words.append(in_buf[i:i+4])
-	out_words.reverse()
-	return b''.join(out_words)
-
 def calc_hdr_hash(blk_hdr):
 	hash1 = hashlib.sha256()
 	hash1.update(blk_hdr)
@@ -60,11 +42,8 @@ def calc_hdr_hash(blk_hdr):
 	return hash2_o
 
 def calc_hash_str(blk_hdr):
-	hash = calc_hdr_hash(blk_hdr)
-	hash = bufreverse(hash)
-	hash = wordreverse(hash)
-	hash_str = hexlify(hash).decode('utf-8')
-	return hash_str
+	# Block hashes are displayed as the byte-reversed double SHA256
+	return hexlify(calc_hdr_hash(blk_hdr)[::-1]).decode('utf-8')
 
 def get_blk_dt(blk_hdr):
 	members = struct.unpack("<I", blk_hdr[68:68+4])
@@ -76,12 +55,22 @@ def get_blk_dt(blk_hdr):
 # When getting the list of block hashes, undo any byte reversals.
 def get_block_hashes(settings):
 	blkindex = []
-	f = open(settings['hashlist'], "r")
-	for line in f:
-		line = line.rstrip()
-		if settings['rev_hash_bytes'] == 'true':
-			line = hex_switchEndian(line)
-		blkindex.append(line)
+	if settings['hashlist_format'] == 'binary':
+		# 32 bytes per hash, as written by linearize-hashes with hashlist_format=binary
+		with open(settings['hashlist'], "rb") as f:
+			data = f.read()
+		for pos in range(0, len(data) - 31, 32):
+			blkhash = data[pos:pos+32]
+			if settings['rev_hash_bytes'] == 'true':
+				blkhash = blkhash[::-1]
+			blkindex.append(hexlify(blkhash).decode('utf-8'))
+	else:
+		f = open(settings['hashlist'], "r")
+		for line in f:
+			line = line.rstrip()
+			if settings['rev_hash_bytes'] == 'true':
+				line = hex_switchEndian(line)
+			blkindex.append(line)
 
 	print("Read " + str(len(blkindex)) + " hashes")
 
@@ -97,6 +86,64 @@ def mkblockmap(blkindex):
 # Block header and extent on disk
 BlockExtent = namedtuple('BlockExtent', ['fn', 'offset', 'inhdr', 'blkhdr', 'size'])
 
+# Number of input files kept open for fetching out-of-order blocks
+INPUT_HANDLES = 8
+
+# Extent index record: hash (as displayed), input file number, offset and size of the block data
+INDEX_RECORD = struct.Struct('<32sIII')
+
+def load_extent_index(fname):
+	'''
+	Read the extent index written by previous runs. Returns a map from block
+	hash to (fn, offset, size), and the input position just after the last
+	indexed block, where scanning has to continue.
+	'''
+	index = {}
+	scanStart = (0, 0)
+	if not os.path.exists(fname):
+		return (index, scanStart)
+	with open(fname, "r+b") as f:
+		data = f.read()
+		# Drop a partial record left by an interrupted run
+		end = len(data) - len(data) % INDEX_RECORD.size
+		if end != len(data):
+			f.truncate(end)
+	for pos in range(0, end, INDEX_RECORD.size):
+		(blkhash, fn, offset, size) = INDEX_RECORD.unpack_from(data, pos)
+		index[hexlify(blkhash).decode('utf-8')] = (fn, offset, size)
+		scanStart = (fn, offset + size)
+	return (index, scanStart)
+
+def scan_block_file(args):
+	'''
+	Find the blocks in one input file, from offset start on. Runs in a worker
+	process. Returns (fn, [(hash_str, extent)], invalid_magic), where
+	invalid_magic is the first non-zero, non-matching magic found, if any.
+	'''
+	(fn, fname, netmagic, start) = args
+	blocks = []
+	with open(fname, "rb") as f:
+		size = os.fstat(f.fileno()).st_size
+		if size == 0:
+			return (fn, blocks, None)
+		data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+	try:
+		pos = start
+		while pos + 8 + 80 <= size:
+			inhdr = data[pos:pos+8]
+			if inhdr[:4] != netmagic:
+				# Files are preallocated, so zeroes mark the end of the data
+				if inhdr[:4] != b'\0\0\0\0':
+					return (fn, blocks, inhdr[:4])
+				break
+			inLen = struct.unpack("<I", inhdr[4:])[0] - 80 # length without header
+			blk_hdr = data[pos+8:pos+8+80]
+			blocks.append((calc_hash_str(blk_hdr), BlockExtent(fn, pos+8+80, inhdr, blk_hdr, inLen)))
+			pos += 8 + 80 + inLen
+	finally:
+		data.close()
+	return (fn, blocks, None)
+
 class BlockDataCopier:
 	def __init__(self, settings, blkindex, blkmap):
 		self.settings = settings
@@ -128,6 +175,17 @@ class BlockDataCopier:
 		self.blockExtents = {}
 		self.outOfOrderData = {}
 		self.outOfOrderSize = 0 # running total size for items in outOfOrderData
+		self.outOfOrderHeap = [] # negated heights in outOfOrderData, furthest first; may hold stale entries
+		self.inFiles = OrderedDict() # open input files for fetchBlock, least recently used first
+		# Out-of-order cache statistics
+		self.cacheHits = 0
+		self.cacheMisses = 0
+		self.cacheEvictions = 0
+		self.bytesReRead = 0
+		# Extents of blocks seen by previous runs, and where to continue scanning
+		self.extentIndex = None
+		self.indexF = None
+		self.scanStart = (0, 0)
 
 	def writeBlock(self, inhdr, blk_hdr, rawblock):
 		blockSizeOnDisk = len(inhdr) + len(blk_hdr) + len(rawblock)
@@ -154,10 +212,7 @@ class BlockDataCopier:
 				self.outsz = 0
 
 		if not self.outF:
-			if self.fileOutput:
-				self.outFname = self.settings['output_file']
-			else:
-				self.outFname = os.path.join(self.settings['output'], "blk%05d.dat" % self.outFn)
+			self.outFname = self.outFileName(self.outFn)
 			print("Output file " + self.outFname)
 			self.outF = open(self.outFname, "wb")
 
@@ -177,25 +232,259 @@ class BlockDataCopier:
 	def inFileName(self, fn):
 		return os.path.join(self.settings['input'], "blk%05d.dat" % fn)
 
+	def inputFile(self, fn):
+		'''Return an open handle on input file fn, from a small pool of recently used ones'''
+		f = self.inFiles.pop(fn, None)
+		if f is None:
+			if len(self.inFiles) >= INPUT_HANDLES:
+				self.inFiles.popitem(last=False)[1].close()
+			f = open(self.inFileName(fn), "rb")
+		self.inFiles[fn] = f
+		return f
+
 	def fetchBlock(self, extent):
 		'''Fetch block contents from disk given extents'''
-		with open(self.inFileName(extent.fn), "rb") as f:
-			f.seek(extent.offset)
-			return f.read(extent.size)
+		f = self.inputFile(extent.fn)
+		f.seek(extent.offset)
+		self.bytesReRead += extent.size
+		return f.read(extent.size)
+
+	def makeRoom(self, blkHeight, size):
+		'''
+		Make room for caching size bytes of the block at blkHeight, by evicting
+		cached blocks that are needed later than it. Returns whether it fits.
+		'''
+		limit = self.settings['out_of_order_cache_sz']
+		heap = self.outOfOrderHeap
+		while self.outOfOrderSize + size > limit and self.outOfOrderData:
+			furthest = -heap[0]
+			if not furthest in self.outOfOrderData:
+				heapq.heappop(heap) # taken from the cache already
+				continue
+			if furthest < blkHeight:
+				break
+			heapq.heappop(heap)
+			self.outOfOrderSize -= len(self.outOfOrderData.pop(furthest))
+			self.cacheEvictions += 1
+		return self.outOfOrderSize + size <= limit
+
+	def storeBlock(self, blkHeight, rawblock):
+		'''Add a block to the cache, which makeRoom() must have made room for'''
+		self.outOfOrderData[blkHeight] = rawblock
+		self.outOfOrderSize += len(rawblock)
+		heapq.heappush(self.outOfOrderHeap, -blkHeight)
+
+	def takeBlock(self, blkHeight):
+		'''Remove a block from the cache and return its data'''
+		rawblock = self.outOfOrderData.pop(blkHeight)
+		self.outOfOrderSize -= len(rawblock)
+		# Blocks are mostly taken in order, from the bottom of the heap, so
+		# their entries are only dropped by rebuilding it once they dominate
+		if len(self.outOfOrderHeap) > 2 * len(self.outOfOrderData) + 64:
+			self.outOfOrderHeap = [-h for h in self.outOfOrderData]
+			heapq.heapify(self.outOfOrderHeap)
+		return rawblock
+
+	def cacheBlock(self, blkHeight, rawblock):
+		if self.makeRoom(blkHeight, len(rawblock)):
+			self.storeBlock(blkHeight, rawblock)
+
+	def readAhead(self):
+		'''
+		Fetch the block to be written next together with the uncached blocks
+		that directly follow it, in file order, so that a run of blocks the
+		cache could not hold costs one pass over the input instead of a seek
+		per block. Returns the data of the next block; the others are cached.
+		'''
+		extent = self.blockExtents[self.blkCountOut]
+		pending = [(extent.fn, extent.offset, self.blkCountOut)]
+		# read_ahead_sz only limits the blocks fetched in addition to it
+		total = 0
+		blkHeight = self.blkCountOut + 1
+		while blkHeight in self.blockExtents and total < self.settings['read_ahead_sz']:
+			if not blkHeight in self.outOfOrderData:
+				extent = self.blockExtents[blkHeight]
+				pending.append((extent.fn, extent.offset, blkHeight))
+				total += extent.size
+			blkHeight += 1
+
+		rawblock = None
+		for (fn, offset, blkHeight) in sorted(pending):
+			data = self.fetchBlock(self.blockExtents[blkHeight])
+			if blkHeight == self.blkCountOut:
+				rawblock = data
+			else:
+				self.cacheBlock(blkHeight, data)
+		return rawblock
 
 	def copyOneBlock(self):
 		'''Find the next block to be written in the input, and copy it to the output.'''
-		extent = self.blockExtents.pop(self.blkCountOut)
 		if self.blkCountOut in self.outOfOrderData:
 			# If the data is cached, use it from memory and remove from the cache
-			rawblock = self.outOfOrderData.pop(self.blkCountOut)
-			self.outOfOrderSize -= len(rawblock)
+			rawblock = self.takeBlock(self.blkCountOut)
+			self.cacheHits += 1
 		else: # Otherwise look up data on disk
-			rawblock = self.fetchBlock(extent)
+			rawblock = self.readAhead()
+			self.cacheMisses += 1
+		extent = self.blockExtents.pop(self.blkCountOut)
 
 		self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
 
+	def printStats(self):
+		lookups = self.cacheHits + self.cacheMisses
+		print("Out-of-order cache: %i hits, %i misses (%.1f%% hit rate), %i evictions, %i bytes re-read" %
+				(self.cacheHits, self.cacheMisses, 100.0 * self.cacheHits / lookups if lookups else 0.0,
+				 self.cacheEvictions, self.bytesReRead))
+
+	def processBlock(self, hash_str, extent, inF):
+		'''
+		Handle a block found in the input. inF must be positioned at the
+		start of the block data, and is left positioned after it.
+		'''
+		self.hash_str = hash_str
+		if self.indexF:
+			self.indexF.write(INDEX_RECORD.pack(unhexlify(hash_str), extent.fn, extent.offset, extent.size))
+
+		if not hash_str in self.blkmap:
+			# Because blocks can be written to files out-of-order as of 0.10, the script
+			# may encounter blocks it doesn't know about. Treat as debug output.
+			if self.settings['debug_output'] == 'true':
+				print("Skipping unknown block " + hash_str)
+			inF.seek(extent.size, os.SEEK_CUR)
+			return
+
+		blkHeight = self.blkmap[hash_str]
+		self.blkCountIn += 1
+
+		if blkHeight < self.blkCountOut:
+			# Already written, by a previous run
+			inF.seek(extent.size, os.SEEK_CUR)
+
+		elif self.blkCountOut == blkHeight:
+			# If in-order block, just copy
+			rawblock = inF.read(extent.size)
+			self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
+
+			# See if we can catch up to prior out-of-order blocks
+			while self.blkCountOut in self.blockExtents:
+				self.copyOneBlock()
+
+		else: # If out-of-order, skip over block data for now
+			self.blockExtents[blkHeight] = extent
+			if self.makeRoom(blkHeight, extent.size):
+				# If there is space in the cache, read the data
+				# Reading the data in file sequence instead of seeking and fetching it later is preferred,
+				# but we don't want to fill up memory
+				self.storeBlock(blkHeight, inF.read(extent.size))
+			else: # If no space in cache, seek forward
+				inF.seek(extent.size, os.SEEK_CUR)
+
+	def outFileName(self, fn):
+		if self.fileOutput:
+			return self.settings['output_file']
+		return os.path.join(self.settings['output'], "blk%05d.dat" % fn)
+
+	def resumeOutput(self):
+		'''
+		Skip the blocks a previous run has already written: walk the output
+		files while they contain the expected blocks in order, cut off
+		whatever follows, and append to the last file from there.
+		'''
+		fn = 0
+		lastFname = None
+		while os.path.exists(self.outFileName(fn)):
+			fname = self.outFileName(fn)
+			with open(fname, "r+b") as f:
+				fileSize = os.fstat(f.fileno()).st_size
+				pos = 0
+				while pos + 8 + 80 <= fileSize and self.blkCountOut < len(self.blkindex):
+					f.seek(pos)
+					inhdr = f.read(8)
+					blk_hdr = f.read(80)
+					size = struct.unpack("<I", inhdr[4:])[0] + 8
+					if (inhdr[:4] != self.settings['netmagic'] or pos + size > fileSize or
+							calc_hash_str(blk_hdr) != self.blkindex[self.blkCountOut]):
+						break
+					(blkDate, blkTS) = get_blk_dt(blk_hdr)
+					if self.timestampSplit and blkDate > self.lastDate:
+						self.lastDate = blkDate
+					if blkTS > self.highTS:
+						self.highTS = blkTS
+					self.blkCountOut += 1
+					pos += size
+				if pos < fileSize:
+					f.truncate(pos)
+			self.outFn = fn
+			self.outsz = pos
+			lastFname = fname
+			if pos < fileSize or self.fileOutput:
+				break
+			fn += 1
+
+		if lastFname is not None:
+			print("Resuming output file " + lastFname + " at height %i" % self.blkCountOut)
+			self.outFname = lastFname
+			self.outF = open(lastFname, "ab")
+
+	def readIndexedExtent(self, hash_str, entry):
+		'''Locate a block found by a previous run, checking its header. Returns the extent.'''
+		(fn, offset, size) = entry
+		f = self.inputFile(fn)
+		f.seek(offset - 80)
+		blk_hdr = f.read(80)
+		if calc_hash_str(blk_hdr) != hash_str:
+			self.indexMismatch()
+		inhdr = self.settings['netmagic'] + struct.pack("<I", size + 80)
+		return BlockExtent(fn, offset, inhdr, blk_hdr, size)
+
+	def indexMismatch(self):
+		print("Extent index " + self.settings['index_file'] + " does not match the input files, remove it and try again")
+		sys.exit(1)
+
+	def copyIndexedBlocks(self):
+		'''
+		Write out the blocks in the extent index, for as long as they are in
+		order. The input after the last indexed block is scanned as usual.
+		'''
+		while self.blkCountOut < len(self.blkindex):
+			self.hash_str = self.blkindex[self.blkCountOut]
+			if not self.hash_str in self.extentIndex:
+				break
+			extent = self.readIndexedExtent(self.hash_str, self.extentIndex[self.hash_str])
+			rawblock = self.inputFile(extent.fn).read(extent.size)
+			if len(rawblock) != extent.size:
+				self.indexMismatch()
+			self.writeBlock(extent.inhdr, extent.blkhdr, rawblock)
+
+		# Indexed blocks past the first gap will not be scanned again; their
+		# data is fetched by readAhead() once they are due
+		for (hash_str, entry) in self.extentIndex.items():
+			blkHeight = self.blkmap.get(hash_str)
+			if blkHeight is not None and blkHeight > self.blkCountOut:
+				self.blockExtents[blkHeight] = self.readIndexedExtent(hash_str, entry)
+		self.extentIndex = None
+
+	def prepare(self):
+		'''Pick up the work of previous runs, as far as configured'''
+		if self.settings['resume'] == 'true':
+			self.resumeOutput()
+		if 'index_file' in self.settings:
+			(self.extentIndex, self.scanStart) = load_extent_index(self.settings['index_file'])
+			print("Extent index " + self.settings['index_file'] + ": %i blocks" % len(self.extentIndex))
+			self.copyIndexedBlocks()
+			self.indexF = open(self.settings['index_file'], "ab")
+
+	def close(self):
+		for f in self.inFiles.values():
+			f.close()
+		self.inFiles.clear()
+		if self.indexF:
+			self.indexF.close()
+			self.indexF = None
+
 	def run(self):
+		self.prepare()
+		self.inFn = self.scanStart[0]
 		while self.blkCountOut < len(self.blkindex):
 			if not self.inF:
 				fname = self.inFileName(self.inFn)
@@ -205,9 +494,11 @@ class BlockDataCopier:
 				except IOError:
 					print("Premature end of block data")
 					return
+				if self.inFn == self.scanStart[0]:
+					self.inF.seek(self.scanStart[1])
 
 			inhdr = self.inF.read(8)
-			if (not inhdr or (inhdr[0] == "\0")):
+			if (not inhdr or (inhdr[:1] == b"\0")):
 				self.inF.close()
 				self.inF = None
 				self.inFn = self.inFn + 1
@@ -223,38 +514,47 @@ class BlockDataCopier:
 			blk_hdr = self.inF.read(80)
 			inExtent = BlockExtent(self.inFn, self.inF.tell(), inhdr, blk_hdr, inLen)
 
-			self.hash_str = calc_hash_str(blk_hdr)
-			if not self.hash_str in blkmap:
-				# Because blocks can be written to files out-of-order as of 0.10, the script
-				# may encounter blocks it doesn't know about. Treat as debug output.
-				if settings['debug_output'] == 'true':
-					print("Skipping unknown block " + self.hash_str)
-				self.inF.seek(inLen, os.SEEK_CUR)
-				continue
+			self.processBlock(calc_hash_str(blk_hdr), inExtent, self.inF)
+
+		self.printStats()
+		print("Done (%i blocks written)" % (self.blkCountOut))
 
-			blkHeight = self.blkmap[self.hash_str]
-			self.blkCountIn += 1
-
-			if self.blkCountOut == blkHeight:
-				# If in-order block, just copy
-				rawblock = self.inF.read(inLen)
-				self.writeBlock(inhdr, blk_hdr, rawblock)
-
-				# See if we can catch up to prior out-of-order blocks
-				while self.blkCountOut in self.blockExtents:
-					self.copyOneBlock()
-
-			else: # If out-of-order, skip over block data for now
-				self.blockExtents[blkHeight] = inExtent
-				if self.outOfOrderSize < self.settings['out_of_order_cache_sz']:
-					# If there is space in the cache, read the data
-					# Reading the data in file sequence instead of seeking and fetching it later is preferred,
-					# but we don't want to fill up memory
-					self.outOfOrderData[blkHeight] = self.inF.read(inLen)
-					self.outOfOrderSize += inLen
-				else: # If no space in cache, seek forward
-					self.inF.seek(inLen, os.SEEK_CUR)
+	def inputFiles(self):
+		(fn, start) = self.scanStart
+		while os.path.exists(self.inFileName(fn)):
+			yield (fn, self.inFileName(fn), self.settings['netmagic'], start)
+			fn += 1
+			start = 0
+
+	def runParallel(self):
+		'''
+		Like run(), but block headers are located and hashed by a pool of
+		worker processes, one input file per task, while this process writes
+		the blocks out in order as the results come in.
+		'''
+		self.prepare()
+		pool = multiprocessing.Pool(self.settings['scan_workers'])
+		try:
+			for (fn, blocks, invalidMagic) in pool.imap(scan_block_file, self.inputFiles()):
+				print("Input file " + self.inFileName(fn))
+				with open(self.inFileName(fn), "rb") as inF:
+					for (hash_str, extent) in blocks:
+						inF.seek(extent.offset)
+						self.processBlock(hash_str, extent, inF)
+
+				if invalidMagic is not None:
+					print("Invalid magic: " + hexlify(invalidMagic).decode('utf-8'))
+					return
+				if self.blkCountOut >= len(self.blkindex):
+					break
+			else:
+				if self.blkCountOut < len(self.blkindex):
+					print("Premature end of block data")
+					return
+		finally:
+			pool.terminate()
 
+		self.printStats()
 		print("Done (%i blocks written)" % (self.blkCountOut))
 
 if __name__ == '__main__':
@@ -290,6 +590,8 @@ if __name__ == '__main__':
 		settings['input'] = 'input'
 	if 'hashlist' not in settings:
 		settings['hashlist'] = 'hashlist.txt'
+	if 'hashlist_format' not in settings:
+		settings['hashlist_format'] = 'hex'
 	if 'file_timestamp' not in settings:
 		settings['file_timestamp'] = 0
 	if 'split_timestamp' not in settings:
@@ -300,13 +602,23 @@ if __name__ == '__main__':
 		settings['out_of_order_cache_sz'] = 100 * 1000 * 1000
 	if 'debug_output' not in settings:
 		settings['debug_output'] = 'false'
+	if 'read_ahead_sz' not in settings:
+		settings['read_ahead_sz'] = 10 * 1000 * 1000
+	if 'scan_workers' not in settings:
+		settings['scan_workers'] = 0
+	if 'resume' not in settings:
+		settings['resume'] = 'false'
 
 	settings['max_out_sz'] = int(settings['max_out_sz'])
 	settings['split_timestamp'] = int(settings['split_timestamp'])
 	settings['file_timestamp'] = int(settings['file_timestamp'])
 	settings['netmagic'] = unhexlify(settings['netmagic'].encode('utf-8'))
 	settings['out_of_order_cache_sz'] = int(settings['out_of_order_cache_sz'])
+	settings['read_ahead_sz'] = int(settings['read_ahead_sz'])
 	settings['debug_output'] = settings['debug_output'].lower()
+	settings['hashlist_format'] = settings['hashlist_format'].lower()
+	settings['scan_workers'] = int(settings['scan_workers'])
+	settings['resume'] = settings['resume'].lower()
 
 	if 'output_file' not in settings and 'output' not in settings:
 		print("Missing output file / directory")
@@ -319,4 +631,11 @@ if __name__ == '__main__':
 	if not settings['genesis'] in blkmap:
 		print("Genesis block not found in hashlist")
 	else:
-		BlockDataCopier(settings, blkindex, blkmap).run()
+		copier = BlockDataCopier(settings, blkindex, blkmap)
+		try:
+			if settings['scan_workers'] > 0:
+				copier.runParallel()
+			else:
+				copier.run()
+		finally:
+			copier.close()
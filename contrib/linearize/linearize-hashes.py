@@ -12,19 +12,19 @@ try: # Python 3
     import http.client as httplib
 except ImportError: # Python 2
     import httplib
+try: # Python 3
+    import queue
+except ImportError: # Python 2
+    import Queue as queue
 import json
 import re
 import base64
 import sys
+import threading
+from binascii import hexlify, unhexlify
 
 settings = {}
 
-##### Switch endian-ness #####
-def hex_switchEndian(s):
-	""" Switches the endianness of a hex string (in pairs of hex chars) """
-	pairList = [s[i:i+2].encode() for i in range(0, len(s), 2)]
-	return b''.join(pairList[::-1]).decode()
-
 class BitcoinRPC:
 	def __init__(self, host, port, username, password):
 		authpair = "%s:%s" % (username, password)
@@ -66,33 +66,97 @@ class BitcoinRPC:
 	def response_is_error(resp_obj):
 		return 'error' in resp_obj and resp_obj['error'] is not None
 
-def get_block_hashes(settings, max_blocks_per_call=10000):
-	rpc = BitcoinRPC(settings['host'], settings['port'],
-			 settings['rpcuser'], settings['rpcpassword'])
+def fetch_batch(rpc, height, num_blocks):
+	'''
+	Fetch the hashes of num_blocks blocks from height on. Returns the list of
+	raw hashes (as displayed, i.e. in getblockhash order), or an error message.
+	'''
+	batch = []
+	for x in range(num_blocks):
+		batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
+
+	reply = rpc.execute(batch)
+	if reply is None:
+		return 'Cannot continue. Program will halt.'
+
+	hashes = []
+	for x,resp_obj in enumerate(reply):
+		if rpc.response_is_error(resp_obj):
+			return 'JSON-RPC: error at height %i: %s' % (height+x, resp_obj['error'])
+		assert(resp_obj['id'] == x) # assume replies are in-sequence
+		hashes.append(unhexlify(resp_obj['result']))
+	return hashes
 
+def get_block_hashes(settings, max_blocks_per_call=10000):
+	'''
+	Fetch the hashes of blocks min_height to max_height and write them to
+	stdout in height order. The range is split into batches, which are
+	fetched by rpc_connections threads with a connection each, so that
+	several batches are in flight at once; finished batches are written out
+	as soon as all earlier ones are.
+	'''
+	num_workers = settings['rpc_connections']
+	pending = queue.Queue()
 	height = settings['min_height']
 	while height < settings['max_height']+1:
 		num_blocks = min(settings['max_height']+1-height, max_blocks_per_call)
-		batch = []
-		for x in range(num_blocks):
-			batch.append(rpc.build_request(x, 'getblockhash', [height + x]))
-
-		reply = rpc.execute(batch)
-		if reply is None:
-			print('Cannot continue. Program will halt.')
-			return None
-
-		for x,resp_obj in enumerate(reply):
-			if rpc.response_is_error(resp_obj):
-				print('JSON-RPC: error at height', height+x, ': ', resp_obj['error'], file=sys.stderr)
-				exit(1)
-			assert(resp_obj['id'] == x) # assume replies are in-sequence
-			if settings['rev_hash_bytes'] == 'true':
-				resp_obj['result'] = hex_switchEndian(resp_obj['result'])
-			print(resp_obj['result'])
-
+		pending.put((height, num_blocks))
 		height += num_blocks
 
+	results = {}
+	results_cv = threading.Condition()
+	# Keep workers from getting too far ahead of the writer
+	window = threading.Semaphore(2 * num_workers)
+
+	def worker():
+		rpc = BitcoinRPC(settings['host'], settings['port'],
+				 settings['rpcuser'], settings['rpcpassword'])
+		while True:
+			window.acquire()
+			try:
+				(height, num_blocks) = pending.get_nowait()
+			except queue.Empty:
+				return
+			try:
+				hashes = fetch_batch(rpc, height, num_blocks)
+			except Exception as e:
+				hashes = 'Error fetching heights %i-%i: %r' % (height, height+num_blocks-1, e)
+			with results_cv:
+				results[height] = hashes
+				results_cv.notify()
+
+	workers = []
+	for _ in range(num_workers):
+		t = threading.Thread(target=worker)
+		t.daemon = True
+		t.start()
+		workers.append(t)
+
+	out = getattr(sys.stdout, 'buffer', sys.stdout)
+	height = settings['min_height']
+	while height < settings['max_height']+1:
+		with results_cv:
+			while height not in results:
+				if not any(t.is_alive() for t in workers):
+					# Only if a worker died unexpectedly
+					results[height] = 'Batch at height %i was not fetched' % height
+					break
+				results_cv.wait(1)
+			hashes = results.pop(height)
+		window.release()
+		if not isinstance(hashes, list):
+			print(hashes, file=sys.stderr)
+			sys.exit(1)
+
+		if settings['rev_hash_bytes'] == 'true':
+			hashes = [h[::-1] for h in hashes]
+		if settings['hashlist_format'] == 'binary':
+			out.write(b''.join(hashes))
+		else:
+			out.write(b''.join(hexlify(h) + b'\n' for h in hashes))
+		height += len(hashes)
+	out.flush()
+
 if __name__ == '__main__':
 	if len(sys.argv) != 2:
 		print("Usage: linearize-hashes.py CONFIG-FILE")
@@ -122,13 +186,19 @@ if __name__ == '__main__':
 		settings['max_height'] = 313000
 	if 'rev_hash_bytes' not in settings:
 		settings['rev_hash_bytes'] = 'false'
+	if 'rpc_connections' not in settings:
+		settings['rpc_connections'] = 4
+	if 'hashlist_format' not in settings:
+		settings['hashlist_format'] = 'hex'
 	if 'rpcuser' not in settings or 'rpcpassword' not in settings:
-		print("Missing username and/or password in cfg file", file=stderr)
+		print("Missing username and/or password in cfg file", file=sys.stderr)
 		sys.exit(1)
 
 	settings['port'] = int(settings['port'])
 	settings['min_height'] = int(settings['min_height'])
 	settings['max_height'] = int(settings['max_height'])
+	settings['rpc_connections'] = int(settings['rpc_connections'])
+	settings['hashlist_format'] = settings['hashlist_format'].lower()
 
 	# Force hash byte format setting to be lowercase to make comparisons easier.
 	settings['rev_hash_bytes'] = settings['rev_hash_bytes'].lower()
@@ -12,6 +12,10 @@ MAX_SEEDS_PER_ASN=2
 
 MIN_BLOCKS = 337600
 
+# Number of the most available IPv4/IPv6 (and, separately, onion) nodes kept
+# as candidates for the ASN filter while reading the dump
+MAX_CANDIDATES = 16 * NSEEDS
+
 # These are hosts that have been observed to be behaving strangely (e.g.
 # aggressively connecting to every node).
 SUSPICIOUS_HOSTS = {
@@ -22,16 +26,32 @@ SUSPICIOUS_HOSTS = {
     "54.94.195.96", "54.94.200.247"
 }
 
+import argparse
+import bisect
+import collections
+import concurrent.futures
+import heapq
+import ipaddress
+import json
+import os
 import re
 import sys
-import dns.resolver
-import collections
+
+try:
+    import dns.exception
+    import dns.resolver
+except ImportError: # only needed for DNS lookups, not with --asn-table
+    dns = None
 
 PATTERN_IPV4 = re.compile(r"^((\d{1,3})\.(\d{1,3})\.(\d{1,3})\.(\d{1,3})):(\d+)$")
 PATTERN_IPV6 = re.compile(r"^\[([0-9a-z:]+)\]:(\d+)$")
 PATTERN_ONION = re.compile(r"^([abcdefghijklmnopqrstuvwxyz234567]{16}\.onion):(\d+)$")
 PATTERN_AGENT = re.compile(r"^(/Satoshi:0.12.(0|1|99)/|/Satoshi:0.13.(0|1|2|99)/)$")
 
+# One parsed line of the seeder dump
+Seed = collections.namedtuple('Seed', ['net', 'ip', 'port', 'ipnum', 'uptime', 'lastsuccess',
+                                       'version', 'agent', 'service', 'blocks', 'sortkey'])
+
 def parseline(line):
     sline = line.split()
     if len(sline) < 11:
@@ -85,88 +105,216 @@ def parseline(line):
     # Extract blocks.
     blocks = int(sline[8])
     # Construct result.
-    return {
-        'net': net,
-        'ip': ipstr,
-        'port': port,
-        'ipnum': ip,
-        'uptime': uptime30,
-        'lastsuccess': lastsuccess,
-        'version': version,
-        'agent': agent,
-        'service': service,
-        'blocks': blocks,
-        'sortkey': sortkey,
-    }
-
-def filtermultiport(ips):
-    '''Filter out hosts with more nodes per IP'''
-    hist = collections.defaultdict(list)
-    for ip in ips:
-        hist[ip['sortkey']].append(ip)
-    return [value[0] for (key,value) in list(hist.items()) if len(value)==1]
+    return Seed(net, ipstr, port, ip, uptime30, lastsuccess, version, agent, service, blocks, sortkey)
+
+def is_good(ip):
+    '''Whether a parsed seed passes all filters that apply to it on its own'''
+    return (ip.blocks >= MIN_BLOCKS and # Enforce minimal number of blocks.
+            (ip.service & 1) == 1 and # Require service bit 1.
+            ip.uptime > 50 and # Require at least 50% 30-day uptime.
+            ip.ip not in SUSPICIOUS_HOSTS and # Skip entries from suspicious hosts.
+            PATTERN_AGENT.match(ip.agent)) # Require a known and recent user agent.
+
+def select_candidates(ips, max_candidates):
+    '''
+    Keep the max_candidates most available IPv4/IPv6 seeds and onion seeds
+    of the stream ips, sorted by availability (using last success as tie
+    breaker), and filter out hosts with multiple bitcoin ports, as these are
+    likely abusive. Memory use is bounded by max_candidates, apart from one
+    counter per host.
+    '''
+    ports = collections.Counter()
+    heaps = {'ipv46': [], 'onion': []}
+    for seq, ip in enumerate(ips):
+        ports[ip.sortkey] += 1
+        heap = heaps['onion' if ip.net == 'onion' else 'ipv46']
+        # -seq keeps the order of the input among equals, like a stable sort
+        entry = ((ip.uptime, ip.lastsuccess, ip.ip), -seq, ip)
+        if len(heap) < max_candidates:
+            heapq.heappush(heap, entry)
+        else:
+            heapq.heappushpop(heap, entry)
+    entries = sorted(heaps['ipv46'] + heaps['onion'], reverse=True)
+    return [ip for (_, _, ip) in entries if ports[ip.sortkey] == 1]
+
+class PrefixTable(object):
+    '''
+    Longest-prefix match from IP address to origin ASN, loaded from prefix to
+    AS files in the CAIDA routeviews pfx2as format (one "prefix length asn"
+    line per route, IPv4 and IPv6 alike). The nested prefixes are flattened
+    into disjoint sorted ranges, so a lookup is a single binary search.
+    '''
+    def __init__(self):
+        self.starts = {4: [], 6: []}
+        self.ends = {4: [], 6: []}
+        self.asns = {4: [], 6: []}
+
+    @classmethod
+    def load(cls, filenames):
+        prefixes = {4: [], 6: []}
+        for filename in filenames:
+            with open(filename, encoding='utf8') as f:
+                for line in f:
+                    fields = line.split()
+                    if len(fields) < 3 or fields[0].startswith('#'):
+                        continue
+                    net = ipaddress.ip_network('%s/%s' % (fields[0], fields[1]), strict=False)
+                    # Multi-origin prefixes ("a_b") and AS sets ("a,b"): use the first
+                    asn = int(re.split('[_,]', fields[2])[0])
+                    prefixes[net.version].append((int(net.network_address), int(net.broadcast_address), asn))
+        table = cls()
+        for version, entries in prefixes.items():
+            table._flatten(version, entries)
+        return table
+
+    def _flatten(self, version, prefixes):
+        starts, ends, asns = self.starts[version], self.ends[version], self.asns[version]
+        def emit(start, end, asn):
+            starts.append(start)
+            ends.append(end)
+            asns.append(asn)
+        # Sorted by start, enclosing prefixes first. CIDR prefixes either
+        # nest or are disjoint, so the enclosing ones form a stack.
+        stack = []
+        pos = 0 # first address not yet assigned to a range
+        for (start, end, asn) in sorted(prefixes, key=lambda p: (p[0], -p[1])) + [(None, None, None)]:
+            while stack and (start is None or stack[-1][0] < start):
+                (outer_end, outer_asn) = stack.pop()
+                if pos <= outer_end:
+                    emit(pos, outer_end, outer_asn)
+                    pos = outer_end + 1
+            if start is None:
+                break
+            if stack and pos < start:
+                emit(pos, start - 1, stack[-1][1])
+            pos = start
+            stack.append((end, asn))
+
+    def __len__(self):
+        return len(self.asns[4]) + len(self.asns[6])
+
+    def lookup(self, ip):
+        '''Return the origin ASN for the address string ip, or None'''
+        addr = ipaddress.ip_address(ip)
+        num = int(addr)
+        i = bisect.bisect_right(self.starts[addr.version], num) - 1
+        if i >= 0 and num <= self.ends[addr.version][i]:
+            return self.asns[addr.version][i]
+        return None
+
+def lookup_asn_dns(ip):
+    '''Look up the origin ASN of the address string ip with Team Cymru's DNS service'''
+    addr = ipaddress.ip_address(ip)
+    if addr.version == 4:
+        name = '.'.join(reversed(ip.split('.'))) + '.origin.asn.cymru.com'
+    else:
+        name = '.'.join(reversed(addr.exploded.replace(':', ''))) + '.origin6.asn.cymru.com'
+    return int([x.to_text() for x in dns.resolver.query(name, 'TXT').response.answer][0].split('\"')[1].split(' ')[0])
+
+class DNSResolver(object):
+    '''
+    Concurrent DNS ASN lookups, remembered in an optional JSON cache file
+    across runs.
+    '''
+    def __init__(self, cache_file=None, num_threads=16):
+        if dns is None:
+            raise ImportError('ASN lookups over DNS need dnspython; install it or use --asn-table')
+        self.cache_file = cache_file
+        self.num_threads = num_threads
+        self.cache = {}
+        if cache_file is not None and os.path.exists(cache_file):
+            with open(cache_file, encoding='utf8') as f:
+                self.cache = json.load(f)
+
+    def resolve(self, ips):
+        '''Return the ASNs of the address strings ips, None where they cannot be resolved'''
+        missing = [ip for ip in set(ips) if ip not in self.cache]
+        if missing:
+            with concurrent.futures.ThreadPoolExecutor(self.num_threads) as executor:
+                futures = {executor.submit(lookup_asn_dns, ip): ip for ip in missing}
+                for future in concurrent.futures.as_completed(futures):
+                    try:
+                        self.cache[futures[future]] = future.result()
+                    except (dns.exception.DNSException, ValueError, IndexError):
+                        pass # reported by filterbyasn
+        return [self.cache.get(ip) for ip in ips]
+
+    def save(self):
+        if self.cache_file is not None:
+            with open(self.cache_file, 'w', encoding='utf8') as f:
+                json.dump(self.cache, f, sort_keys=True)
+
+class TableResolver(object):
+    def __init__(self, table):
+        self.table = table
+
+    def resolve(self, ips):
+        return [self.table.lookup(ip) for ip in ips]
+
+    def save(self):
+        pass
 
 # Based on Greg Maxwell's seed_filter.py
-def filterbyasn(ips, max_per_asn, max_total):
+def filterbyasn(ips, max_per_asn, max_total, resolver):
     # Sift out ips by type
-    ips_ipv4 = [ip for ip in ips if ip['net'] == 'ipv4']
-    ips_ipv6 = [ip for ip in ips if ip['net'] == 'ipv6']
-    ips_onion = [ip for ip in ips if ip['net'] == 'onion']
+    ips_ipv46 = [ip for ip in ips if ip.net in ('ipv4', 'ipv6')]
+    ips_onion = [ip for ip in ips if ip.net == 'onion']
 
-    # Filter IPv4 by ASN
+    # Filter IPv4 and IPv6 by ASN. Addresses are resolved a batch at a time,
+    # as only as many are needed as it takes to fill max_total.
     result = []
     asn_count = {}
-    for ip in ips_ipv4:
-        if len(result) == max_total:
-            break
-        try:
-            asn = int([x.to_text() for x in dns.resolver.query('.'.join(reversed(ip['ip'].split('.'))) + '.origin.asn.cymru.com', 'TXT').response.answer][0].split('\"')[1].split(' ')[0])
+    batch_size = 4 * max_total
+    for batch_start in range(0, len(ips_ipv46), batch_size):
+        batch = ips_ipv46[batch_start:batch_start+batch_size]
+        for ip, asn in zip(batch, resolver.resolve([ip.ip for ip in batch])):
+            if len(result) == max_total:
+                break
+            if asn is None:
+                sys.stderr.write('ERR: Could not resolve ASN for "' + ip.ip + '"\n')
+                continue
             if asn not in asn_count:
                 asn_count[asn] = 0
             if asn_count[asn] == max_per_asn:
                 continue
             asn_count[asn] += 1
             result.append(ip)
-        except:
-            sys.stderr.write('ERR: Could not resolve ASN for "' + ip['ip'] + '"\n')
-
-    # TODO: filter IPv6 by ASN
+        if len(result) == max_total:
+            break
 
-    # Add back non-IPv4
-    result.extend(ips_ipv6)
+    # Add back Onion
     result.extend(ips_onion)
     return result
 
 def main():
-    lines = sys.stdin.readlines()
-    ips = [parseline(line) for line in lines]
-
-    # Skip entries with valid address.
-    ips = [ip for ip in ips if ip is not None]
-    # Skip entries from suspicious hosts.
-    ips = [ip for ip in ips if ip['ip'] not in SUSPICIOUS_HOSTS]
-    # Enforce minimal number of blocks.
-    ips = [ip for ip in ips if ip['blocks'] >= MIN_BLOCKS]
-    # Require service bit 1.
-    ips = [ip for ip in ips if (ip['service'] & 1) == 1]
-    # Require at least 50% 30-day uptime.
-    ips = [ip for ip in ips if ip['uptime'] > 50]
-    # Require a known and recent user agent.
-    ips = [ip for ip in ips if PATTERN_AGENT.match(ip['agent'])]
-    # Sort by availability (and use last success as tie breaker)
-    ips.sort(key=lambda x: (x['uptime'], x['lastsuccess'], x['ip']), reverse=True)
-    # Filter out hosts with multiple bitcoin ports, these are likely abusive
-    ips = filtermultiport(ips)
+    parser = argparse.ArgumentParser(description='Select seed nodes from a DNS seeder dump read from stdin.')
+    parser.add_argument('--asn-table', action='append', default=[], metavar='FILE',
+                        help='prefix to AS table (CAIDA routeviews pfx2as format) to look up ASNs '
+                             'in instead of querying DNS. May be given more than once, e.g. for IPv4 and IPv6.')
+    parser.add_argument('--asn-cache', metavar='FILE',
+                        help='JSON file in which ASNs looked up over DNS are kept across runs')
+    parser.add_argument('--dns-threads', type=int, default=16,
+                        help='number of concurrent DNS lookups (default: %(default)s)')
+    args = parser.parse_args()
+    if args.asn_table:
+        resolver = TableResolver(PrefixTable.load(args.asn_table))
+    else:
+        resolver = DNSResolver(args.asn_cache, args.dns_threads)
+
+    # Parse and filter the dump as it is read, keeping only the best candidates.
+    ips = (parseline(line) for line in sys.stdin)
+    ips = select_candidates((ip for ip in ips if ip is not None and is_good(ip)), MAX_CANDIDATES)
     # Look up ASNs and limit results, both per ASN and globally.
-    ips = filterbyasn(ips, MAX_SEEDS_PER_ASN, NSEEDS)
+    ips = filterbyasn(ips, MAX_SEEDS_PER_ASN, NSEEDS, resolver)
+    resolver.save()
     # Sort the results by IP address (for deterministic output).
-    ips.sort(key=lambda x: (x['net'], x['sortkey']))
+    ips.sort(key=lambda x: (x.net, x.sortkey))
 
     for ip in ips:
-        if ip['net'] == 'ipv6':
-            print('[%s]:%i' % (ip['ip'], ip['port']))
+        if ip.net == 'ipv6':
+            print('[%s]:%i' % (ip.ip, ip.port))
         else:
-            print('%s:%i' % (ip['ip'], ip['port']))
+            print('%s:%i' % (ip.ip, ip.port))
 
 if __name__ == '__main__':
     main()
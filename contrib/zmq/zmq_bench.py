@@ -0,0 +1,119 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+Throughput benchmark for zmqconsumer.
+
+A thread stands in for bitcoind: it publishes synthetic rawtx or rawblock
+notifications, with sequence numbers, on a local PUB socket as fast as it
+can. The consumer handles them with a no-op handler, optionally decoding
+every message, and the achieved rate is reported in messages and megabytes
+per second, along with the number of notifications lost.
+"""
+
+import argparse
+import asyncio
+import struct
+import threading
+import time
+
+import zmq
+
+from zmqconsumer import ZMQConsumer
+from test_framework.mininode import CBlock, COutPoint, CTransaction, CTxIn, CTxOut
+
+def make_tx(n):
+    tx = CTransaction()
+    tx.vin = [CTxIn(COutPoint(n, i), b'\x51' * 107) for i in range(2)]
+    tx.vout = [CTxOut(1000 + i, b'\x76\xa9\x14' + bytes(20) + b'\x88\xac') for i in range(2)]
+    return tx
+
+def make_body(topic):
+    if topic == "rawtx":
+        return make_tx(1).serialize()
+    block = CBlock()
+    block.vtx = [make_tx(n) for n in range(2000)]
+    return block.serialize()
+
+def publish(address, topic, body, count, ready):
+    context = zmq.Context()
+    socket = context.socket(zmq.PUB)
+    socket.setsockopt(zmq.SNDHWM, 0)
+    socket.bind(address)
+    ready.wait()
+    # Give the subscription time to reach the publisher
+    time.sleep(0.5)
+    topic = topic.encode('ascii')
+    for seq in range(count):
+        socket.send_multipart([topic, body, struct.pack('<I', seq)])
+    socket.close(linger=-1)
+    context.term()
+
+async def consume(consumer, count, decode, timeout):
+    """
+    Handle notifications until count have been handled or lost, or none has
+    arrived for timeout seconds. The last messages may be dropped without a
+    later one revealing the gap, so the timeout is what ends the run then.
+    Returns (handled, seconds from the first to the last message handled).
+    """
+    handled = 0
+    first = last = None
+    done = asyncio.Event()
+    def handler(notification):
+        nonlocal handled, first, last
+        if decode:
+            notification.decoded
+        handled += 1
+        last = time.time()
+        if first is None:
+            first = last
+        if handled + consumer.lost >= count:
+            done.set()
+    for topic in consumer.topics:
+        consumer.add_handler(topic, handler)
+
+    task = asyncio.ensure_future(consumer.run())
+    seen = -1
+    while not done.is_set() and handled != seen:
+        seen = handled
+        try:
+            await asyncio.wait_for(done.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+    task.cancel()
+    return (handled, last - first if handled else 0.0)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--topic', choices=['rawtx', 'rawblock'], default='rawtx')
+    parser.add_argument('--count', type=int, default=100000, help='number of messages (default: %(default)s)')
+    parser.add_argument('--decode', action='store_true', help='decode every message')
+    parser.add_argument('--address', default='tcp://127.0.0.1:28399')
+    parser.add_argument('--timeout', type=float, default=5, help='give up after this many seconds without a message (default: %(default)s)')
+    args = parser.parse_args()
+
+    body = make_body(args.topic)
+    ready = threading.Event()
+    publisher = threading.Thread(target=publish, args=(args.address, args.topic, body, args.count, ready))
+    publisher.start()
+
+    consumer = ZMQConsumer(args.address, [args.topic])
+    consumer.connect()
+    ready.set()
+    loop = asyncio.get_event_loop()
+    (handled, elapsed) = loop.run_until_complete(consume(consumer, args.count, args.decode, args.timeout))
+    publisher.join()
+
+    # Everything not handled was lost, including messages dropped at the end
+    lost = args.count - handled
+    if handled < 2 or not elapsed:
+        print("%i %s messages handled, %i lost" % (handled, args.topic, lost))
+        return
+    # The rate is over the intervals between the first and the last message
+    print("%i %s messages of %i bytes%s in %.2f s: %.0f msgs/s, %.1f MB/s, %i lost" % (
+          handled, args.topic, len(body), ", decoded," if args.decode else "", elapsed,
+          (handled - 1) / elapsed, (handled - 1) * len(body) / elapsed / 1e6, lost))
+
+if __name__ == '__main__':
+    main()
@@ -1,43 +1,57 @@
-#!/usr/bin/env python2
+#!/usr/bin/env python3
 # Copyright (c) 2014-2016 The Bitcoin Core developers
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
-import binascii
-import zmq
-import struct
+"""
+Print the notifications of a bitcoind started with e.g.
+
+    bitcoind -zmqpubhashblock=tcp://127.0.0.1:28332 -zmqpubrawtx=tcp://127.0.0.1:28332 ...
+
+See zmqconsumer.py for the library this uses.
+"""
+
+import asyncio
+
+from zmqconsumer import ZMQConsumer
 
 port = 28332
 
-zmqContext = zmq.Context()
-zmqSubSocket = zmqContext.socket(zmq.SUB)
-zmqSubSocket.setsockopt(zmq.SUBSCRIBE, "hashblock")
-zmqSubSocket.setsockopt(zmq.SUBSCRIBE, "hashtx")
-zmqSubSocket.setsockopt(zmq.SUBSCRIBE, "rawblock")
-zmqSubSocket.setsockopt(zmq.SUBSCRIBE, "rawtx")
-zmqSubSocket.connect("tcp://127.0.0.1:%i" % port)
-
-try:
-    while True:
-        msg = zmqSubSocket.recv_multipart()
-        topic = str(msg[0])
-        body = msg[1]
-        sequence = "Unknown"
-        if len(msg[-1]) == 4:
-          msgSequence = struct.unpack('<I', msg[-1])[-1]
-          sequence = str(msgSequence)
-        if topic == "hashblock":
-            print '- HASH BLOCK ('+sequence+') -'
-            print binascii.hexlify(body)
-        elif topic == "hashtx":
-            print '- HASH TX  ('+sequence+') -'
-            print binascii.hexlify(body)
-        elif topic == "rawblock":
-            print '- RAW BLOCK HEADER ('+sequence+') -'
-            print binascii.hexlify(body[:80])
-        elif topic == "rawtx":
-            print '- RAW TX ('+sequence+') -'
-            print binascii.hexlify(body)
-
-except KeyboardInterrupt:
-    zmqContext.destroy()
+def print_hash(notification):
+    print('- %s (%s) -' % (notification.topic.upper(), notification.sequence))
+    print(notification.decoded)
+
+def print_block(notification):
+    block = notification.decoded
+    block.rehash()
+    print('- RAW BLOCK (%s) -' % notification.sequence)
+    print('%s: %i transactions, %i bytes' % (block.hash, len(block.vtx), len(notification.body)))
+
+def print_tx(notification):
+    tx = notification.decoded
+    tx.rehash()
+    print('- RAW TX (%s) -' % notification.sequence)
+    print('%s: %i inputs, %i outputs, %i bytes' % (tx.hash, len(tx.vin), len(tx.vout), len(notification.body)))
+
+def print_gap(topic, expected, received):
+    print('- LOST %i %s notifications -' % ((received - expected) & 0xffffffff, topic))
+
+def main():
+    consumer = ZMQConsumer("tcp://127.0.0.1:%i" % port)
+    consumer.add_handler("hashblock", print_hash)
+    consumer.add_handler("hashtx", print_hash)
+    consumer.add_handler("rawblock", print_block)
+    consumer.add_handler("rawtx", print_tx)
+    consumer.add_gap_handler(print_gap)
+
+    loop = asyncio.get_event_loop()
+    try:
+        loop.run_until_complete(consumer.run())
+    except KeyboardInterrupt:
+        pass
+    finally:
+        consumer.context.destroy()
+        loop.close()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+asyncio consumer of bitcoind's ZMQ notifications.
+
+    consumer = ZMQConsumer("tcp://127.0.0.1:28332", ["rawblock", "rawtx"])
+    consumer.add_handler("rawblock", on_block)   # on_block(notification)
+    consumer.add_handler("rawtx", on_tx)         # plain functions or coroutines
+    await consumer.run()
+
+- one task receives messages and puts them on a bounded queue, another
+  passes them on to the handlers; when the handlers fall behind, the
+  receiver stops reading and the messages pile up in ZMQ's own queue up to
+  its high water mark, after which bitcoind drops them
+- lost messages are detected from the sequence number that bitcoind appends
+  to every notification, and reported to the gap handlers
+- message bodies are received without copying them into new bytes objects;
+  rawtx and rawblock bodies are decoded into the test framework's
+  CTransaction/CBlock (see qa/rpc-tests/test_framework/mininode.py) on first
+  access to Notification.decoded, once for all handlers. Decoding copies
+  every field it reads, as those classes keep their fields as bytes.
+
+Requires Python 3.5+ and pyzmq with asyncio support.
+"""
+
+import asyncio
+import os
+import struct
+import sys
+from binascii import hexlify
+
+import zmq
+import zmq.asyncio
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..', 'qa', 'rpc-tests'))
+from test_framework.mininode import CBlock, CTransaction
+
+TOPICS = ("hashblock", "hashtx", "rawblock", "rawtx")
+
+# Maximum number of received notifications waiting for the handlers
+QUEUE_SIZE = 1000
+
+class BufferReader(object):
+    '''File-like reader over a buffer, returning the parts read as bytes'''
+    __slots__ = ('view', 'pos')
+
+    def __init__(self, buf):
+        self.view = memoryview(buf)
+        self.pos = 0
+
+    def read(self, n):
+        data = self.view[self.pos:self.pos+n].tobytes()
+        self.pos += len(data)
+        return data
+
+class Notification(object):
+    __slots__ = ('topic', 'body', 'sequence', '_decoded')
+
+    def __init__(self, topic, body, sequence):
+        self.topic = topic          # str
+        self.body = body            # buffer (memoryview) over the message frame
+        self.sequence = sequence    # int, or None if the message carried none
+        self._decoded = None
+
+    @property
+    def decoded(self):
+        '''
+        The body as a CBlock (rawblock), CTransaction (rawtx), or hex hash
+        string (hashblock, hashtx). Decoded once and shared by all handlers.
+        '''
+        if self._decoded is None:
+            if self.topic == "rawblock":
+                self._decoded = CBlock()
+                self._decoded.deserialize(BufferReader(self.body))
+            elif self.topic == "rawtx":
+                self._decoded = CTransaction()
+                self._decoded.deserialize(BufferReader(self.body))
+            else:
+                self._decoded = hexlify(self.body).decode('ascii')
+        return self._decoded
+
+class ZMQConsumer(object):
+    def __init__(self, address, topics=TOPICS, queue_size=QUEUE_SIZE, context=None):
+        self.address = address
+        self.topics = list(topics)
+        self.queue_size = queue_size
+        self.context = context or zmq.asyncio.Context.instance()
+        self.handlers = {}
+        self.gap_handlers = []
+        self.sequence = {}
+        self.socket = None
+        self.queue = None # created in run(), inside the running event loop
+        # Statistics
+        self.messages = 0
+        self.bytes = 0
+        self.gaps = 0
+        self.lost = 0
+
+    def add_handler(self, topic, handler):
+        '''
+        Call handler(notification) for every notification of topic, in order.
+        The handler may be a coroutine function, which is then awaited before
+        the next notification is handled.
+        '''
+        self.handlers.setdefault(topic, []).append(handler)
+
+    def add_gap_handler(self, handler):
+        '''Call handler(topic, expected, received) when notifications were lost'''
+        self.gap_handlers.append(handler)
+
+    def connect(self):
+        self.socket = self.context.socket(zmq.SUB)
+        for topic in self.topics:
+            self.socket.setsockopt(zmq.SUBSCRIBE, topic.encode('ascii'))
+        self.socket.connect(self.address)
+
+    def close(self):
+        if self.socket is not None:
+            self.socket.close(linger=0)
+            self.socket = None
+
+    def _check_sequence(self, topic, sequence):
+        last = self.sequence.get(topic)
+        self.sequence[topic] = sequence
+        if last is None:
+            return
+        expected = (last + 1) & 0xffffffff
+        if sequence != expected:
+            self.gaps += 1
+            self.lost += (sequence - expected) & 0xffffffff
+            for handler in self.gap_handlers:
+                handler(topic, expected, sequence)
+
+    async def _receive(self):
+        while True:
+            frames = await self.socket.recv_multipart(copy=False)
+            topic = frames[0].bytes.decode('ascii')
+            body = frames[1].buffer
+            sequence = None
+            if len(frames) > 2 and len(frames[-1]) == 4:
+                sequence = struct.unpack('<I', frames[-1].bytes)[-1]
+                self._check_sequence(topic, sequence)
+            self.messages += 1
+            self.bytes += len(body)
+            # Blocks while the queue is full, leaving further messages in ZMQ
+            await self.queue.put(Notification(topic, body, sequence))
+
+    async def _dispatch(self):
+        while True:
+            notification = await self.queue.get()
+            for handler in self.handlers.get(notification.topic, ()):
+                result = handler(notification)
+                if asyncio.iscoroutine(result):
+                    await result
+            self.queue.task_done()
+
+    async def run(self):
+        '''Receive and handle notifications until cancelled'''
+        if self.socket is None:
+            self.connect()
+        self.queue = asyncio.Queue(self.queue_size)
+        tasks = [asyncio.ensure_future(self._receive()), asyncio.ensure_future(self._dispatch())]
+        try:
+            # Whichever ends first does so with an exception
+            done, _ = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                task.result()
+        finally:
+            for task in tasks:
+                task.cancel()
+            self.close()
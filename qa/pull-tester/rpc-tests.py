@@ -24,10 +24,13 @@ For a description of arguments recognized by test scripts, see
 import os
 import time
 import shutil
+import signal
+import selectors
 import sys
 import subprocess
 import tempfile
 import re
+import json
 
 sys.path.append("qa/pull-tester/")
 from tests_config import *
@@ -39,6 +42,8 @@ if os.name == 'posix':
     BOLD = ('\033[0m', '\033[1m')
 
 RPC_TESTS_DIR = SRCDIR + '/qa/rpc-tests/'
+# Durations and peak memory of previous runs, used for scheduling
+TEST_HISTORY_FILE = BUILDDIR + '/qa/rpc_test_history.json'
 
 #If imported values are not defined then set to zero (or disabled)
 if 'ENABLE_WALLET' not in vars():
@@ -59,7 +64,7 @@ PASSON_REGEX = re.compile("^--")
 PARALLEL_REGEX = re.compile('^-parallel=')
 
 print_help = False
-run_parallel = 4
+run_parallel = None # sized from the machine unless -parallel is given
 
 for arg in sys.argv[1:]:
     if arg == "--help" or arg == "-h" or arg == "-?":
@@ -100,6 +105,7 @@ if ENABLE_ZMQ:
 
 testScripts = [
     # longest test should go first, to favor running tests in parallel
+    # (once durations have been recorded, those decide the order instead)
     'wallet-hd.py',
     'walletbackup.py',
     # vv Tests less than 5m vv
@@ -161,6 +167,22 @@ testScripts = [
 if ENABLE_ZMQ:
     testScripts.append('zmq_test.py')
 
+# Expected resource use of tests that need more than the default of
+# DEFAULT_TEST_RESOURCES: number of bitcoind nodes, RAM and disk in MB.
+# Heavy tests are never run at the same time as each other. Once a test's
+# peak RSS has been recorded, that replaces the RAM estimate.
+DEFAULT_TEST_RESOURCES = {'nodes': 4, 'mem': 4 * 100 + 100, 'disk': 100, 'heavy': False}
+TEST_RESOURCES = {
+    'pruning.py': {'nodes': 6, 'mem': 3000, 'disk': 4000, 'heavy': True},
+    'fork-large-block.py': {'nodes': 2, 'mem': 1500, 'disk': 1000, 'heavy': True},
+    'p2p-fullblocktest.py': {'nodes': 1, 'mem': 2000, 'disk': 500, 'heavy': True},
+    'p2p-segwit.py': {'nodes': 3, 'mem': 1000, 'disk': 300, 'heavy': True},
+    'maxuploadtarget.py': {'nodes': 1, 'mem': 1000, 'disk': 1000, 'heavy': True},
+    'smartfees.py': {'nodes': 3, 'mem': 800, 'disk': 300},
+    'mempool_limit.py': {'nodes': 1, 'mem': 600, 'disk': 200},
+    'mempool_packages.py': {'nodes': 2, 'mem': 500, 'disk': 100},
+}
+
 testScriptsExt = [
     'pruning.py',
     # vv Tests less than 20m vv
@@ -218,21 +240,32 @@ def runtests():
     if coverage:
         flags.append(coverage.flag)
 
-    if len(test_list) > 1 and run_parallel > 1:
+    if len(test_list) > 1 and run_parallel != 1:
         # Populate cache
         subprocess.check_output([RPC_TESTS_DIR + 'create_cache.py'] + flags)
 
     #Run Tests
+    history = TestHistory(TEST_HISTORY_FILE)
+    admission = AdmissionController(history)
+    num_jobs = run_parallel or admission.default_parallelism()
+    test_list = history.schedule(test_list)
+    predicted_runtime, predicted_longest = history.predict(test_list, num_jobs)
+    num_unknown = len([t for t in test_list if t not in history.durations])
     max_len_name = len(max(test_list, key=len))
     time_sum = 0
     time0 = time.time()
-    job_queue = RPCTestHandler(run_parallel, test_list, flags)
+    longest = (None, 0)
+    print("Running %d tests, up to %d in parallel" % (len(test_list), num_jobs))
+    job_queue = RPCTestHandler(num_jobs, test_list, flags, admission)
     results = BOLD[1] + "%s | %s | %s\n\n" % ("TEST".ljust(max_len_name), "PASSED", "DURATION") + BOLD[0]
     all_passed = True
     for _ in range(len(test_list)):
-        (name, stdout, stderr, passed, duration) = job_queue.get_next()
+        (name, stdout, stderr, passed, duration, peak_rss) = job_queue.get_next()
         all_passed = all_passed and passed
         time_sum += duration
+        history.record(name, duration, peak_rss)
+        if duration >= longest[1]:
+            longest = (name, duration)
 
         print('\n' + BOLD[1] + name + BOLD[0] + ":")
         print('' if passed else stdout + '\n', end='')
@@ -242,6 +275,10 @@ def runtests():
     results += BOLD[1] + "\n%s | %s | %s s (accumulated)" % ("ALL".ljust(max_len_name), str(all_passed).ljust(6), time_sum) + BOLD[0]
     print(results)
     print("\nRuntime: %s s" % (int(time.time() - time0)))
+    print("Predicted: %s s (%d tests without recorded duration), longest test: %s %s s (predicted %s)" % (
+        predicted_runtime, num_unknown,
+        longest[0], longest[1], predicted_longest))
+    history.save()
 
     if coverage:
         coverage.report_rpc_coverage()
@@ -252,28 +289,216 @@ def runtests():
     sys.exit(not all_passed)
 
 
+class TestHistory(object):
+    """
+    Duration (seconds) and peak RSS (MB) of tests in previous runs, keyed
+    by test name (including arguments), kept in a JSON file between runs.
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        try:
+            with open(filename, 'r', encoding='utf8') as f:
+                history = json.load(f)
+        except (IOError, ValueError):
+            history = {}
+        self.durations = {t: h['duration'] for t, h in history.items() if 'duration' in h}
+        self.peak_rss = {t: h['peak_rss'] for t, h in history.items() if h.get('peak_rss')}
+        self.new_entries = {}
+
+    def schedule(self, test_list):
+        """
+        Order tests longest-processing-time first. Tests without a recorded
+        duration are assumed to be as long as the longest known one, and
+        otherwise keep their hand-maintained order (the sort is stable).
+        """
+        if not self.durations:
+            return list(test_list)
+        unknown = max(self.durations.values())
+        return sorted(test_list, key=lambda t: -self.durations.get(t, unknown))
+
+    def predict(self, test_list, num_jobs):
+        """
+        Simulate running test_list in order on num_jobs slots.
+        Returns (predicted wall time, predicted longest single test).
+        """
+        slots = [0] * num_jobs
+        for t in test_list:
+            slots[slots.index(min(slots))] += self.durations.get(t, 0)
+        return max(slots), max([self.durations.get(t, 0) for t in test_list] + [0])
+
+    def record(self, name, duration, peak_rss):
+        self.new_entries[name] = {'duration': duration, 'peak_rss': peak_rss}
+
+    def save(self):
+        history = {t: {'duration': d} for t, d in self.durations.items()}
+        for t, rss in self.peak_rss.items():
+            history.setdefault(t, {})['peak_rss'] = rss
+        for t, entry in self.new_entries.items():
+            history.setdefault(t, {}).update((k, v) for k, v in entry.items() if v is not None)
+        try:
+            with open(self.filename, 'w', encoding='utf8') as f:
+                json.dump(history, f, indent=1, sort_keys=True)
+        except IOError as e:
+            print("WARN: could not save test history: " + str(e))
+
+
+def available_memory_mb():
+    """Memory available for new processes in MB, or None if unknown"""
+    try:
+        with open('/proc/meminfo', 'r') as f:
+            for line in f:
+                if line.startswith('MemAvailable:'):
+                    return int(line.split()[1]) // 1024
+    except IOError:
+        pass
+    try:
+        return os.sysconf('SC_AVPHYS_PAGES') * os.sysconf('SC_PAGE_SIZE') // 2**20
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
+class AdmissionController(object):
+    """
+    Decides which queued test may start next, so that the tests running
+    at the same time fit in the machine's memory and disk, and heavy tests
+    do not overlap.
+    """
+
+    def __init__(self, history):
+        self.history = history
+        mem = available_memory_mb()
+        # Leave some headroom for the rest of the system
+        self.mem_budget = None if mem is None else mem * 8 // 10
+        tmpdir = tempfile.gettempdir()
+        self.disk_budget = shutil.disk_usage(tmpdir).free // 2**20 * 8 // 10
+        self.running = {}
+
+    def resources(self, test):
+        """Expected resource use of test, from TEST_RESOURCES and the recorded peak RSS"""
+        res = dict(DEFAULT_TEST_RESOURCES)
+        res.update(TEST_RESOURCES.get(test.split()[0], {}))
+        if test in self.history.peak_rss:
+            # The peak is that of the largest single process of the test
+            # (the python script or one of its nodes), so scale by nodes.
+            res['mem'] = self.history.peak_rss[test] * (res['nodes'] + 1)
+        return res
+
+    def default_parallelism(self):
+        """Number of parallel jobs to use when -parallel is not given"""
+        jobs = os.cpu_count() or 1
+        if self.mem_budget is not None:
+            jobs = min(jobs, self.mem_budget // DEFAULT_TEST_RESOURCES['mem'])
+        return max(1, jobs)
+
+    def admits(self, test):
+        if not self.running:
+            return True # always make progress, even if the test does not fit
+        res = self.resources(test)
+        in_use = self.running.values()
+        if res['heavy'] and any(r['heavy'] for r in in_use):
+            return False
+        if self.mem_budget is not None and sum(r['mem'] for r in in_use) + res['mem'] > self.mem_budget:
+            return False
+        if sum(r['disk'] for r in in_use) + res['disk'] > self.disk_budget:
+            return False
+        return True
+
+    def pick(self, test_list):
+        """
+        Return the first test in test_list that may start now, or None.
+        As test_list is longest first, this fills gaps next to a heavy test
+        with the longest light test that fits.
+        """
+        for t in test_list:
+            if self.admits(t):
+                return t
+        return None
+
+    def start(self, test):
+        self.running[test] = self.resources(test)
+
+    def finish(self, test):
+        del self.running[test]
+
+
 class RPCTestHandler:
     """
     Trigger the testscrips passed in via the list.
     """
 
-    def __init__(self, num_tests_parallel, test_list=None, flags=None):
+    def __init__(self, num_tests_parallel, test_list=None, flags=None, admission=None):
         assert(num_tests_parallel >= 1)
         self.num_jobs = num_tests_parallel
         self.test_list = test_list
         self.flags = flags
+        self.admission = admission
         self.num_running = 0
         # In case there is a graveyard of zombie bitcoinds, we can apply a
         # pseudorandom offset to hopefully jump over them.
         # (625 is PORT_RANGE/MAX_NODES)
         self.portseed_offset = int(time.time() * 1000) % 625
         self.jobs = []
+        self.selector = None
+        if os.name == 'posix':
+            # Wake up as soon as a test process exits: SIGCHLD writes a
+            # byte into this pipe, which we wait on instead of sleep-polling.
+            import fcntl
+            wakeup_r, wakeup_w = os.pipe()
+            for fd in (wakeup_r, wakeup_w):
+                fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+            signal.signal(signal.SIGCHLD, lambda signum, frame: None)
+            signal.set_wakeup_fd(wakeup_w)
+            self.selector = selectors.DefaultSelector()
+            self.selector.register(wakeup_r, selectors.EVENT_READ)
+
+    @staticmethod
+    def _reap(proc):
+        """
+        Poll proc. If it exited, set its returncode and return its peak RSS
+        in MB (including the nodes it started and waited for), when known.
+        """
+        if not hasattr(os, 'wait4'):
+            proc.poll()
+            return None
+        pid, status, rusage = os.wait4(proc.pid, os.WNOHANG)
+        if pid == 0:
+            return None
+        if os.WIFSIGNALED(status):
+            proc.returncode = -os.WTERMSIG(status)
+        else:
+            proc.returncode = os.WEXITSTATUS(status)
+        # ru_maxrss is in kilobytes on Linux, bytes on OS X
+        return rusage.ru_maxrss // (2**20 if sys.platform == 'darwin' else 2**10)
+
+    def _wait_for_exit(self, timeout):
+        """
+        Wait until a child process may have exited, or timeout seconds.
+        Returns False on timeout.
+        """
+        if self.selector is None:
+            time.sleep(timeout)
+            return False
+        events = self.selector.select(timeout)
+        for key, _ in events:
+            try:
+                os.read(key.fd, 512)
+            except BlockingIOError:
+                pass
+        return bool(events)
 
     def get_next(self):
         while self.num_running < self.num_jobs and self.test_list:
             # Add tests
+            if self.admission is None:
+                t = self.test_list[0]
+            else:
+                t = self.admission.pick(self.test_list)
+                if t is None:
+                    break # wait for a running test to free up resources
+                self.admission.start(t)
             self.num_running += 1
-            t = self.test_list.pop(0)
+            self.test_list.remove(t)
             port_seed = ["--portseed={}".format(len(self.test_list) + self.portseed_offset)]
             log_stdout = tempfile.SpooledTemporaryFile(max_size=2**16)
             log_stderr = tempfile.SpooledTemporaryFile(max_size=2**16)
@@ -289,18 +514,21 @@ class RPCTestHandler:
             raise IndexError('pop from empty list')
         while True:
             # Return first proc that finishes
-            time.sleep(.5)
+            if not self._wait_for_exit(.5):
+                print('.', end='', flush=True)
             for j in self.jobs:
                 (name, time0, proc, log_out, log_err) = j
-                if proc.poll() is not None:
+                peak_rss = self._reap(proc)
+                if proc.returncode is not None:
                     log_out.seek(0), log_err.seek(0)
                     [stdout, stderr] = [l.read().decode('utf-8') for l in (log_out, log_err)]
                     log_out.close(), log_err.close()
                     passed = stderr == "" and proc.returncode == 0
                     self.num_running -= 1
                     self.jobs.remove(j)
-                    return name, stdout, stderr, passed, int(time.time() - time0)
-            print('.', end='', flush=True)
+                    if self.admission is not None:
+                        self.admission.finish(name)
+                    return name, stdout, stderr, passed, int(time.time() - time0), peak_rss
 
 
 class RPCCoverage(object):
@@ -309,11 +537,13 @@ class RPCCoverage(object):
 
     Coverage calculation works by having each test script subprocess write
     coverage files into a particular directory. These files contain the RPC
-    commands invoked during testing, as well as a complete listing of RPC
-    commands per `bitcoin-cli help` (`rpc_interface.txt`).
+    commands invoked during testing with their call counts and cumulative
+    latency, as well as a complete listing of RPC commands per
+    `bitcoin-cli help` (`rpc_interface.txt`).
 
     After all tests complete, the commands run are combined and diff'd against
-    the complete list to calculate uncovered RPC commands.
+    the complete list to calculate uncovered RPC commands, and the most
+    called and most time consuming commands are reported.
 
     See also: qa/rpc-tests/test_framework/coverage.py
 
@@ -322,12 +552,14 @@ class RPCCoverage(object):
         self.dir = tempfile.mkdtemp(prefix="coverage")
         self.flag = '--coveragedir=%s' % self.dir
 
-    def report_rpc_coverage(self):
+    def report_rpc_coverage(self, num_hot=10):
         """
-        Print out RPC commands that were unexercised by tests.
+        Print out RPC commands that were unexercised by tests, and the
+        `num_hot` commands with the most calls and the most total time.
 
         """
-        uncovered = self._get_uncovered_rpc_commands()
+        calls, seconds = self._get_rpc_call_stats()
+        uncovered = self._get_uncovered_rpc_commands(set(calls))
 
         if uncovered:
             print("Uncovered RPC commands:")
@@ -335,22 +567,52 @@ class RPCCoverage(object):
         else:
             print("All RPC commands covered.")
 
+        print("Most called RPC commands:")
+        for cmd in sorted(calls, key=lambda c: -calls[c])[:num_hot]:
+            print("  - %s: %d calls, %.2f s" % (cmd, calls[cmd], seconds[cmd]))
+        print("Most time consuming RPC commands:")
+        for cmd in sorted(seconds, key=lambda c: -seconds[c])[:num_hot]:
+            print("  - %s: %.2f s in %d calls" % (cmd, seconds[cmd], calls[cmd]))
+
     def cleanup(self):
         return shutil.rmtree(self.dir)
 
-    def _get_uncovered_rpc_commands(self):
+    def _get_rpc_call_stats(self):
+        """
+        Return dicts of call counts and total seconds per RPC command.
+
+        """
+        # This is shared from `qa/rpc-tests/test-framework/coverage.py`
+        COVERAGE_FILE_PREFIX = 'coverage.'
+
+        calls = {}
+        seconds = {}
+
+        for root, dirs, files in os.walk(self.dir):
+            for filename in files:
+                if not filename.startswith(COVERAGE_FILE_PREFIX):
+                    continue
+                with open(os.path.join(root, filename), 'r') as f:
+                    for line in f:
+                        fields = line.split()
+                        if not fields:
+                            continue
+                        cmd = fields[0]
+                        calls[cmd] = calls.get(cmd, 0) + (int(fields[1]) if len(fields) > 1 else 1)
+                        seconds[cmd] = seconds.get(cmd, 0.0) + (float(fields[2]) if len(fields) > 2 else 0.0)
+
+        return calls, seconds
+
+    def _get_uncovered_rpc_commands(self, covered_cmds):
         """
         Return a set of currently untested RPC commands.
 
         """
         # This is shared from `qa/rpc-tests/test-framework/coverage.py`
         REFERENCE_FILENAME = 'rpc_interface.txt'
-        COVERAGE_FILE_PREFIX = 'coverage.'
 
         coverage_ref_filename = os.path.join(self.dir, REFERENCE_FILENAME)
-        coverage_filenames = set()
         all_cmds = set()
-        covered_cmds = set()
 
         if not os.path.isfile(coverage_ref_filename):
             raise RuntimeError("No coverage reference found")
@@ -358,15 +620,6 @@ class RPCCoverage(object):
         with open(coverage_ref_filename, 'r') as f:
             all_cmds.update([i.strip() for i in f.readlines()])
 
-        for root, dirs, files in os.walk(self.dir):
-            for filename in files:
-                if filename.startswith(COVERAGE_FILE_PREFIX):
-                    coverage_filenames.add(os.path.join(root, filename))
-
-        for filename in coverage_filenames:
-            with open(filename, 'r') as f:
-                covered_cmds.update([i.strip() for i in f.readlines()])
-
         return all_cmds - covered_cmds
 
 
@@ -6,7 +6,8 @@
 from test_framework.test_framework import BitcoinTestFramework
 from test_framework.util import *
 from test_framework.mininode import NetworkThread, CTransaction, FromHex
-from test_framework.blocktools import create_coinbase, create_block, create_transaction
+from test_framework.blocktools import create_coinbase, create_block, create_transaction, create_large_block, TxFactory
+from test_framework.key import CECKey
 from test_framework.script import *
 import time
 
@@ -208,6 +209,34 @@ class ForkLargeBlockTest(BitcoinTestFramework):
 
         self.generate_blocks(1, 4, txs=[large_tx[4], large_tx[5], large_tx[6]]) # large block ok
 
+        # Test 8
+        # Blocks built locally by blocktools
+        # A chain stamped out from a template has the txids the node computes, also after rehash()
+        factory = TxFactory(self.create_tx(spend_tx[7], 0, 1))
+        value = spend_tx[7].vout[0].nValue
+        chain = factory.create_chain((spend_tx[7].sha256, 0), [value - 1000 * (i + 1) for i in range(10)])
+        for tx in chain:
+            tx.rehash()
+        self.generate_blocks(1, 4, txs=chain)
+        assert_equal(self.nodes[0].getblock(self.nodes[0].getbestblockhash())['tx'][1:], [tx.hash for tx in chain])
+
+        # Large blocks of exactly the requested size, with filler transactions signed by key
+        key = CECKey()
+        key.set_secretbytes(b"fork-large-block")
+        fund_tx = self.create_tx(spend_tx[8], 0, spend_tx[8].vout[0].nValue, CScript([key.get_pubkey(), OP_CHECKSIG]))
+        self.generate_blocks(1, 4, txs=[fund_tx])
+        utxos = [(fund_tx.sha256, 0, fund_tx.vout[0].nValue)]
+        for size in (1500000, 1999000):
+            block = create_large_block(self.tip, self.height, utxos, size, self.last_block_time + 1, key)
+            block.nVersion = 4
+            block.rehash()
+            block.solve()
+            assert_equal(self.nodes[0].submitblock(bytes_to_hex_str(block.serialize(True))), None)
+            assert_equal(self.nodes[0].getblock(block.hash)['strippedsize'], size)
+            self.last_block_time += 1
+            self.tip = block.sha256
+            self.height += 1
+
 
     def generate_blocks(self, number, version, error = None, txs = []):
         for i in range(number):
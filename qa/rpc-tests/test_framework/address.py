@@ -6,30 +6,24 @@
 #
 # address.py
 #
-# This file encodes and decodes BASE58 P2PKH and P2SH addresses
+# This file encodes and decodes BASE58 P2PKH and P2SH addresses, and
+# bech32 native segwit addresses
 #
 
-from .script import hash256, hash160, sha256, CScript, OP_0
-from .util import bytes_to_hex_str, hex_str_to_bytes
-
-chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+from . import segwit_addr
+from .base58 import b58encode_chk, b58decode_chk
+from .script import hash160, sha256, CScript, CScriptOp, OP_0
+from .util import hex_str_to_bytes
 
 def byte_to_base58(b, version):
-    result = ''
-    str = bytes_to_hex_str(b)
-    str = bytes_to_hex_str(chr(version).encode('latin-1')) + str
-    checksum = bytes_to_hex_str(hash256(hex_str_to_bytes(str)))
-    str += checksum[:8]
-    value = int('0x'+str,0)
-    while value > 0:
-        result = chars[value % 58] + result
-        value //= 58
-    while (str[:2] == '00'):
-        result = chars[0] + result
-        str = str[2:]
-    return result
-
-# TODO: def base58_decode
+    return b58encode_chk(bytes([version]) + b)
+
+def base58_to_byte(s):
+    """Decode a base58check string into (payload, version)"""
+    data = b58decode_chk(s)
+    if not data:
+        raise ValueError('Invalid base58check string %s' % s)
+    return (data[1:], data[0])
 
 def keyhash_to_p2pkh(hash, main = False):
     assert (len(hash) == 20)
@@ -59,6 +53,43 @@ def script_to_p2sh_p2wsh(script, main = False):
     p2shscript = CScript([OP_0, sha256(script)])
     return script_to_p2sh(p2shscript, main)
 
+def witness_hrp(main = False):
+    return "bc" if main else "bcrt"
+
+def program_to_witness(version, program, main = False):
+    if (type(program) is str):
+        program = hex_str_to_bytes(program)
+    assert 0 <= version <= 16
+    assert 2 <= len(program) <= 40
+    assert version > 0 or len(program) in [20, 32]
+    return segwit_addr.encode(witness_hrp(main), version, program)
+
+def witness_to_program(address, main = False):
+    """Decode a native segwit address into (version, program)"""
+    (version, program) = segwit_addr.decode(witness_hrp(main), address)
+    if version is None:
+        raise ValueError('Invalid segwit address %s' % address)
+    return (version, program)
+
+def witness_to_script(address, main = False):
+    """scriptPubKey paying to a native segwit address"""
+    (version, program) = witness_to_program(address, main)
+    return CScript([CScriptOp.encode_op_n(version), program])
+
+def script_to_p2wsh(script, main = False):
+    script = check_script(script)
+    return program_to_witness(0, sha256(script), main)
+
+def key_to_p2wpkh(key, main = False):
+    key = check_key(key)
+    return program_to_witness(0, hash160(key), main)
+
+def scripts_to_p2wsh(scripts, main = False):
+    return segwit_addr.encode_list(witness_hrp(main), 0, [sha256(check_script(s)) for s in scripts])
+
+def keys_to_p2wpkh(keys, main = False):
+    return segwit_addr.encode_list(witness_hrp(main), 0, [hash160(check_key(k)) for k in keys])
+
 def check_key(key):
     if (type(key) is str):
         key = hex_str_to_bytes(key) # Assuming this is hex string
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+asyncio counterpart of AuthServiceProxy.
+
+AsyncAuthServiceProxy has the same call syntax as AuthServiceProxy, except
+that every RPC is a coroutine:
+
+    node = AsyncAuthServiceProxy(rpc_url(0))
+    height = await node.getblockcount()
+
+- HTTP/1.1 keep-alive connections are kept in a small per-server pool, so
+  many calls can be in flight against the same node at once
+- sends Basic HTTP authentication headers built from the service URL
+- parses all JSON numbers that look like floats as Decimal
+- applies a per-call timeout, reported the same way as AuthServiceProxy
+- reconnects once if the server closed or reset an idle connection
+
+This module uses async/await syntax and therefore requires Python 3.5+.
+It is not imported by the rest of the framework.
+"""
+
+import asyncio
+import base64
+import decimal
+import json
+import logging
+import urllib.parse as urlparse
+
+from .authproxy import (
+    EncodeDecimal,
+    HTTP_TIMEOUT,
+    JSONRPCException,
+    USER_AGENT,
+)
+
+log = logging.getLogger("BitcoinRPC")
+
+# Maximum number of simultaneous HTTP connections to one RPC server.
+# bitcoind serves -rpcthreads (default 4) requests concurrently and queues
+# up to -rpcworkqueue more, so there is little point in opening many more.
+MAX_CONNECTIONS = 4
+
+class _ConnectionPool(object):
+    '''Keep-alive HTTP connections to a single RPC server'''
+    def __init__(self, host, port, max_connections):
+        self.host = host
+        self.port = port
+        self.max_connections = max_connections
+        self._idle = []
+        self._slots = None # created lazily, inside the running event loop
+
+    async def acquire(self):
+        '''Return (reader, writer, reused) for a connection to the server'''
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(self.max_connections)
+        await self._slots.acquire()
+        if self._idle:
+            reader, writer = self._idle.pop()
+            return reader, writer, True
+        try:
+            reader, writer = await asyncio.open_connection(self.host, self.port)
+        except BaseException:
+            self._slots.release()
+            raise
+        return reader, writer, False
+
+    def release(self, reader, writer, keep_alive):
+        if keep_alive:
+            self._idle.append((reader, writer))
+        else:
+            writer.close()
+        self._slots.release()
+
+    def close(self):
+        for _, writer in self._idle:
+            writer.close()
+        self._idle = []
+
+class AsyncAuthServiceProxy(object):
+    __id_count = 0
+
+    # ensure_ascii: escape unicode as \uXXXX, passed to json.dumps
+    def __init__(self, service_url, service_name=None, timeout=HTTP_TIMEOUT, pool=None, ensure_ascii=True, max_connections=MAX_CONNECTIONS):
+        self.__service_url = service_url
+        self._service_name = service_name
+        self.ensure_ascii = ensure_ascii # can be toggled on the fly by tests
+        self.timeout = timeout
+        self.__url = urlparse.urlparse(service_url)
+        if self.__url.scheme != 'http':
+            raise ValueError('Unsupported URL scheme %r' % self.__url.scheme)
+        port = 80 if self.__url.port is None else self.__url.port
+        authpair = (self.__url.username or '') + ':' + (self.__url.password or '')
+        self.__auth_header = 'Basic ' + base64.b64encode(authpair.encode('utf8')).decode('ascii')
+        self.__path = self.__url.path or '/'
+
+        if pool:
+            # Callables re-use the connections of the original proxy
+            self.__pool = pool
+        else:
+            self.__pool = _ConnectionPool(self.__url.hostname, port, max_connections)
+
+    def __getattr__(self, name):
+        if name.startswith('__') and name.endswith('__'):
+            # Python internal stuff
+            raise AttributeError
+        if self._service_name is not None:
+            name = "%s.%s" % (self._service_name, name)
+        return AsyncAuthServiceProxy(self.__service_url, name, timeout=self.timeout,
+                                     pool=self.__pool, ensure_ascii=self.ensure_ascii)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        '''Close all idle connections. Connections in use are closed when released.'''
+        self.__pool.close()
+
+    def _build_request(self, method, path, postdata):
+        head = ('%s %s HTTP/1.1\r\n'
+                'Host: %s\r\n'
+                'User-Agent: %s\r\n'
+                'Authorization: %s\r\n'
+                'Content-type: application/json\r\n'
+                'Content-Length: %d\r\n'
+                '\r\n') % (method, path, self.__url.hostname, USER_AGENT,
+                           self.__auth_header, len(postdata))
+        return head.encode('latin-1') + postdata
+
+    async def _exchange(self, request):
+        '''
+        Send one request over a pooled connection and read back the response.
+        Returns (status, reason, content_type, body).
+        '''
+        reader, writer, reused = await self.__pool.acquire()
+        keep_alive = False
+        try:
+            writer.write(request)
+            await writer.drain()
+            status_line = await reader.readline()
+            if not status_line:
+                # Server closed the connection before answering
+                raise ConnectionResetError('empty status line')
+            version, status, reason = (status_line.decode('latin-1').rstrip('\r\n').split(' ', 2) + [''])[:3]
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                key, _, value = line.decode('latin-1').partition(':')
+                headers[key.strip().lower()] = value.strip()
+            if 'content-length' in headers:
+                body = await reader.readexactly(int(headers['content-length']))
+                keep_alive = (version == 'HTTP/1.1' and
+                              headers.get('connection', '').lower() != 'close')
+            else:
+                body = await reader.read()
+            return int(status), reason, headers.get('content-type'), body
+        except (BrokenPipeError, ConnectionResetError, asyncio.IncompleteReadError):
+            if not reused:
+                raise
+            # An idle connection was closed by the server (e.g. because of
+            # its own timeout); try again once on a fresh connection.
+            self.__pool.release(reader, writer, False)
+            reader = None
+            return await self._exchange(request)
+        finally:
+            if reader is not None:
+                self.__pool.release(reader, writer, keep_alive)
+
+    async def _request(self, method, path, postdata):
+        request = self._build_request(method, path, postdata)
+        try:
+            if self.timeout is None:
+                response = await self._exchange(request)
+            else:
+                response = await asyncio.wait_for(self._exchange(request), self.timeout)
+        except asyncio.TimeoutError:
+            raise JSONRPCException({
+                'code': -344,
+                'message': '%r RPC took longer than %f seconds. Consider '
+                           'using larger timeout for calls that take '
+                           'longer to return.' % (self._service_name,
+                                                  self.timeout)})
+        return self._get_response(*response)
+
+    async def __call__(self, *args, **argsn):
+        AsyncAuthServiceProxy.__id_count += 1
+        call_id = AsyncAuthServiceProxy.__id_count
+
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-%s-> %s %s"%(call_id, self._service_name,
+                                     json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        if args and argsn:
+            raise ValueError('Cannot handle both named and positional arguments')
+        postdata = json.dumps({'version': '1.1',
+                               'method': self._service_name,
+                               'params': args or argsn,
+                               'id': call_id}, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
+        response = await self._request('POST', self.__path, postdata.encode('utf-8'))
+        if response['error'] is not None:
+            raise JSONRPCException(response['error'])
+        elif 'result' not in response:
+            raise JSONRPCException({
+                'code': -343, 'message': 'missing JSON-RPC result'})
+        else:
+            return response['result']
+
+    async def _batch(self, rpc_call_list):
+        postdata = json.dumps(list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("--> "+postdata)
+        return await self._request('POST', self.__path, postdata.encode('utf-8'))
+
+    def _get_response(self, status, reason, content_type, body):
+        if content_type != 'application/json':
+            raise JSONRPCException({
+                'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (status, reason)})
+
+        responsedata = body.decode('utf8')
+        response = json.loads(responsedata, parse_float=decimal.Decimal)
+        if log.isEnabledFor(logging.DEBUG):
+            if isinstance(response, dict) and "error" in response and response["error"] is None:
+                log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+            else:
+                log.debug("<-- "+responsedata)
+        return response
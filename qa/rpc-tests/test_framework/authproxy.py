@@ -77,6 +77,9 @@ class AuthServiceProxy(object):
         self.__service_url = service_url
         self._service_name = service_name
         self.ensure_ascii = ensure_ascii # can be toggled on the fly by tests
+        # Sizes of the last request and response, in bytes
+        self.request_size = 0
+        self.response_size = 0
         self.__url = urlparse.urlparse(service_url)
         if self.__url.port is None:
             port = 80
@@ -141,15 +144,18 @@ class AuthServiceProxy(object):
     def __call__(self, *args, **argsn):
         AuthServiceProxy.__id_count += 1
 
-        log.debug("-%s-> %s %s"%(AuthServiceProxy.__id_count, self._service_name,
-                                 json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("-%s-> %s %s"%(AuthServiceProxy.__id_count, self._service_name,
+                                     json.dumps(args, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
         if args and argsn:
             raise ValueError('Cannot handle both named and positional arguments')
         postdata = json.dumps({'version': '1.1',
                                'method': self._service_name,
                                'params': args or argsn,
                                'id': AuthServiceProxy.__id_count}, default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        response = self._request('POST', self.__url.path, postdata.encode('utf-8'))
+        postdata = postdata.encode('utf-8')
+        self.request_size = len(postdata)
+        response = self._request('POST', self.__url.path, postdata)
         if response['error'] is not None:
             raise JSONRPCException(response['error'])
         elif 'result' not in response:
@@ -160,7 +166,8 @@ class AuthServiceProxy(object):
 
     def _batch(self, rpc_call_list):
         postdata = json.dumps(list(rpc_call_list), default=EncodeDecimal, ensure_ascii=self.ensure_ascii)
-        log.debug("--> "+postdata)
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("--> "+postdata)
         return self._request('POST', self.__url.path, postdata.encode('utf-8'))
 
     def _get_response(self):
@@ -182,10 +189,16 @@ class AuthServiceProxy(object):
             raise JSONRPCException({
                 'code': -342, 'message': 'non-JSON HTTP response with \'%i %s\' from server' % (http_response.status, http_response.reason)})
 
-        responsedata = http_response.read().decode('utf8')
+        # Read the body in one go and decode it in a single pass. The debug
+        # output below re-serializes the result, which is as expensive as
+        # parsing it, so only do that when somebody is listening.
+        responsedata = http_response.read()
+        self.response_size = len(responsedata)
+        responsedata = responsedata.decode('utf8')
         response = json.loads(responsedata, parse_float=decimal.Decimal)
-        if "error" in response and response["error"] is None:
-            log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
-        else:
-            log.debug("<-- "+responsedata)
+        if log.isEnabledFor(logging.DEBUG):
+            if "error" in response and response["error"] is None:
+                log.debug("<-%s- %s"%(response["id"], json.dumps(response["result"], default=EncodeDecimal, ensure_ascii=self.ensure_ascii)))
+            else:
+                log.debug("<-- "+responsedata)
         return response
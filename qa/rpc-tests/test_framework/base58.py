@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+Base58 and base58check encoding and decoding.
+
+Shared by address.py and contrib/testgen, and therefore also compatible
+with Python 2. Bytes are converted to and from one big number through hex,
+and that number is split into (or built from) chunks of CHUNK_DIGITS
+base58 digits, so there is one big number division or multiplication per
+chunk instead of per digit; the digits within a chunk are converted with
+machine word arithmetic and a table of digit pairs.
+"""
+
+import hashlib
+from binascii import hexlify, unhexlify
+
+b58chars = '123456789ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz'
+b58values = dict((c, i) for (i, c) in enumerate(b58chars))
+
+# 58**10 < 2**63, so a chunk still fits in a machine word
+CHUNK_DIGITS = 10
+POWERS = [58**i for i in range(CHUNK_DIGITS + 1)]
+# All two digit strings, by value
+PAIRS = [a + b for a in b58chars for b in b58chars]
+
+def b58encode(v):
+    """Encode bytes v as a base58 string"""
+    v = bytearray(v)
+    npad = len(v) - len(v.lstrip(b'\0'))
+    value = int(hexlify(v), 16) if v else 0
+    (chunk_size, p2, p4, p6, p8) = (POWERS[CHUNK_DIGITS], POWERS[2], POWERS[4], POWERS[6], POWERS[8])
+    pairs = PAIRS
+    chunks = []
+    while value:
+        (value, c) = divmod(value, chunk_size)
+        chunks.append(pairs[c // p8] + pairs[c // p6 % p2] + pairs[c // p4 % p2] + pairs[c // p2 % p2] + pairs[c % p2])
+    # The most significant chunk is padded with zero digits, and leading
+    # zero bytes are encoded as leading zero digits
+    return b58chars[0] * npad + ''.join(reversed(chunks)).lstrip(b58chars[0])
+
+def b58decode(v, length=None):
+    """
+    Decode base58 string v to bytes. Returns None if v contains invalid
+    characters, or the result is not length bytes long.
+    """
+    npad = len(v) - len(v.lstrip(b58chars[0]))
+    value = 0
+    pos = 0
+    # Make the first chunk the short one
+    step = len(v) % CHUNK_DIGITS or CHUNK_DIGITS
+    try:
+        while pos < len(v):
+            chunk = 0
+            for c in v[pos:pos+step]:
+                chunk = chunk * 58 + b58values[c]
+            value = value * POWERS[step] + chunk
+            pos += step
+            step = CHUNK_DIGITS
+    except KeyError:
+        return None
+    digits = '%x' % value if value else ''
+    result = b'\0' * npad + unhexlify(('0' * (len(digits) % 2)) + digits)
+    if length is not None and len(result) != length:
+        return None
+    return result
+
+def checksum(v):
+    """Return 32-bit checksum based on SHA256"""
+    return hashlib.sha256(hashlib.sha256(v).digest()).digest()[0:4]
+
+def b58encode_chk(v):
+    """b58encode a string, with 32-bit checksum"""
+    return b58encode(v + checksum(v))
+
+def b58decode_chk(v):
+    """Decode a base58 string, check and remove checksum. Returns None if invalid."""
+    result = b58decode(v)
+    if result is None or len(result) < 4:
+        return None
+    if result[-4:] == checksum(result[:-4]):
+        return result[:-4]
+    return None
+
+def b58encode_chk_list(vs):
+    """b58encode_chk every bytes object in vs"""
+    encode = b58encode_chk
+    return [encode(v) for v in vs]
+
+def b58decode_chk_list(vs):
+    """b58decode_chk every string in vs; invalid ones decode to None"""
+    decode = b58decode_chk
+    return [decode(v) for v in vs]
@@ -22,65 +22,39 @@ def bn_bytes(v, have_ext=False):
         ext = 1
     return ((v.bit_length()+7)//8) + ext
 
+def sm_bytes(v):
+    """Bytes needed for the sign-magnitude encoding of v, keeping the top bit free for the sign"""
+    return (v.bit_length() + 8) // 8 if v else 0
+
+def sm_magnitude(v, size):
+    """Magnitude of v with the sign bit of a size byte encoding set if v is negative"""
+    return (-v) | (0x80 << ((size - 1) * 8)) if v < 0 else v
+
+def sm_value(m, size):
+    """Inverse of sm_magnitude"""
+    sign = 0x80 << ((size - 1) * 8)
+    return -(m ^ sign) if m & sign else m
+
 def bn2bin(v):
-    s = bytearray()
-    i = bn_bytes(v)
-    while i > 0:
-        s.append((v >> ((i-1) * 8)) & 0xff)
-        i -= 1
-    return s
+    """Big endian bytes of non-negative v"""
+    return bytearray(v.to_bytes(bn_bytes(v), 'big'))
 
 def bin2bn(s):
-    l = 0
-    for ch in s:
-        l = (l << 8) | ch
-    return l
+    return int.from_bytes(s, 'big')
 
 def bn2mpi(v):
-    have_ext = False
-    if v.bit_length() > 0:
-        have_ext = (v.bit_length() & 0x07) == 0
-
-    neg = False
-    if v < 0:
-        neg = True
-        v = -v
-
-    s = struct.pack(b">I", bn_bytes(v, have_ext))
-    ext = bytearray()
-    if have_ext:
-        ext.append(0)
-    v_bin = bn2bin(v)
-    if neg:
-        if have_ext:
-            ext[0] |= 0x80
-        else:
-            v_bin[0] |= 0x80
-    return s + ext + v_bin
+    size = sm_bytes(v)
+    return struct.pack(b">I", size) + sm_magnitude(v, size).to_bytes(size, 'big')
 
 def mpi2bn(s):
     if len(s) < 4:
         return None
-    s_size = bytes(s[:4])
-    v_len = struct.unpack(b">I", s_size)[0]
+    v_len = struct.unpack(b">I", bytes(s[:4]))[0]
     if len(s) != (v_len + 4):
         return None
     if v_len == 0:
         return 0
-
-    v_str = bytearray(s[4:])
-    neg = False
-    i = v_str[0]
-    if i & 0x80:
-        neg = True
-        i &= ~0x80
-        v_str[0] = i
-
-    v = bin2bn(v_str)
-
-    if neg:
-        return -v
-    return v
+    return sm_value(int.from_bytes(s[4:], 'big'), v_len)
 
 # bitcoin-specific little endian format, with implicit size
 def mpi2vch(s):
@@ -89,13 +63,23 @@ def mpi2vch(s):
     return r
 
 def bn2vch(v):
-    return bytes(mpi2vch(bn2mpi(v)))
+    """Minimal little endian sign-magnitude encoding of v, as used for script numbers"""
+    size = sm_bytes(v)
+    return sm_magnitude(v, size).to_bytes(size, 'little')
 
 def vch2mpi(s):
     r = struct.pack(b">I", len(s))   # size
     r += s[::-1]            # reverse string, converting LE->BE
     return r
 
-def vch2bn(s):
-    return mpi2bn(vch2mpi(s))
-
+def vch2bn(s, require_minimal=False):
+    """
+    Decode a little endian sign-magnitude number. With require_minimal, a
+    ValueError is raised if s is not the minimal encoding, like script
+    numbers must be.
+    """
+    if not s:
+        return 0
+    if require_minimal and not (s[-1] & 0x7f) and (len(s) == 1 or not (s[-2] & 0x80)):
+        raise ValueError('Non-minimally encoded number %r' % bytes(s))
+    return sm_value(int.from_bytes(s, 'little'), len(s))
@@ -5,7 +5,11 @@
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 
 from .mininode import *
-from .script import CScript, OP_TRUE, OP_CHECKSIG, OP_RETURN
+from .script import CScript, OP_TRUE, OP_CHECKSIG, OP_RETURN, SIGHASH_ALL
+
+from binascii import hexlify
+from io import BytesIO
+import struct
 
 # Create a block (with regtest difficulty)
 def create_block(hashprev, coinbase, nTime=None):
@@ -89,6 +93,252 @@ def create_transaction(prevtx, n, sig, value, scriptPubKey=CScript()):
     tx.calc_sha256()
     return tx
 
+# Fields that LazyTransaction deserializes on first use
+LAZY_TX_FIELDS = frozenset(['nVersion', 'vin', 'vout', 'wit', 'nLockTime'])
+
+class LazyTransaction(CTransaction):
+    """
+    A transaction without witness, kept as raw bytes with a known txid.
+    It is only deserialized into a full CTransaction when one of its fields
+    is used, after which it behaves like any other CTransaction (including
+    the need to rehash() after modifying it).
+    """
+    def __init__(self, raw, digest=None):
+        self.raw = raw
+        self.set_hash(hash256(raw) if digest is None else digest)
+
+    def set_hash(self, digest):
+        self.sha256 = int.from_bytes(digest, 'little')
+        self.hash = hexlify(digest[::-1]).decode('ascii')
+
+    def __getattr__(self, name):
+        # Only called for attributes that are not set yet
+        if name not in LAZY_TX_FIELDS or self.__dict__.get('raw') is None:
+            raise AttributeError(name)
+        (sha256, txhash) = (self.sha256, self.hash)
+        self.wit = CTxWitness()
+        self.deserialize(BytesIO(self.raw))
+        (self.sha256, self.hash) = (sha256, txhash)
+        self.raw = None
+        return getattr(self, name)
+
+    def serialize_without_witness(self):
+        if self.raw is not None:
+            return self.raw
+        return super(LazyTransaction, self).serialize_without_witness()
+
+    def serialize_with_witness(self):
+        if self.raw is not None:
+            return self.raw
+        return super(LazyTransaction, self).serialize_with_witness()
+
+    def calc_sha256(self, with_witness=False):
+        if self.raw is not None:
+            # After rehash()
+            if self.sha256 is None:
+                self.set_hash(hash256(self.raw))
+            # Without witness the txid and wtxid are the same
+            return self.sha256 if with_witness else None
+        return super(LazyTransaction, self).calc_sha256(with_witness)
+
+OUTPOINT = struct.Struct("<32sI")
+AMOUNT = struct.Struct("<q")
+
+def patch_script(buf, offset, size, script):
+    if len(script) != size:
+        raise ValueError('Script of %d bytes does not fit the template (%d bytes)' % (len(script), size))
+    buf[offset:offset+size] = script
+
+class TxFactory(object):
+    """
+    Creates transactions from a template by patching the serialized template.
+
+    The template (a CTransaction without witness) is serialized once, and
+    the offsets of the prevout of every input and the value of every output
+    are remembered. Each new transaction copies the template into a
+    preallocated buffer, overwrites the given prevouts, values and scripts
+    in place and hashes the result, so no transaction objects are built
+    unless asked for. Scripts can only be replaced by scripts of the same
+    length. Fields that are not given keep the template's value.
+
+    Prevout txids may be given as ints (like CTransaction.sha256) or as the
+    32 byte little endian hash.
+    """
+    def __init__(self, template):
+        assert template.wit.is_null()
+        self.template = template.serialize_without_witness()
+        self.buf = bytearray(self.template)
+        self.prevout_offsets = []
+        self.script_sig_slices = []
+        self.value_offsets = []
+        self.script_pubkey_slices = []
+        f = BytesIO(self.template)
+        f.seek(4) # nVersion
+        for i in range(deser_compact_size(f)):
+            self.prevout_offsets.append(f.tell())
+            f.seek(36, 1)
+            size = deser_compact_size(f)
+            self.script_sig_slices.append((f.tell(), size))
+            f.seek(size + 4, 1) # scriptSig, nSequence
+        for i in range(deser_compact_size(f)):
+            self.value_offsets.append(f.tell())
+            f.seek(8, 1)
+            size = deser_compact_size(f)
+            self.script_pubkey_slices.append((f.tell(), size))
+            f.seek(size, 1)
+
+    def create_raw(self, prevouts=(), values=(), script_sigs=(), script_pubkeys=()):
+        """
+        Return the serialization of a transaction with the prevouts of the
+        first inputs replaced by the (txid, n) pairs in prevouts, the values
+        of the first outputs by values, and so on.
+        """
+        buf = self.buf
+        buf[:] = self.template
+        for (offset, (txid, n)) in zip(self.prevout_offsets, prevouts):
+            if isinstance(txid, int):
+                txid = txid.to_bytes(32, 'little')
+            OUTPOINT.pack_into(buf, offset, txid, n)
+        for (offset, value) in zip(self.value_offsets, values):
+            AMOUNT.pack_into(buf, offset, value)
+        for ((offset, size), script) in zip(self.script_sig_slices, script_sigs):
+            patch_script(buf, offset, size, script)
+        for ((offset, size), script) in zip(self.script_pubkey_slices, script_pubkeys):
+            patch_script(buf, offset, size, script)
+        return bytes(buf)
+
+    def create(self, prevouts=(), values=(), script_sigs=(), script_pubkeys=()):
+        """Like create_raw, but return a LazyTransaction"""
+        return LazyTransaction(self.create_raw(prevouts, values, script_sigs, script_pubkeys))
+
+    def create_many(self, prevouts, values=None):
+        """
+        Return a LazyTransaction for every entry of prevouts, a list of the
+        (txid, n) pairs of each transaction, with the output values given by
+        the matching entry of values.
+        """
+        if values is None:
+            values = [()] * len(prevouts)
+        create_raw = self.create_raw
+        return [LazyTransaction(create_raw(p, v)) for (p, v) in zip(prevouts, values)]
+
+    def create_chain(self, prevout, values):
+        """
+        Return a chain of len(values) transactions, the first spending prevout
+        and each of the others output 0 of the one before, where output 0 of
+        the i-th transaction has value values[i].
+        """
+        txs = []
+        create_raw = self.create_raw
+        for value in values:
+            raw = create_raw((prevout,), (value,))
+            digest = hash256(raw)
+            txs.append(LazyTransaction(raw, digest))
+            prevout = (digest, 0)
+        return txs
+
+# Largest filler transaction create_large_block puts in a block
+MAX_FILLER_TX_SIZE = 100000
+# Size of the witness commitment output in the coinbase
+WITNESS_COMMITMENT_OUTPUT_SIZE = 8 + 1 + 2 + len(WITNESS_COMMITMENT_HEADER) + 32
+# Length of the DER signatures create_large_block makes, so that the
+# transaction sizes are known before signing
+FILLER_SIG_SIZE = 71
+
+def op_return_sizes(size):
+    """Script lengths of OP_RETURN outputs that serialize to exactly size bytes together"""
+    if size == 0:
+        return []
+    for length in (size - 9, size - 11, size - 13):
+        if length >= 1 and 8 + len(ser_compact_size(length)) + length == size:
+            return [length]
+    if size < 20:
+        raise ValueError('No outputs serialize to %d bytes' % size)
+    # The compact size of the script length changes in between
+    return op_return_sizes(size // 2) + op_return_sizes(size - size // 2)
+
+def create_large_block(hashprev, height, utxos, size, nTime=None, key=None, segwit=True, tx_size=MAX_FILLER_TX_SIZE):
+    """
+    Create a block of exactly size bytes (without witness) spending outputs
+    from utxos, without any RPC.
+
+    utxos is a list of (txid, n, value) outputs that are anyone-can-spend
+    (OP_TRUE) or, if key (a CECKey) is given, pay to key's public key, like
+    the coinbase outputs of create_coinbase(height, key.get_pubkey()). The
+    block is filled with a chain of transactions of at most tx_size bytes,
+    padded with zero-value OP_RETURN outputs. The first one spends the last
+    output in utxos, which is removed, and the change output of the last
+    one, to the same kind of script, is appended. So as long as the blocks
+    are accepted, any number of them can be built from one output. If
+    segwit, the witness commitment is added to the coinbase. The block is
+    not solved; submit it with
+    node.submitblock(bytes_to_hex_str(block.serialize(True))) or as a
+    msg_witness_block.
+    """
+    assert tx_size >= 1000
+    if key is None:
+        script_pubkey = CScript([OP_TRUE])
+        script_sig_size = 0
+    else:
+        script_pubkey = CScript([key.get_pubkey(), OP_CHECKSIG])
+        script_sig_size = 1 + FILLER_SIG_SIZE + 1
+    coinbase = create_coinbase(height, None if key is None else key.get_pubkey())
+    change_output = ser_compact_size(len(script_pubkey)) + script_pubkey
+    # Transaction without OP_RETURN outputs (fewer than 253 of them)
+    tx_fixed_size = 4 + 1 + 36 + len(ser_compact_size(script_sig_size)) + script_sig_size + 4 + 1 + 8 + len(change_output) + 4
+
+    fill = size - 80 - len(coinbase.serialize()) - (WITNESS_COMMITMENT_OUTPUT_SIZE if segwit else 0)
+    # Number of filler transactions, given the size of the transaction count
+    num_txs = 0
+    while True:
+        available = fill - len(ser_compact_size(num_txs + 1))
+        needed = -(-available // tx_size)
+        if needed == num_txs:
+            break
+        num_txs = needed
+    if available < 0 or (0 < available < tx_fixed_size + 10 and available != tx_fixed_size):
+        raise ValueError('Cannot create a block of exactly %d bytes' % size)
+
+    block = create_block(hashprev, coinbase, nTime)
+    if num_txs:
+        if not utxos:
+            raise ValueError('No output to spend')
+        (txid, n, value) = utxos.pop()
+        if isinstance(txid, int):
+            txid = txid.to_bytes(32, 'little')
+    for i in range(num_txs):
+        # Spread the fill evenly
+        target = available // num_txs + (1 if i < available % num_txs else 0)
+        fillers = [struct.pack('<q', 0) + ser_compact_size(length) + b'\x6a' + bytes(length - 1)
+                   for length in op_return_sizes(target - tx_fixed_size)]
+        head = struct.pack('<i', 1) + b'\x01' + OUTPOINT.pack(txid, n)
+        tail = (struct.pack('<I', 0xffffffff) + ser_compact_size(1 + len(fillers)) +
+                struct.pack('<q', value) + change_output + b''.join(fillers) + struct.pack('<I', 0))
+        if key is None:
+            raw = head + b'\x00' + tail
+        else:
+            # Legacy signature hash of the only input with SIGHASH_ALL
+            sighash = hash256(head + ser_string(script_pubkey) + tail + struct.pack('<I', SIGHASH_ALL))
+            while True:
+                sig = key.sign(sighash)
+                if len(sig) == FILLER_SIG_SIZE:
+                    break
+            raw = head + ser_string(ser_string(sig + bytes([SIGHASH_ALL]))) + tail
+        assert len(raw) == target
+        txid = hash256(raw)
+        n = 0
+        block.vtx.append(LazyTransaction(raw, txid))
+    if num_txs:
+        utxos.append((block.vtx[-1].sha256, 0, value))
+
+    if segwit:
+        add_witness_commitment(block)
+    else:
+        block.hashMerkleRoot = block.calc_merkle_root()
+        block.rehash()
+    assert len(block.serialize()) == size
+    return block
+
 def get_legacy_sigopcount_block(block, fAccurate=True):
     count = 0
     for tx in block.vtx:
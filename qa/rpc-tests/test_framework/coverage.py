@@ -8,50 +8,111 @@ This module contains utilities for doing coverage analysis on the RPC
 interface.
 
 It provides a way to track which RPC commands are exercised during
-testing.
+testing, how often and how long they take.
 
 """
+import atexit
 import os
+import time
+
+from . import profiler
 
 
 REFERENCE_FILENAME = 'rpc_interface.txt'
 
+# Write out counters after this many calls, in addition to at exit
+FLUSH_INTERVAL = 10000
+
+
+class CoverageLog(object):
+    """
+    Per-method call counts and cumulative latency for one coverage file,
+    kept in memory and appended to the file in batches. Each flush appends
+    one "<method> <calls> <seconds>" line per method called since the last
+    flush.
+
+    """
+    _logs = {}
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.calls = {}
+        self.seconds = {}
+        self.pending = 0
+
+    @classmethod
+    def get(cls, filename):
+        if filename not in cls._logs:
+            cls._logs[filename] = cls(filename)
+        return cls._logs[filename]
+
+    @classmethod
+    def flush_all(cls):
+        for log in cls._logs.values():
+            log.flush()
+
+    def record(self, rpc_method, seconds):
+        self.calls[rpc_method] = self.calls.get(rpc_method, 0) + 1
+        self.seconds[rpc_method] = self.seconds.get(rpc_method, 0.0) + seconds
+        self.pending += 1
+        if self.pending >= FLUSH_INTERVAL:
+            self.flush()
+
+    def flush(self):
+        if not self.calls:
+            return
+        with open(self.filename, 'a+', encoding='utf8') as f:
+            for rpc_method in sorted(self.calls):
+                f.write("%s %d %.6f\n" % (rpc_method, self.calls[rpc_method], self.seconds[rpc_method]))
+        self.calls = {}
+        self.seconds = {}
+        self.pending = 0
+
+atexit.register(CoverageLog.flush_all)
+
 
 class AuthServiceProxyWrapper(object):
     """
     An object that wraps AuthServiceProxy to record specific RPC calls.
 
     """
-    def __init__(self, auth_service_proxy_instance, coverage_logfile=None):
+    def __init__(self, auth_service_proxy_instance, coverage_logfile=None, node_number=None):
         """
         Kwargs:
             auth_service_proxy_instance (AuthServiceProxy): the instance
                 being wrapped.
-            coverage_logfile (str): if specified, write each service_name
-                out to a file when called.
+            coverage_logfile (str): if specified, count calls per
+                service_name and write the counts out to this file.
+            node_number (int): the node called, reported to the profiler.
 
         """
         self.auth_service_proxy_instance = auth_service_proxy_instance
         self.coverage_logfile = coverage_logfile
+        self.node_number = node_number
 
     def __getattr__(self, *args, **kwargs):
         return_val = self.auth_service_proxy_instance.__getattr__(
             *args, **kwargs)
 
-        return AuthServiceProxyWrapper(return_val, self.coverage_logfile)
+        return AuthServiceProxyWrapper(return_val, self.coverage_logfile, self.node_number)
 
     def __call__(self, *args, **kwargs):
         """
-        Delegates to AuthServiceProxy, then writes the particular RPC method
-        called to a file.
+        Delegates to AuthServiceProxy, then records the particular RPC method
+        called and its latency.
 
         """
+        time0 = time.time()
         return_val = self.auth_service_proxy_instance.__call__(*args, **kwargs)
+        elapsed = time.time() - time0
         rpc_method = self.auth_service_proxy_instance._service_name
 
         if self.coverage_logfile:
-            with open(self.coverage_logfile, 'a+', encoding='utf8') as f:
-                f.write("%s\n" % rpc_method)
+            CoverageLog.get(self.coverage_logfile).record(rpc_method, elapsed)
+        if profiler.PROFILER is not None:
+            proxy = self.auth_service_proxy_instance
+            profiler.PROFILER.record_rpc(self.node_number, rpc_method, elapsed,
+                                         proxy.request_size, proxy.response_size)
 
         return return_val
 
@@ -37,6 +37,7 @@ from threading import Thread
 import logging
 import copy
 from test_framework.siphash import siphash256
+from test_framework import profiler
 
 BIP0031_VERSION = 60000
 MY_VERSION = 70014  # past bip-31 for ping/pong
@@ -1740,10 +1741,14 @@ class NodeConn(asyncore.dispatcher):
                         raise ValueError("got bad checksum " + repr(self.recvbuf))
                     self.recvbuf = self.recvbuf[4+12+4+4+msglen:]
                 if command in self.messagemap:
+                    time0 = time.time()
                     f = BytesIO(msg)
                     t = self.messagemap[command]()
                     t.deserialize(f)
                     self.got_message(t)
+                    if profiler.PROFILER is not None:
+                        profiler.PROFILER.record_message(command.decode('ascii'), "recv",
+                                                         4 + 12 + 4 + 4 + msglen, time.time() - time0)
                 else:
                     self.show_debug_msg("Unknown command: '" + command + "' " +
                                         repr(msg))
@@ -1756,6 +1761,7 @@ class NodeConn(asyncore.dispatcher):
         if self.state != "connected" and not pushbuf:
             raise IOError('Not connected, no pushbuf')
         self.show_debug_msg("Send %s" % repr(message))
+        time0 = time.time()
         command = message.command
         data = message.serialize()
         tmsg = self.MAGIC_BYTES[self.network]
@@ -1770,6 +1776,9 @@ class NodeConn(asyncore.dispatcher):
         with mininode_lock:
             self.sendbuf += tmsg
             self.last_sent = time.time()
+        if profiler.PROFILER is not None:
+            profiler.PROFILER.record_message(command.decode('ascii'), "send",
+                                             len(tmsg), time.time() - time0)
 
     def got_message(self, message):
         if message.command == b"version":
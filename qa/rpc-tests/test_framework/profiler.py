@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+Profiling of a test run.
+
+When enabled (BitcoinTestFramework --profiledir), this records:
+
+- every RPC call: node, method, latency, request and response size
+- every mininode message: command, direction, size and the time spent
+  serializing it (send) or deserializing and delivering it (receive)
+- periodic stack samples of all Python threads of the test
+- time spent in time.sleep, which is wrapped while profiling
+
+At the end of the test, a JSON summary and the stack samples in folded
+format (one "frame;frame;frame count" line per stack, as consumed by
+flamegraph.pl) are written out. Comparing the total RPC time, the message
+handling time and the samples inside time.sleep against the wall time
+tells whether a slow test is waiting on bitcoind, on Python or on sleeps.
+"""
+
+import json
+import os
+import sys
+import threading
+import time
+
+# The active Profiler, if any. Set by enable_profiling().
+PROFILER = None
+
+# Seconds between stack samples
+SAMPLE_INTERVAL = 0.005
+
+def enable_profiling(sample_interval=SAMPLE_INTERVAL):
+    global PROFILER
+    PROFILER = Profiler(sample_interval)
+    PROFILER.start()
+    return PROFILER
+
+class Profiler(object):
+    def __init__(self, sample_interval):
+        self.sample_interval = sample_interval
+        self.lock = threading.Lock()
+        # (node, method) -> [calls, seconds, max seconds, bytes sent, bytes received]
+        self.rpcs = {}
+        # (command, direction) -> [messages, bytes, seconds]
+        self.messages = {}
+        # folded stack -> number of samples
+        self.stacks = {}
+        self.num_samples = 0
+        self.sleep_seconds = 0.0
+        self.real_sleep = time.sleep
+        self.start_time = None
+        self.stop_time = None
+        self.sampler = None
+        self.stopping = threading.Event()
+
+    def start(self):
+        self.start_time = time.time()
+        # time.sleep is implemented in C and so never shows up in the stack
+        # samples; a Python wrapper does, and lets us count the time.
+        real_sleep = self.real_sleep
+        def sleep(seconds):
+            time0 = time.time()
+            real_sleep(seconds)
+            with self.lock:
+                self.sleep_seconds += time.time() - time0
+        time.sleep = sleep
+        self.sampler = threading.Thread(target=self._sample_loop, name="profiler")
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def stop(self):
+        if self.stop_time is None:
+            self.stop_time = time.time()
+            time.sleep = self.real_sleep
+            self.stopping.set()
+            self.sampler.join()
+
+    def record_rpc(self, node, method, seconds, sent, received):
+        with self.lock:
+            entry = self.rpcs.setdefault((node, method), [0, 0.0, 0.0, 0, 0])
+            entry[0] += 1
+            entry[1] += seconds
+            entry[2] = max(entry[2], seconds)
+            entry[3] += sent
+            entry[4] += received
+
+    def record_message(self, command, direction, size, seconds):
+        with self.lock:
+            entry = self.messages.setdefault((command, direction), [0, 0, 0.0])
+            entry[0] += 1
+            entry[1] += size
+            entry[2] += seconds
+
+    def _sample_loop(self):
+        own_id = threading.current_thread().ident
+        while not self.stopping.wait(self.sample_interval):
+            names = {t.ident: t.name for t in threading.enumerate()}
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                stack = []
+                while frame is not None:
+                    code = frame.f_code
+                    stack.append("%s:%s" % (os.path.basename(code.co_filename), code.co_name))
+                    frame = frame.f_back
+                stack.append(names.get(thread_id, str(thread_id)))
+                folded = ";".join(reversed(stack)).replace(" ", "_")
+                with self.lock:
+                    self.stacks[folded] = self.stacks.get(folded, 0) + 1
+                    self.num_samples += 1
+
+    def summary(self):
+        with self.lock:
+            wall = (self.stop_time or time.time()) - self.start_time
+            rpcs = [{'node': node, 'method': method, 'calls': e[0], 'seconds': e[1],
+                     'max_seconds': e[2], 'bytes_sent': e[3], 'bytes_received': e[4]}
+                    for (node, method), e in sorted(self.rpcs.items(), key=lambda i: -i[1][1])]
+            messages = [{'command': command, 'direction': direction, 'messages': e[0],
+                         'bytes': e[1], 'seconds': e[2]}
+                        for (command, direction), e in sorted(self.messages.items(), key=lambda i: -i[1][2])]
+            sleep_samples = sum(n for stack, n in self.stacks.items() if stack.endswith("profiler.py:sleep"))
+            return {
+                'wall_seconds': wall,
+                'rpc_seconds': sum(r['seconds'] for r in rpcs),
+                'message_seconds': sum(m['seconds'] for m in messages),
+                'sleep_seconds': self.sleep_seconds,
+                'samples': self.num_samples,
+                'sleep_samples': sleep_samples,
+                'sample_interval': self.sample_interval,
+                'rpcs': rpcs,
+                'messages': messages,
+            }
+
+    def write(self, dirname, name):
+        """Write <name>.profile.json and <name>.folded into dirname"""
+        self.stop()
+        os.makedirs(dirname, exist_ok=True)
+        with open(os.path.join(dirname, name + ".profile.json"), 'w', encoding='utf8') as f:
+            json.dump(self.summary(), f, indent=1)
+        with open(os.path.join(dirname, name + ".folded"), 'w', encoding='utf8') as f:
+            for stack, count in sorted(self.stacks.items()):
+                f.write("%s %d\n" % (stack, count))
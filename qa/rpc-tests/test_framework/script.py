@@ -29,7 +29,7 @@ if sys.version > '3':
 
 import struct
 
-from .bignum import bn2vch
+from .bignum import bn2vch, vch2bn
 
 MAX_SCRIPT_SIZE = 10000
 MAX_SCRIPT_ELEMENT_SIZE = 520
@@ -629,19 +629,17 @@ class CScriptNum(object):
 
     @staticmethod
     def encode(obj):
-        r = bytearray(0)
         if obj.value == 0:
-            return bytes(r)
-        neg = obj.value < 0
-        absvalue = -obj.value if neg else obj.value
-        while (absvalue):
-            r.append(absvalue & 0xff)
-            absvalue >>= 8
-        if r[-1] & 0x80:
-            r.append(0x80 if neg else 0)
-        elif neg:
-            r[-1] |= 0x80
-        return bytes(bchr(len(r)) + r)
+            return b''
+        r = bn2vch(obj.value)
+        return bchr(len(r)) + r
+
+    @staticmethod
+    def decode(vch):
+        """Decode the output of encode(), requiring minimal encoding"""
+        if not vch:
+            return 0
+        return vch2bn(vch[1:1+vch[0]], require_minimal=True)
 
 
 class CScript(bytes):
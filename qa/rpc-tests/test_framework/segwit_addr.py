@@ -0,0 +1,140 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 Pieter Wuille
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+Bech32 and segwit address encoding and decoding (BIP173).
+
+The checksum polymod is table driven: the five generator terms selected
+by the top five bits of the checksum are combined in advance for all 32
+values of those bits. The checksum state after the human readable part is
+computed once per hrp and cached, so encoding or decoding many addresses
+of the same network only runs the polymod over the data part of each.
+"""
+
+CHARSET = "qpzry9x8gf2tvdw0s3jn54khce6mua7l"
+CHARSET_VALUES = {c: i for (i, c) in enumerate(CHARSET)}
+
+GENERATOR = [0x3b6a57b2, 0x26508e6d, 0x1ea119fa, 0x3d4233dd, 0x2a1462b3]
+# XOR of the generator terms selected by each value of the top five bits
+POLYMOD_TABLE = [0] * 32
+for top in range(32):
+    for i in range(5):
+        if (top >> i) & 1:
+            POLYMOD_TABLE[top] ^= GENERATOR[i]
+del top, i
+
+# hrp -> polymod state after the expanded hrp
+hrp_states = {}
+
+def bech32_polymod(values, chk=1):
+    """Internal function that computes the Bech32 checksum"""
+    table = POLYMOD_TABLE
+    for value in values:
+        chk = ((chk & 0x1ffffff) << 5) ^ value ^ table[chk >> 25]
+    return chk
+
+def bech32_hrp_expand(hrp):
+    """Expand the HRP into values for checksum computation"""
+    return [ord(x) >> 5 for x in hrp] + [0] + [ord(x) & 31 for x in hrp]
+
+def hrp_state(hrp):
+    """Polymod state after the expanded hrp"""
+    state = hrp_states.get(hrp)
+    if state is None:
+        state = hrp_states[hrp] = bech32_polymod(bech32_hrp_expand(hrp))
+    return state
+
+def bech32_verify_checksum(hrp, data):
+    """Verify a checksum given HRP and converted data characters"""
+    return bech32_polymod(data, hrp_state(hrp)) == 1
+
+def bech32_create_checksum(hrp, data):
+    """Compute the checksum values given HRP and data"""
+    polymod = bech32_polymod([0, 0, 0, 0, 0, 0], bech32_polymod(data, hrp_state(hrp))) ^ 1
+    return [(polymod >> 5 * (5 - i)) & 31 for i in range(6)]
+
+def bech32_encode(hrp, data):
+    """Compute a Bech32 string given HRP and data values"""
+    combined = data + bech32_create_checksum(hrp, data)
+    return hrp + '1' + ''.join([CHARSET[d] for d in combined])
+
+def bech32_decode(bech):
+    """Validate a Bech32 string, and determine HRP and data. Returns (None, None) if invalid."""
+    if ((any(ord(x) < 33 or ord(x) > 126 for x in bech)) or
+            (bech.lower() != bech and bech.upper() != bech)):
+        return (None, None)
+    bech = bech.lower()
+    pos = bech.rfind('1')
+    if pos < 1 or pos + 7 > len(bech) or len(bech) > 90:
+        return (None, None)
+    try:
+        data = [CHARSET_VALUES[x] for x in bech[pos+1:]]
+    except KeyError:
+        return (None, None)
+    hrp = bech[:pos]
+    if not bech32_verify_checksum(hrp, data):
+        return (None, None)
+    return (hrp, data[:-6])
+
+def convertbits(data, frombits, tobits, pad=True):
+    """General power-of-2 base conversion. Returns None if data is invalid."""
+    acc = 0
+    bits = 0
+    ret = []
+    maxv = (1 << tobits) - 1
+    max_acc = (1 << (frombits + tobits - 1)) - 1
+    for value in data:
+        if value < 0 or (value >> frombits):
+            return None
+        acc = ((acc << frombits) | value) & max_acc
+        bits += frombits
+        while bits >= tobits:
+            bits -= tobits
+            ret.append((acc >> bits) & maxv)
+    if pad:
+        if bits:
+            ret.append((acc << (tobits - bits)) & maxv)
+    elif bits >= frombits or ((acc << (tobits - bits)) & maxv):
+        return None
+    return ret
+
+def decode(hrp, addr):
+    """Decode a segwit address into (witness version, witness program), or (None, None) if invalid"""
+    hrpgot, data = bech32_decode(addr)
+    if hrpgot != hrp:
+        return (None, None)
+    decoded = convertbits(data[1:], 5, 8, False)
+    if decoded is None or len(decoded) < 2 or len(decoded) > 40:
+        return (None, None)
+    if data[0] > 16:
+        return (None, None)
+    if data[0] == 0 and len(decoded) != 20 and len(decoded) != 32:
+        return (None, None)
+    return (data[0], bytes(decoded))
+
+def encode(hrp, witver, witprog):
+    """Encode a segwit address"""
+    assert 0 <= witver <= 16 and 2 <= len(witprog) <= 40
+    ret = bech32_encode(hrp, [witver] + convertbits(witprog, 8, 5))
+    assert decode(hrp, ret) != (None, None)
+    return ret
+
+def encode_list(hrp, witver, witprogs):
+    """Encode segwit addresses for all witness programs in witprogs"""
+    assert 0 <= witver <= 16
+    prefix = hrp + '1' + CHARSET[witver]
+    start = bech32_polymod([witver], hrp_state(hrp))
+    ret = []
+    for witprog in witprogs:
+        assert 2 <= len(witprog) <= 40
+        data = convertbits(witprog, 8, 5)
+        polymod = bech32_polymod(data + [0, 0, 0, 0, 0, 0], start) ^ 1
+        ret.append(prefix + ''.join([CHARSET[d] for d in data]) +
+                   ''.join([CHARSET[(polymod >> 5 * (5 - i)) & 31] for i in range(6)]))
+    return ret
+
+def decode_list(hrp, addrs):
+    """Decode segwit addresses into a list of (witness version, witness program), (None, None) for invalid ones"""
+    return [decode(hrp, addr) for addr in addrs]
@@ -3,10 +3,18 @@
 # Distributed under the MIT software license, see the accompanying
 # file COPYING or http://www.opensource.org/licenses/mit-license.php.
 '''
-Dummy Socks5 server for testing.
+Socks5 server for testing.
+
+All connections are handled by one thread running a selectors event loop,
+so hundreds of concurrent connections are cheap. Every connect request is
+reported on Socks5Server.queue. By default the connection is closed after
+the request (a dummy proxy); if Socks5Configuration.relay is set, the
+server connects to the destination it returns and relays data in both
+directions, keeping byte counters and the connect latency of every
+connection in Socks5Server.stats.
 '''
 
-import socket, threading, queue
+import errno, selectors, socket, threading, time, queue
 import traceback, sys
 
 ### Protocol constants
@@ -18,17 +26,35 @@ class AddressType:
     DOMAINNAME = 0x03
     IPV6 = 0x04
 
+class Reply:
+    SUCCEEDED = 0x00
+    NOT_ALLOWED = 0x02
+    CONNECTION_REFUSED = 0x05
+
+# Stop reading from one side of a relayed connection while this many bytes
+# are waiting to be written to the other side
+MAX_BUFFERED = 256 * 1024
+RECV_SIZE = 64 * 1024
+
 ### Utility functions
-def recvall(s, n):
-    '''Receive n bytes from a socket, or fail'''
-    rv = bytearray()
-    while n > 0:
-        d = s.recv(n)
-        if not d:
-            raise IOError('Unexpected end of stream')
-        rv.extend(d)
-        n -= len(d)
-    return rv
+class IncompleteError(Exception):
+    '''Not enough data has been received yet'''
+
+class BufferReader(object):
+    '''Read from the start of a buffer; raises IncompleteError when it runs out'''
+    def __init__(self, buf):
+        self.buf = buf
+        self.pos = 0
+
+    def read(self, n):
+        if self.pos + n > len(self.buf):
+            raise IncompleteError()
+        rv = self.buf[self.pos:self.pos+n]
+        self.pos += n
+        return rv
+
+    def byte(self):
+        return self.read(1)[0]
 
 ### Implementation classes
 class Socks5Configuration(object):
@@ -38,6 +64,10 @@ class Socks5Configuration(object):
         self.af = socket.AF_INET # Bind address family
         self.unauth = False  # Support unauthenticated
         self.auth = False  # Support authentication
+        # Relay connections: called with every Socks5Command, returns the
+        # (host, port) to connect to, or None to refuse the request. When
+        # not set, connections are closed after the request.
+        self.relay = None
 
 class Socks5Command(object):
     '''Information about an incoming socks5 command'''
@@ -51,78 +81,271 @@ class Socks5Command(object):
     def __repr__(self):
         return 'Socks5Command(%s,%s,%s,%s,%s,%s)' % (self.cmd, self.atyp, self.addr, self.port, self.username, self.password)
 
+class Socks5Stats(object):
+    '''Counters of one proxied connection'''
+    def __init__(self, peer):
+        self.peer = peer
+        self.command = None # Socks5Command, once received
+        self.target = None # (host, port) relayed to
+        self.accepted = time.time()
+        self.requested = None # Time the connect request was received
+        self.connected = None # Time the relayed connection was established
+        self.closed = None
+        self.bytes_sent = 0 # From the client to the target
+        self.bytes_received = 0 # From the target to the client
+
+    @property
+    def connect_latency(self):
+        '''Seconds from the connect request until the target accepted'''
+        if self.requested is None or self.connected is None:
+            return None
+        return self.connected - self.requested
+
+    @property
+    def duration(self):
+        return (self.closed or time.time()) - self.accepted
+
+    def __repr__(self):
+        return 'Socks5Stats(%s,%s,%s,sent=%i,received=%i,connect_latency=%s)' % (self.peer, self.command, self.target, self.bytes_sent, self.bytes_received, self.connect_latency)
+
+class Endpoint(object):
+    '''One socket of a connection and the data waiting to be written to it'''
+    def __init__(self, sock):
+        self.sock = sock
+        self.outbuf = bytearray()
+        self.events = 0 # Events registered with the selector
+        self.eof = False # Nothing more will be read from it
+        self.shut = False # Its write side has been shut down
+
 class Socks5Connection(object):
+    # States
+    GREETING, AUTH, REQUEST, CONNECTING, RELAY, CLOSING = range(6)
+
     def __init__(self, serv, conn, peer):
         self.serv = serv
-        self.conn = conn
+        self.client = Endpoint(conn)
+        self.target = None
         self.peer = peer
+        self.state = self.GREETING
+        self.inbuf = bytearray()
+        self.username = None
+        self.password = None
+        self.stats = Socks5Stats(peer)
+        self.closed = False
 
-    def handle(self):
-        '''
-        Handle socks5 request according to RFC1928
-        '''
-        try:
-            # Verify socks version
-            ver = recvall(self.conn, 1)[0]
-            if ver != 0x05:
-                raise IOError('Invalid socks version %i' % ver)
-            # Choose authentication method
-            nmethods = recvall(self.conn, 1)[0]
-            methods = bytearray(recvall(self.conn, nmethods))
-            method = None
-            if 0x02 in methods and self.serv.conf.auth:
-                method = 0x02 # username/password
-            elif 0x00 in methods and self.serv.conf.unauth:
-                method = 0x00 # unauthenticated
-            if method is None:
-                raise IOError('No supported authentication method was offered')
-            # Send response
-            self.conn.sendall(bytearray([0x05, method]))
-            # Read authentication (optional)
-            username = None
-            password = None
-            if method == 0x02:
-                ver = recvall(self.conn, 1)[0]
-                if ver != 0x01:
-                    raise IOError('Invalid auth packet version %i' % ver)
-                ulen = recvall(self.conn, 1)[0]
-                username = str(recvall(self.conn, ulen))
-                plen = recvall(self.conn, 1)[0]
-                password = str(recvall(self.conn, plen))
-                # Send authentication response
-                self.conn.sendall(bytearray([0x01, 0x00]))
-
-            # Read connect request
-            (ver,cmd,rsv,atyp) = recvall(self.conn, 4)
-            if ver != 0x05:
-                raise IOError('Invalid socks version %i in connect request' % ver)
-            if cmd != Command.CONNECT:
-                raise IOError('Unhandled command %i in connect request' % cmd)
-
-            if atyp == AddressType.IPV4:
-                addr = recvall(self.conn, 4)
-            elif atyp == AddressType.DOMAINNAME:
-                n = recvall(self.conn, 1)[0]
-                addr = recvall(self.conn, n)
-            elif atyp == AddressType.IPV6:
-                addr = recvall(self.conn, 16)
+    def other(self, ep):
+        return self.target if ep is self.client else self.client
+
+    def update(self):
+        '''Register the events to wait for on both sockets'''
+        for ep in (self.client, self.target):
+            if ep is None:
+                continue
+            events = 0
+            if self.state == self.CONNECTING:
+                if ep is self.target:
+                    events = selectors.EVENT_WRITE
             else:
-                raise IOError('Unknown address type %i' % atyp)
-            port_hi,port_lo = recvall(self.conn, 2)
-            port = (port_hi << 8) | port_lo
+                if ep.outbuf:
+                    events |= selectors.EVENT_WRITE
+                if not ep.eof and (self.state == self.RELAY and len(self.other(ep).outbuf) < MAX_BUFFERED or
+                                   self.state < self.CONNECTING and ep is self.client):
+                    events |= selectors.EVENT_READ
+            if events != ep.events:
+                if not ep.events:
+                    self.serv.selector.register(ep.sock, events, (self, ep))
+                elif not events:
+                    self.serv.selector.unregister(ep.sock)
+                else:
+                    self.serv.selector.modify(ep.sock, events, (self, ep))
+                ep.events = events
+
+    def send(self, ep, data):
+        ep.outbuf.extend(data)
+        self.flush(ep)
 
-            # Send dummy response
-            self.conn.sendall(bytearray([0x05, 0x00, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]))
+    def flush(self, ep):
+        if ep.outbuf:
+            try:
+                n = ep.sock.send(ep.outbuf)
+            except (BlockingIOError, InterruptedError):
+                return
+            del ep.outbuf[:n]
+        if not ep.outbuf and self.state == self.RELAY and self.other(ep).eof and not ep.shut:
+            # Pass on the half-close
+            ep.sock.shutdown(socket.SHUT_WR)
+            ep.shut = True
 
-            cmdin = Socks5Command(cmd, atyp, addr, port, username, password)
-            self.serv.queue.put(cmdin)
-            print('Proxy: ', cmdin)
-            # Fall through to disconnect
+    def handle_event(self, ep, mask):
+        try:
+            if self.state == self.CONNECTING:
+                self.handle_connect()
+            else:
+                if mask & selectors.EVENT_WRITE:
+                    self.flush(ep)
+                if mask & selectors.EVENT_READ:
+                    self.handle_read(ep)
+            if self.state == self.CLOSING and not self.client.outbuf:
+                self.close()
+            elif self.state == self.RELAY and self.client.shut and self.target.shut:
+                self.close()
+            else:
+                self.update()
         except Exception as e:
-            traceback.print_exc(file=sys.stderr)
-            self.serv.queue.put(e)
-        finally:
-            self.conn.close()
+            if self.state < self.CONNECTING:
+                # Error in the socks5 negotiation
+                traceback.print_exc(file=sys.stderr)
+                self.serv.queue.put(e)
+            self.close()
+
+    def handle_read(self, ep):
+        try:
+            data = ep.sock.recv(RECV_SIZE)
+        except (BlockingIOError, InterruptedError):
+            return
+        if self.state == self.RELAY:
+            if data:
+                if ep is self.client:
+                    self.stats.bytes_sent += len(data)
+                else:
+                    self.stats.bytes_received += len(data)
+                self.send(self.other(ep), data)
+            else:
+                ep.eof = True
+                self.flush(self.other(ep))
+        else:
+            if not data:
+                raise IOError('Unexpected end of stream')
+            self.inbuf.extend(data)
+            self.handle_negotiation()
+
+    def handle_negotiation(self):
+        '''
+        Handle socks5 request according to RFC1928, as far as received
+        '''
+        while self.state < self.CONNECTING:
+            r = BufferReader(self.inbuf)
+            try:
+                if self.state == self.GREETING:
+                    self.handle_greeting(r)
+                elif self.state == self.AUTH:
+                    self.handle_auth(r)
+                else:
+                    self.handle_request(r)
+            except IncompleteError:
+                return
+            del self.inbuf[:r.pos]
+
+    def handle_greeting(self, r):
+        # Verify socks version
+        ver = r.byte()
+        if ver != 0x05:
+            raise IOError('Invalid socks version %i' % ver)
+        # Choose authentication method
+        nmethods = r.byte()
+        methods = r.read(nmethods)
+        method = None
+        if 0x02 in methods and self.serv.conf.auth:
+            method = 0x02 # username/password
+        elif 0x00 in methods and self.serv.conf.unauth:
+            method = 0x00 # unauthenticated
+        if method is None:
+            raise IOError('No supported authentication method was offered')
+        # Send response
+        self.send(self.client, bytearray([0x05, method]))
+        self.state = self.AUTH if method == 0x02 else self.REQUEST
+
+    def handle_auth(self, r):
+        ver = r.byte()
+        if ver != 0x01:
+            raise IOError('Invalid auth packet version %i' % ver)
+        ulen = r.byte()
+        username = str(r.read(ulen))
+        plen = r.byte()
+        password = str(r.read(plen))
+        (self.username, self.password) = (username, password)
+        # Send authentication response
+        self.send(self.client, bytearray([0x01, 0x00]))
+        self.state = self.REQUEST
+
+    def handle_request(self, r):
+        # Read connect request
+        (ver,cmd,rsv,atyp) = r.read(4)
+        if ver != 0x05:
+            raise IOError('Invalid socks version %i in connect request' % ver)
+        if cmd != Command.CONNECT:
+            raise IOError('Unhandled command %i in connect request' % cmd)
+
+        if atyp == AddressType.IPV4:
+            addr = r.read(4)
+        elif atyp == AddressType.DOMAINNAME:
+            n = r.byte()
+            addr = r.read(n)
+        elif atyp == AddressType.IPV6:
+            addr = r.read(16)
+        else:
+            raise IOError('Unknown address type %i' % atyp)
+        port_hi,port_lo = r.read(2)
+        port = (port_hi << 8) | port_lo
+
+        cmdin = Socks5Command(cmd, atyp, addr, port, self.username, self.password)
+        self.stats.command = cmdin
+        self.stats.requested = time.time()
+        self.serv.queue.put(cmdin)
+        print('Proxy: ', cmdin)
+
+        target = self.serv.conf.relay(cmdin) if self.serv.conf.relay else None
+        if target is None:
+            # Send dummy response, or refuse, and disconnect
+            self.reply(Reply.NOT_ALLOWED if self.serv.conf.relay else Reply.SUCCEEDED)
+            self.state = self.CLOSING
+        else:
+            self.stats.target = target
+            self.connect(target)
+
+    def reply(self, rep):
+        self.send(self.client, bytearray([0x05, rep, 0x00, 0x01, 0x00, 0x00, 0x00, 0x00, 0x00, 0x00]))
+
+    def connect(self, target):
+        (af, socktype, proto, _, sockaddr) = socket.getaddrinfo(target[0], target[1], type=socket.SOCK_STREAM)[0]
+        sock = socket.socket(af, socktype, proto)
+        sock.setblocking(False)
+        self.target = Endpoint(sock)
+        err = sock.connect_ex(sockaddr)
+        if err in (0, errno.EINPROGRESS, errno.EWOULDBLOCK):
+            self.state = self.CONNECTING
+        else:
+            self.reply(Reply.CONNECTION_REFUSED)
+            self.state = self.CLOSING
+
+    def handle_connect(self):
+        err = self.target.sock.getsockopt(socket.SOL_SOCKET, socket.SO_ERROR)
+        if err:
+            self.reply(Reply.CONNECTION_REFUSED)
+            self.state = self.CLOSING
+            return
+        self.stats.connected = time.time()
+        self.state = self.RELAY
+        self.reply(Reply.SUCCEEDED)
+        if self.inbuf:
+            # Data the client sent right after the request
+            self.stats.bytes_sent += len(self.inbuf)
+            self.send(self.target, self.inbuf)
+            self.inbuf = bytearray()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        self.stats.closed = time.time()
+        for ep in (self.client, self.target):
+            if ep is None:
+                continue
+            if ep.events:
+                self.serv.selector.unregister(ep.sock)
+                ep.events = 0
+            ep.sock.close()
+        self.serv.connections.discard(self)
 
 class Socks5Server(object):
     def __init__(self, conf):
@@ -130,32 +353,58 @@ class Socks5Server(object):
         self.s = socket.socket(conf.af)
         self.s.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.s.bind(conf.addr)
-        self.s.listen(5)
+        self.s.listen(socket.SOMAXCONN)
+        self.s.setblocking(False)
         self.running = False
         self.thread = None
+        self.selector = None
+        self.wakeup = None
+        self.connections = set()
         self.queue = queue.Queue() # report connections and exceptions to client
+        self.stats = [] # Socks5Stats of every accepted connection
+
+    def accept(self):
+        while True:
+            try:
+                (sockconn, peer) = self.s.accept()
+            except (BlockingIOError, InterruptedError):
+                return
+            sockconn.setblocking(False)
+            conn = Socks5Connection(self, sockconn, peer)
+            self.connections.add(conn)
+            self.stats.append(conn.stats)
+            conn.update()
 
     def run(self):
         while self.running:
-            (sockconn, peer) = self.s.accept()
-            if self.running:
-                conn = Socks5Connection(self, sockconn, peer)
-                thread = threading.Thread(None, conn.handle)
-                thread.daemon = True
-                thread.start()
-    
+            for (key, mask) in self.selector.select():
+                if key.fileobj is self.s:
+                    self.accept()
+                elif key.fileobj is self.wakeup[0]:
+                    self.wakeup[0].recv(1)
+                else:
+                    (conn, ep) = key.data
+                    if not conn.closed:
+                        conn.handle_event(ep, mask)
+        for conn in list(self.connections):
+            conn.close()
+
     def start(self):
         assert(not self.running)
         self.running = True
+        self.selector = selectors.DefaultSelector()
+        self.wakeup = socket.socketpair()
+        self.selector.register(self.s, selectors.EVENT_READ)
+        self.selector.register(self.wakeup[0], selectors.EVENT_READ)
         self.thread = threading.Thread(None, self.run)
         self.thread.daemon = True
         self.thread.start()
 
     def stop(self):
         self.running = False
-        # connect to self to end run loop
-        s = socket.socket(self.conf.af)
-        s.connect(self.conf.addr)
-        s.close()
+        # wake up the event loop to end it
+        self.wakeup[1].send(b'\0')
         self.thread.join()
-
+        self.selector.close()
+        for s in self.wakeup:
+            s.close()
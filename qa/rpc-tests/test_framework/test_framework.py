@@ -22,11 +22,13 @@ from .util import (
     stop_nodes,
     stop_node,
     enable_coverage,
+    enable_zmq_sync,
     check_json_precision,
     initialize_chain_clean,
     PortSeed,
 )
 from .authproxy import JSONRPCException
+from . import profiler
 
 
 class BitcoinTestFramework(object):
@@ -34,6 +36,7 @@ class BitcoinTestFramework(object):
     def __init__(self):
         self.num_nodes = 4
         self.setup_clean_chain = False
+        self.cache_flavour = None # CacheFlavour to use instead of the default 200-block chain
         self.nodes = None
 
     def run_test(self):
@@ -47,7 +50,7 @@ class BitcoinTestFramework(object):
         if self.setup_clean_chain:
             initialize_chain_clean(self.options.tmpdir, self.num_nodes)
         else:
-            initialize_chain(self.options.tmpdir, self.num_nodes, self.options.cachedir)
+            initialize_chain(self.options.tmpdir, self.num_nodes, self.options.cachedir, self.cache_flavour)
 
     def stop_node(self, num_node):
         stop_node(self.nodes[num_node], num_node)
@@ -119,6 +122,10 @@ class BitcoinTestFramework(object):
                           help="The seed to use for assigning port numbers (default: current process id)")
         parser.add_option("--coveragedir", dest="coveragedir",
                           help="Write tested RPC commands into this directory")
+        parser.add_option("--profiledir", dest="profiledir",
+                          help="Write an RPC/p2p/Python profile of the test run into this directory")
+        parser.add_option("--zmqsync", dest="zmq_sync", default=False, action="store_true",
+                          help="Wait for ZMQ block/tx notifications in sync_blocks/sync_mempools instead of polling")
         self.add_options(parser)
         (self.options, self.args) = parser.parse_args()
 
@@ -131,6 +138,12 @@ class BitcoinTestFramework(object):
         if self.options.coveragedir:
             enable_coverage(self.options.coveragedir)
 
+        if self.options.zmq_sync:
+            enable_zmq_sync()
+
+        if self.options.profiledir:
+            profiler.enable_profiling()
+
         PortSeed.n = self.options.port_seed
 
         os.environ['PATH'] = self.options.srcdir+":"+self.options.srcdir+"/qt:"+os.environ['PATH']
@@ -165,6 +178,11 @@ class BitcoinTestFramework(object):
         else:
             print("Note: bitcoinds were not stopped and may still be running")
 
+        if profiler.PROFILER is not None:
+            name = os.path.splitext(os.path.basename(sys.argv[0]))[0]
+            profiler.PROFILER.write(self.options.profiledir, name)
+            print("Profile written to %s" % os.path.join(self.options.profiledir, name + ".profile.json"))
+
         if not self.options.nocleanup and not self.options.noshutdown and success:
             print("Cleaning up")
             shutil.rmtree(self.options.tmpdir)
@@ -14,11 +14,13 @@ import sys
 from binascii import hexlify, unhexlify
 from base64 import b64encode
 from decimal import Decimal, ROUND_DOWN
+import hashlib
 import json
 import http.client
 import random
 import shutil
 import subprocess
+import tempfile
 import time
 import re
 import errno
@@ -28,6 +30,9 @@ from .authproxy import AuthServiceProxy, JSONRPCException
 
 COVERAGE_DIR = None
 
+# Set by enable_zmq_sync() to a zmqsync.ZMQSync instance
+ZMQ_SYNC = None
+
 # The maximum number of nodes a single test can spawn
 MAX_NODES = 8
 # Don't assign rpc or p2p ports lower than this
@@ -69,6 +74,17 @@ def enable_coverage(dirname):
     COVERAGE_DIR = dirname
 
 
+def enable_zmq_sync():
+    """
+    Have nodes publish block and tx notifications over ZMQ and let
+    sync_blocks/sync_mempools wait on those instead of polling RPC.
+    Requires python3-zmq and a bitcoind built with ZMQ support.
+    """
+    global ZMQ_SYNC
+    from .zmqsync import ZMQSync
+    ZMQ_SYNC = ZMQSync()
+
+
 def get_rpc_proxy(url, node_number, timeout=None):
     """
     Args:
@@ -92,7 +108,7 @@ def get_rpc_proxy(url, node_number, timeout=None):
     coverage_logfile = coverage.get_filename(
         COVERAGE_DIR, node_number) if COVERAGE_DIR else None
 
-    return coverage.AuthServiceProxyWrapper(proxy, coverage_logfile)
+    return coverage.AuthServiceProxyWrapper(proxy, coverage_logfile, node_number)
 
 
 def p2p_port(n):
@@ -102,6 +118,9 @@ def p2p_port(n):
 def rpc_port(n):
     return PORT_MIN + PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
 
+def zmq_port(n):
+    return PORT_MIN + 2 * PORT_RANGE + n + (MAX_NODES * PortSeed.n) % (PORT_RANGE - 1 - MAX_NODES)
+
 def check_json_precision():
     """Make sure json library being used does not lose precision converting BTC values"""
     n = Decimal("20000000.00000003")
@@ -134,6 +153,14 @@ def sync_blocks(rpc_connections, *, wait=1, timeout=60):
     # variables (chainActive vs latestBlock) and the former gets updated
     # earlier.
     maxheight = max(x.getblockcount() for x in rpc_connections)
+    views = ZMQ_SYNC.get_views(rpc_connections) if ZMQ_SYNC else None
+    if views:
+        from . import zmqsync
+        tips = zmqsync.sync_height(views, maxheight, wait=wait, timeout=timeout)
+        if all(t["hash"] == tips[0]["hash"] for t in tips):
+            return
+        raise AssertionError("Block sync failed, mismatched block hashes:{}".format(
+                             "".join("\n  {!r}".format(tip) for tip in tips)))
     start_time = cur_time = time.time()
     while cur_time <= start_time + timeout:
         tips = [r.waitforblockheight(maxheight, int(wait * 1000)) for r in rpc_connections]
@@ -150,6 +177,10 @@ def sync_chain(rpc_connections, *, wait=1, timeout=60):
     """
     Wait until everybody has the same best block
     """
+    views = ZMQ_SYNC.get_views(rpc_connections) if ZMQ_SYNC else None
+    if views:
+        from . import zmqsync
+        return zmqsync.sync_blocks(views, wait=wait, timeout=timeout)
     while timeout > 0:
         best_hash = [x.getbestblockhash() for x in rpc_connections]
         if best_hash == [best_hash[0]]*len(best_hash):
@@ -163,6 +194,10 @@ def sync_mempools(rpc_connections, *, wait=1, timeout=60):
     Wait until everybody has the same transactions in their memory
     pools
     """
+    views = ZMQ_SYNC.get_views(rpc_connections) if ZMQ_SYNC else None
+    if views:
+        from . import zmqsync
+        return zmqsync.sync_mempools(views, wait=wait, timeout=timeout)
     while timeout > 0:
         pool = set(rpc_connections[0].getrawmempool())
         num_match = 1
@@ -211,6 +246,9 @@ def wait_for_bitcoind_start(process, url, i):
     Wait for bitcoind to start. This means that RPC is accessible and fully initialized.
     Raise an exception if bitcoind exits during initialization.
     '''
+    # Probe with exponential backoff: most nodes come up within a few tens of
+    # milliseconds, so a fixed 250ms poll wastes most of the time it sleeps.
+    delay = 0.01
     while True:
         if process.poll() is not None:
             raise Exception('bitcoind exited with status %i during initialization' % process.returncode)
@@ -224,49 +262,36 @@ def wait_for_bitcoind_start(process, url, i):
         except JSONRPCException as e: # Initialization phase
             if e.error['code'] != -28: # RPC in warmup?
                 raise # unknown JSON RPC exception
-        time.sleep(0.25)
+        time.sleep(delay)
+        delay = min(delay * 2, 0.25)
 
-def initialize_chain(test_dir, num_nodes, cachedir):
-    """
-    Create a cache of a 200-block-long chain (with wallet) for MAX_NODES
-    Afterward, create num_nodes copies from the cache
+class CacheFlavour(object):
     """
+    A kind of pre-built chain kept in the test cache.
 
-    assert num_nodes <= MAX_NODES
-    create_cache = False
-    for i in range(MAX_NODES):
-        if not os.path.isdir(os.path.join(cachedir, 'node'+str(i))):
-            create_cache = True
-            break
+    The cache stores each flavour as an immutable image: a manifest listing
+    the files of all node directories by content hash, with the contents
+    themselves kept once in a shared object store. Images are keyed by
+    name and params, so changing a parameter builds a new image rather
+    than reusing a stale one.
 
-    if create_cache:
+    Subclasses set name/num_nodes/extra_args and override build(rpcs), which
+    is called with RPC connections to freshly started, connected nodes.
+    """
+    name = "default"
+    num_nodes = MAX_NODES
+    extra_args = []
 
-        #find and delete old cache directories if any exist
-        for i in range(MAX_NODES):
-            if os.path.isdir(os.path.join(cachedir,"node"+str(i))):
-                shutil.rmtree(os.path.join(cachedir,"node"+str(i)))
+    def __init__(self, **params):
+        self.params = params
 
-        # Create cache directories, run bitcoinds:
-        for i in range(MAX_NODES):
-            datadir=initialize_datadir(cachedir, i)
-            args = [ os.getenv("BITCOIND", "bitcoind"), "-server", "-keypool=1", "-datadir="+datadir, "-discover=0" ]
-            if i > 0:
-                args.append("-connect=127.0.0.1:"+str(p2p_port(0)))
-            bitcoind_processes[i] = subprocess.Popen(args)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print("initialize_chain: bitcoind started, waiting for RPC to come up")
-            wait_for_bitcoind_start(bitcoind_processes[i], rpc_url(i), i)
-            if os.getenv("PYTHON_DEBUG", ""):
-                print("initialize_chain: RPC successfully started")
-
-        rpcs = []
-        for i in range(MAX_NODES):
-            try:
-                rpcs.append(get_rpc_proxy(rpc_url(i), i))
-            except:
-                sys.stderr.write("Error connecting to "+url+"\n")
-                sys.exit(1)
+    def key(self):
+        if not self.params:
+            return self.name
+        digest = hashlib.sha256(json.dumps(self.params, sort_keys=True).encode('utf8')).hexdigest()
+        return "%s-%s" % (self.name, digest[:16])
 
+    def build(self, rpcs):
         # Create a 200-block-long chain; each of the 4 first nodes
         # gets 25 mature blocks and 25 immature.
         # Note: To preserve compatibility with older versions of
@@ -284,20 +309,143 @@ def initialize_chain(test_dir, num_nodes, cachedir):
                     block_time += 10*60
                 # Must sync before next peer starts generating blocks
                 sync_blocks(rpcs)
+        disable_mocktime()
+
+# Files that bitcoind never modifies once written, and which can therefore
+# be hard linked from the cache: LevelDB tables (chainstate, block index).
+# Everything else (wallet, block and undo files, LevelDB logs/manifests,
+# bitcoin.conf) is rewritten in place and gets its own copy.
+CACHE_LINKABLE_RE = re.compile(r'.*\.(ldb|sst)$')
+
+# ioctl to clone a file's extents on copy-on-write filesystems (btrfs, xfs)
+FICLONE = 0x40049409
+
+def _cache_object_path(cachedir, digest):
+    return os.path.join(cachedir, "objects", digest[:2], digest[2:])
+
+def _cache_manifest_path(cachedir, key):
+    return os.path.join(cachedir, "images", key + ".json")
+
+def _store_cache_image(cachedir, build_dir, key):
+    """
+    Move the node directories in build_dir into the object store and
+    write the image manifest. The manifest is written last, atomically, so
+    concurrent builders of the same image can not produce a partial one.
+    """
+    manifest = {}
+    for root, dirs, files in os.walk(build_dir):
+        rel_root = os.path.relpath(root, build_dir)
+        if not files and not dirs:
+            manifest[rel_root] = None # keep empty directories
+        for name in files:
+            path = os.path.join(root, name)
+            sha256 = hashlib.sha256()
+            with open(path, 'rb') as f:
+                for chunk in iter(lambda: f.read(1 << 20), b''):
+                    sha256.update(chunk)
+            digest = sha256.hexdigest()
+            object_path = _cache_object_path(cachedir, digest)
+            if not os.path.exists(object_path):
+                os.makedirs(os.path.dirname(object_path), exist_ok=True)
+                os.replace(path, object_path)
+                if os.name == 'posix':
+                    os.chmod(object_path, 0o444) # guard against writes through hard links
+            manifest[os.path.join(rel_root, name)] = digest
+    manifest_path = _cache_manifest_path(cachedir, key)
+    os.makedirs(os.path.dirname(manifest_path), exist_ok=True)
+    with open(manifest_path + ".tmp%d" % os.getpid(), 'w', encoding='utf8') as f:
+        json.dump(manifest, f, indent=1, sort_keys=True)
+    os.replace(manifest_path + ".tmp%d" % os.getpid(), manifest_path)
+
+def _clone_file(src, dst, linkable):
+    """Hard link, reflink or copy src to dst, cheapest first"""
+    if linkable and os.name == 'posix':
+        try:
+            os.link(src, dst)
+            return
+        except OSError:
+            pass
+    try:
+        import fcntl
+        with open(src, 'rb') as fsrc, open(dst, 'wb') as fdst:
+            fcntl.ioctl(fdst.fileno(), FICLONE, fsrc.fileno())
+        return
+    except (ImportError, OSError):
+        pass
+    shutil.copyfile(src, dst)
+
+def _clone_cache_image(cachedir, key, test_dir, num_nodes):
+    with open(_cache_manifest_path(cachedir, key), encoding='utf8') as f:
+        manifest = json.load(f)
+    for rel_path, digest in sorted(manifest.items()):
+        node_dir = rel_path.split(os.sep)[0]
+        if int(node_dir[len("node"):]) >= num_nodes:
+            continue
+        path = os.path.join(test_dir, rel_path)
+        if digest is None:
+            os.makedirs(path, exist_ok=True)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        _clone_file(_cache_object_path(cachedir, digest), path,
+                    CACHE_LINKABLE_RE.match(os.path.basename(rel_path)))
+
+def _build_cache_image(cachedir, flavour):
+    os.makedirs(cachedir, exist_ok=True)
+    build_dir = tempfile.mkdtemp(prefix="build-" + flavour.key() + "-", dir=cachedir)
+    try:
+        # Create cache directories, run bitcoinds. Start all of them before
+        # waiting for any, so that they initialize in parallel:
+        for i in range(flavour.num_nodes):
+            datadir=initialize_datadir(build_dir, i)
+            args = [ os.getenv("BITCOIND", "bitcoind"), "-server", "-keypool=1", "-datadir="+datadir, "-discover=0" ]
+            if i > 0:
+                args.append("-connect=127.0.0.1:"+str(p2p_port(0)))
+            args.extend(flavour.extra_args)
+            bitcoind_processes[i] = subprocess.Popen(args)
+            if os.getenv("PYTHON_DEBUG", ""):
+                print("initialize_chain: bitcoind started, waiting for RPC to come up")
+        for i in range(flavour.num_nodes):
+            wait_for_bitcoind_start(bitcoind_processes[i], rpc_url(i), i)
+            if os.getenv("PYTHON_DEBUG", ""):
+                print("initialize_chain: RPC successfully started")
+
+        rpcs = []
+        for i in range(flavour.num_nodes):
+            try:
+                rpcs.append(get_rpc_proxy(rpc_url(i), i))
+            except:
+                sys.stderr.write("Error connecting to "+rpc_url(i)+"\n")
+                sys.exit(1)
+
+        flavour.build(rpcs)
 
         # Shut them down, and clean up cache directories:
         stop_nodes(rpcs)
-        disable_mocktime()
-        for i in range(MAX_NODES):
-            os.remove(log_filename(cachedir, i, "debug.log"))
-            os.remove(log_filename(cachedir, i, "db.log"))
-            os.remove(log_filename(cachedir, i, "peers.dat"))
-            os.remove(log_filename(cachedir, i, "fee_estimates.dat"))
+        for i in range(flavour.num_nodes):
+            for logname in ("debug.log", "db.log", "peers.dat", "fee_estimates.dat"):
+                if os.path.exists(log_filename(build_dir, i, logname)):
+                    os.remove(log_filename(build_dir, i, logname))
+        _store_cache_image(cachedir, build_dir, flavour.key())
+    finally:
+        shutil.rmtree(build_dir, ignore_errors=True)
+
+def initialize_chain(test_dir, num_nodes, cachedir, flavour=None):
+    """
+    Create a cache of a 200-block-long chain (with wallet) for MAX_NODES
+    Afterward, create num_nodes copies from the cache
 
+    flavour (CacheFlavour) selects a different pre-built chain. Cached files
+    that bitcoind never rewrites are hard linked rather than copied.
+    """
+    if flavour is None:
+        flavour = CacheFlavour()
+    assert num_nodes <= flavour.num_nodes
+
+    if not os.path.isfile(_cache_manifest_path(cachedir, flavour.key())):
+        _build_cache_image(cachedir, flavour)
+
+    _clone_cache_image(cachedir, flavour.key(), test_dir, num_nodes)
     for i in range(num_nodes):
-        from_dir = os.path.join(cachedir, "node"+str(i))
-        to_dir = os.path.join(test_dir,  "node"+str(i))
-        shutil.copytree(from_dir, to_dir)
         initialize_datadir(test_dir, i) # Overwrite port/rpcport in bitcoin.conf
 
 def initialize_chain_clean(test_dir, num_nodes):
@@ -329,18 +477,28 @@ def _rpchost_to_args(rpchost):
         rv += ['-rpcport=' + rpcport]
     return rv
 
-def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+def _spawn_bitcoind(i, dirname, extra_args=None, binary=None):
     """
-    Start a bitcoind and return RPC connection to it
+    Launch bitcoind process i without waiting for it to come up
     """
     datadir = os.path.join(dirname, "node"+str(i))
     if binary is None:
         binary = os.getenv("BITCOIND", "bitcoind")
     args = [ binary, "-datadir="+datadir, "-server", "-keypool=1", "-discover=0", "-rest", "-mocktime="+str(get_mocktime()) ]
+    if ZMQ_SYNC:
+        # Before extra_args, so that tests configuring their own ZMQ
+        # endpoints override these
+        zmq_address = "tcp://127.0.0.1:%d" % zmq_port(i)
+        args += [ "-zmqpubhashblock="+zmq_address, "-zmqpubhashtx="+zmq_address ]
     if extra_args is not None: args.extend(extra_args)
     bitcoind_processes[i] = subprocess.Popen(args)
     if os.getenv("PYTHON_DEBUG", ""):
         print("start_node: bitcoind started, waiting for RPC to come up")
+
+def _wait_for_node_rpc(i, rpchost=None, timewait=None):
+    """
+    Wait until the RPC interface of spawned bitcoind i is up and return a connection to it
+    """
     url = rpc_url(i, rpchost)
     wait_for_bitcoind_start(bitcoind_processes[i], url, i)
     if os.getenv("PYTHON_DEBUG", ""):
@@ -350,19 +508,42 @@ def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=
     if COVERAGE_DIR:
         coverage.write_all_rpc_commands(COVERAGE_DIR, proxy)
 
+    if ZMQ_SYNC:
+        ZMQ_SYNC.register(url, "tcp://127.0.0.1:%d" % zmq_port(i), proxy)
+
     return proxy
 
+def start_node(i, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
+    """
+    Start a bitcoind and return RPC connection to it
+    """
+    _spawn_bitcoind(i, dirname, extra_args, binary)
+    return _wait_for_node_rpc(i, rpchost, timewait)
+
 def start_nodes(num_nodes, dirname, extra_args=None, rpchost=None, timewait=None, binary=None):
     """
     Start multiple bitcoinds, return RPC connections to them
+
+    All processes are launched first and then waited for, so the nodes
+    initialize concurrently.
     """
     if extra_args is None: extra_args = [ None for _ in range(num_nodes) ]
     if binary is None: binary = [ None for _ in range(num_nodes) ]
     rpcs = []
     try:
         for i in range(num_nodes):
-            rpcs.append(start_node(i, dirname, extra_args[i], rpchost, timewait=timewait, binary=binary[i]))
+            _spawn_bitcoind(i, dirname, extra_args[i], binary[i])
+        for i in range(num_nodes):
+            rpcs.append(_wait_for_node_rpc(i, rpchost, timewait))
     except: # If one node failed to start, stop the others
+        # Nodes that were launched but never answered over RPC can only be
+        # killed; the ones that came up are shut down cleanly.
+        for i in range(len(rpcs), num_nodes):
+            if i in bitcoind_processes:
+                if bitcoind_processes[i].poll() is None:
+                    bitcoind_processes[i].kill()
+                bitcoind_processes[i].wait(timeout=BITCOIND_PROC_WAIT_TIMEOUT)
+                del bitcoind_processes[i]
         stop_nodes(rpcs)
         raise
     return rpcs
@@ -370,18 +551,28 @@ def start_nodes(num_nodes, dirname, extra_args=None, rpchost=None, timewait=None
 def log_filename(dirname, n_node, logname):
     return os.path.join(dirname, "node"+str(n_node), "regtest", logname)
 
-def stop_node(node, i):
+def _request_stop(node):
     try:
         node.stop()
     except http.client.CannotSendRequest as e:
         print("WARN: Unable to stop node: " + repr(e))
+
+def _wait_bitcoind_exit(i):
     return_code = bitcoind_processes[i].wait(timeout=BITCOIND_PROC_WAIT_TIMEOUT)
     assert_equal(return_code, 0)
     del bitcoind_processes[i]
 
+def stop_node(node, i):
+    _request_stop(node)
+    _wait_bitcoind_exit(i)
+
 def stop_nodes(nodes):
-    for i, node in enumerate(nodes):
-        stop_node(node, i)
+    # Ask every node to shut down before waiting for any of them, so that
+    # they shut down in parallel.
+    for node in nodes:
+        _request_stop(node)
+    for i in range(len(nodes)):
+        _wait_bitcoind_exit(i)
     assert not bitcoind_processes.values() # All connections must be gone now
 
 def set_node_times(nodes, t):
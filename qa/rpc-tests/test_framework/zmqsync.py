@@ -0,0 +1,199 @@
+#!/usr/bin/env python3
+# Copyright (c) 2017 The Bitcoin Core developers
+# Distributed under the MIT software license, see the accompanying
+# file COPYING or http://www.opensource.org/licenses/mit-license.php.
+"""
+Event driven block and mempool synchronization.
+
+Every node started while ZMQ sync is enabled (see util.enable_zmq_sync)
+publishes its hashblock/hashtx notifications on its own port. A NodeView
+subscribes to those and keeps an incremental picture of the node's tip and
+mempool, so sync_blocks/sync_mempools can wait for the exact notification
+that brings the nodes into agreement and only compare hashes, instead of
+re-fetching the full state from every node once a second.
+
+ZMQ is lossy (slow joiners, full queues) and does not report mempool
+removals, so the views are treated as hints: agreement is confirmed with
+RPCs before returning, and a view is re-seeded over RPC after a
+block, a sequence gap or `wait` seconds without progress.
+"""
+
+import struct
+import time
+
+from binascii import hexlify
+
+import zmq
+
+class NodeView(object):
+    '''Incremental view of one node's tip and mempool, fed by ZMQ'''
+    def __init__(self, context, address, rpc):
+        self.rpc = rpc
+        self.socket = context.socket(zmq.SUB)
+        self.socket.setsockopt(zmq.SUBSCRIBE, b"hashblock")
+        self.socket.setsockopt(zmq.SUBSCRIBE, b"hashtx")
+        self.socket.connect(address)
+        self.sequence = {}
+        self.tip = None
+        self.mempool = None
+
+    def close(self):
+        self.socket.close(linger=0)
+
+    def refresh_tip(self):
+        self.tip = self.rpc.getbestblockhash()
+
+    def refresh_mempool(self):
+        self.mempool = set(self.rpc.getrawmempool())
+
+    def process(self):
+        '''Apply all pending notifications without blocking. Returns whether there were any.'''
+        received = False
+        while True:
+            try:
+                topic, body, seq = self.socket.recv_multipart(zmq.NOBLOCK)
+            except zmq.Again:
+                return received
+            received = True
+            seq = struct.unpack('<I', seq)[-1]
+            last = self.sequence.get(topic)
+            self.sequence[topic] = seq
+            if last is not None and seq != (last + 1) & 0xffffffff:
+                # Missed notifications; fall back to RPC for this node
+                self.tip = None
+                self.mempool = None
+                continue
+            if topic == b"hashblock":
+                self.tip = hexlify(body).decode('ascii')
+                # The block may have removed transactions from the mempool,
+                # which ZMQ does not announce.
+                self.mempool = None
+            elif topic == b"hashtx" and self.mempool is not None:
+                self.mempool.add(hexlify(body).decode('ascii'))
+
+class ZMQSync(object):
+    '''Owns the ZMQ context and the views of all nodes, keyed by RPC URL'''
+    def __init__(self):
+        self.context = zmq.Context()
+        self.views = {}
+
+    def register(self, url, address, rpc):
+        if url in self.views:
+            self.views[url].close()
+        self.views[url] = NodeView(self.context, address, rpc)
+
+    def get_views(self, rpc_connections):
+        '''Return the views for rpc_connections, or None if some node has none'''
+        try:
+            return [self.views[r.url] for r in rpc_connections]
+        except (AttributeError, KeyError, TypeError):
+            return None
+
+def _wait_for_events(views, timeout):
+    poller = zmq.Poller()
+    for v in views:
+        poller.register(v.socket, zmq.POLLIN)
+    poller.poll(max(0, int(timeout * 1000)))
+
+def sync_blocks(views, *, wait=1, timeout=60):
+    """
+    Wait until all views report the same tip, then confirm it over RPC.
+    """
+    deadline = time.time() + timeout
+    next_refresh = 0
+    while True:
+        progress = False
+        for v in views:
+            progress |= v.process()
+        now = time.time()
+        if progress:
+            next_refresh = now + wait
+        for v in views:
+            if v.tip is None or now >= next_refresh:
+                v.refresh_tip()
+        if now >= next_refresh:
+            next_refresh = now + wait
+        if all(v.tip == views[0].tip for v in views):
+            # Confirm: the views may lag behind or have missed a message
+            tips = [v.rpc.getbestblockhash() for v in views]
+            if tips == [tips[0]] * len(tips):
+                return
+            for v, tip in zip(views, tips):
+                v.tip = tip
+        if now > deadline:
+            raise AssertionError("Block sync timed out:{}".format(
+                                 "".join("\n  {!r}".format(v.tip) for v in views)))
+        _wait_for_events(views, min(deadline, next_refresh) - now)
+
+def sync_height(views, height, *, wait=1, timeout=60):
+    """
+    Wait until the tips of all views are at height, and return the nodes'
+    tips as {'hash', 'height'}. The height of a tip is only looked up when
+    a view reports a new one, or every `wait` seconds.
+    """
+    deadline = time.time() + timeout
+    next_refresh = 0
+    heights = [None] * len(views)
+    checked = [None] * len(views) # tips whose height is in heights
+    while True:
+        for v in views:
+            v.process()
+        now = time.time()
+        refresh = now >= next_refresh
+        if refresh:
+            next_refresh = now + wait
+        for i, v in enumerate(views):
+            if refresh or v.tip is None:
+                v.refresh_tip()
+            if checked[i] != v.tip:
+                heights[i] = v.rpc.getblockheader(v.tip)['height']
+                checked[i] = v.tip
+        if all(h == height for h in heights):
+            # Confirm: the views may lag behind
+            tips = []
+            for v in views:
+                tip = v.rpc.getbestblockhash()
+                tips.append({'hash': tip, 'height': v.rpc.getblockheader(tip)['height']})
+            if all(t['height'] == height for t in tips):
+                return tips
+            next_refresh = 0
+        if now > deadline:
+            raise AssertionError("Block sync to height {} timed out:{}".format(
+                                 height, "".join("\n  {!r}".format({'hash': v.tip, 'height': h})
+                                                 for v, h in zip(views, heights))))
+        _wait_for_events(views, min(deadline, next_refresh) - now)
+
+def sync_mempools(views, *, wait=1, timeout=60):
+    """
+    Wait until all views report the same set of mempool transactions,
+    then confirm that the nodes' mempools are equal over RPC.
+    """
+    deadline = time.time() + timeout
+    next_refresh = 0
+    while True:
+        progress = False
+        for v in views:
+            progress |= v.process()
+        now = time.time()
+        if progress:
+            next_refresh = now + wait
+        for v in views:
+            if v.mempool is None or now >= next_refresh:
+                v.refresh_mempool()
+        if now >= next_refresh:
+            next_refresh = now + wait
+        if all(v.mempool == views[0].mempool for v in views):
+            # Evictions and expiries are not announced, and a missed hashtx
+            # can go unnoticed, so make sure the views have not drifted from
+            # the real mempools.
+            pools = [set(v.rpc.getrawmempool()) for v in views]
+            if all(pool == pools[0] for pool in pools):
+                return
+            for v, pool in zip(views, pools):
+                v.mempool = pool
+        if now > deadline:
+            raise AssertionError("Mempool sync failed:{}".format(
+                                 "".join("\n  {!r}".format(None if v.mempool is None else sorted(v.mempool))
+                                         for v in views)))
+        if all(v.mempool is not None for v in views):
+            _wait_for_events(views, min(deadline, next_refresh) - now)
@@ -10,6 +10,9 @@ import sys
 import binascii
 import difflib
 import logging
+import multiprocessing
+import time
+from multiprocessing.pool import ThreadPool
 
 def parse_output(a, fmt):
     """Parse the output according to specified format.
@@ -22,12 +25,44 @@ def parse_output(a, fmt):
     else:
         raise NotImplementedError("Don't know how to compare %s" % fmt)
 
-def bctest(testDir, testObj, exeext):
+class DataFiles(object):
+    """Contents of the input and expected output files, read and parsed once.
+
+    Many test cases share the same files, and the cases run concurrently, so
+    all files are loaded up front by load()."""
+    def __init__(self, testDir):
+        self.testDir = testDir
+        self.contents = {}
+        self.parsed = {}
+
+    def load(self, input_data):
+        for testObj in input_data:
+            for key in ("input", "output_cmp"):
+                if key in testObj and testObj[key] not in self.contents:
+                    try:
+                        self.contents[testObj[key]] = open(self.testDir + "/" + testObj[key]).read()
+                    except IOError:
+                        pass # reported by the test case
+
+    def read(self, filename):
+        if filename not in self.contents:
+            self.contents[filename] = open(self.testDir + "/" + filename).read()
+        return self.contents[filename]
+
+    def read_parsed(self, filename, fmt):
+        if filename not in self.parsed:
+            self.parsed[filename] = parse_output(self.read(filename), fmt)
+        return self.parsed[filename]
+
+def bctest(testDir, testObj, exeext, dataFiles=None, logger=logging):
     """Runs a single test, comparing output and RC to expected output and RC.
 
     Raises an error if input can't be read, executable fails, or output/RC
     are not as expected. Error is caught by bctester() and reported.
+    The reason for a failure is logged to logger.
     """
+    if dataFiles is None:
+        dataFiles = DataFiles(testDir)
     # Get the exec names and arguments
     execprog = testObj['exec'] + exeext
     execargs = testObj['args']
@@ -37,8 +72,7 @@ def bctest(testDir, testObj, exeext):
     stdinCfg = None
     inputData = None
     if "input" in testObj:
-        filename = testDir + "/" + testObj['input']
-        inputData = open(filename).read()
+        inputData = dataFiles.read(testObj['input'])
         stdinCfg = subprocess.PIPE
 
     # Read the expected output data (if there is any)
@@ -48,12 +82,12 @@ def bctest(testDir, testObj, exeext):
         outputFn = testObj['output_cmp']
         outputType = os.path.splitext(outputFn)[1][1:] # output type from file extension (determines how to compare)
         try:
-            outputData = open(testDir + "/" + outputFn).read()
+            outputData = dataFiles.read(outputFn)
         except:
-            logging.error("Output file " + outputFn + " can not be opened")
+            logger.error("Output file " + outputFn + " can not be opened")
             raise
         if not outputData:
-            logging.error("Output data missing for " + outputFn)
+            logger.error("Output data missing for " + outputFn)
             raise Exception
 
     # Run the test
@@ -61,7 +95,7 @@ def bctest(testDir, testObj, exeext):
     try:
         outs = proc.communicate(input=inputData)
     except OSError:
-        logging.error("OSError, Failed to execute " + execprog)
+        logger.error("OSError, Failed to execute " + execprog)
         raise
 
     if outputData:
@@ -69,16 +103,16 @@ def bctest(testDir, testObj, exeext):
         try:
             a_parsed = parse_output(outs[0], outputType)
         except Exception as e:
-            logging.error('Error parsing command output as %s: %s' % (outputType,e))
+            logger.error('Error parsing command output as %s: %s' % (outputType,e))
             raise
         try:
-            b_parsed = parse_output(outputData, outputType)
+            b_parsed = dataFiles.read_parsed(outputFn, outputType)
         except Exception as e:
-            logging.error('Error parsing expected output %s as %s: %s' % (outputFn,outputType,e))
+            logger.error('Error parsing expected output %s as %s: %s' % (outputFn,outputType,e))
             raise
         # Compare data
         if a_parsed != b_parsed:
-            logging.error("Output data mismatch for " + outputFn + " (format " + outputType + ")")
+            logger.error("Output data mismatch for " + outputFn + " (format " + outputType + ")")
             raise Exception
         # Compare formatting
         if outs[0] != outputData:
@@ -87,7 +121,7 @@ def bctest(testDir, testObj, exeext):
                                                           outs[0].splitlines(True),
                                                           fromfile=outputFn,
                                                           tofile="returned"))
-            logging.error(error_message)
+            logger.error(error_message)
             raise Exception
 
     # Compare the return code to the expected return code
@@ -95,7 +129,7 @@ def bctest(testDir, testObj, exeext):
     if "return_code" in testObj:
         wantRC = testObj['return_code']
     if proc.returncode != wantRC:
-        logging.error("Return code mismatch for " + outputFn)
+        logger.error("Return code mismatch for " + outputFn)
         raise Exception
 
     if "error_txt" in testObj:
@@ -107,25 +141,72 @@ def bctest(testDir, testObj, exeext):
         # linux through wine. Just assert that the expected error text appears
         # somewhere in stderr.
         if want_error not in outs[1]:
-            logging.error("Error mismatch:\n" + "Expected: " + want_error + "\nReceived: " + outs[1].rstrip())
+            logger.error("Error mismatch:\n" + "Expected: " + want_error + "\nReceived: " + outs[1].rstrip())
             raise Exception
 
-def bctester(testDir, input_basename, buildenv):
-    """ Loads and parses the input file, runs all tests and reports results"""
+class RecordList(logging.Handler):
+    """Keeps the records logged by one test case, to be reported with its result."""
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+def run_testcase(args):
+    """Runs one test case for bctester().
+
+    Returns (passed, duration in seconds, log records of the case)."""
+    (testDir, testObj, exeext, dataFiles) = args
+    # A logger of its own, outside the logging hierarchy, so the messages of
+    # concurrently running cases don't interleave
+    records = RecordList()
+    logger = logging.Logger(testObj["description"])
+    logger.addHandler(records)
+    start = time.time()
+    try:
+        bctest(testDir, testObj, exeext, dataFiles, logger)
+        passed = True
+    except:
+        passed = False
+    return (passed, time.time() - start, records.records)
+
+def bctester(testDir, input_basename, buildenv, jobs=None):
+    """ Loads and parses the input file, runs all tests and reports results
+
+    The test cases are independent of each other (bitcoin-tx keeps no state),
+    so they run concurrently, at most jobs (default: number of CPUs) at a time.
+    """
     input_filename = testDir + "/" + input_basename
     raw_data = open(input_filename).read()
     input_data = json.loads(raw_data)
 
-    failed_testcases = []
+    dataFiles = DataFiles(testDir)
+    dataFiles.load(input_data)
 
-    for testObj in input_data:
-        try:
-            bctest(testDir, testObj, buildenv.exeext)
+    start = time.time()
+    pool = ThreadPool(jobs or multiprocessing.cpu_count())
+    results = pool.map(run_testcase, [(testDir, testObj, buildenv.exeext, dataFiles) for testObj in input_data], chunksize=1)
+    pool.close()
+    elapsed = time.time() - start
+
+    root = logging.getLogger()
+    failed_testcases = []
+    for (testObj, (passed, duration, records)) in zip(input_data, results):
+        for record in records:
+            if root.isEnabledFor(record.levelno):
+                root.handle(record)
+        if passed:
             logging.info("PASSED: " + testObj["description"])
-        except:
+        else:
             logging.info("FAILED: " + testObj["description"])
             failed_testcases.append(testObj["description"])
 
+    timings = sorted(zip([testObj["description"] for testObj in input_data], results), key=lambda r: -r[1][1])
+    logging.info("Timings (%d cases in %.2fs, %.2fs of test time):\n" % (len(results), elapsed, sum(r[1] for r in results)) +
+                 "".join("%8.3fs  %s  %s\n" % (duration, "PASSED" if passed else "FAILED", description)
+                         for (description, (passed, duration, records)) in timings))
+
     if failed_testcases:
         logging.error("FAILED TESTCASES: [" + ", ".join(failed_testcases) + "]")
         sys.exit(1)
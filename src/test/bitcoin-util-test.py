@@ -16,7 +16,7 @@ Runs automatically during `make check`.
 
 Can also be run manually from the src directory by specifying the source directory:
 
-test/bitcoin-util-test.py --srcdir='srcdir' [--verbose]
+test/bitcoin-util-test.py --srcdir='srcdir' [--verbose] [--jobs=N]
 """
 
 if __name__ == '__main__':
@@ -26,13 +26,16 @@ if __name__ == '__main__':
     try:
         srcdir = os.environ["srcdir"]
         verbose = False
+        jobs = None
     except:
         parser = argparse.ArgumentParser(description=help_text)
         parser.add_argument('-s', '--srcdir')
-        parser.add_argument('-v', '--verbose', action='store_true')
+        parser.add_argument('-v', '--verbose', action='store_true', help='log every case and a timing table')
+        parser.add_argument('-j', '--jobs', type=int, help='number of cases to run at once (default: number of CPUs)')
         args = parser.parse_args()
         srcdir = args.srcdir
         verbose = args.verbose
+        jobs = args.jobs
 
     if verbose:
         level = logging.DEBUG
@@ -42,4 +45,4 @@ if __name__ == '__main__':
     # Add the format/level to the logger
     logging.basicConfig(format = formatter, level=level)
 
-    bctest.bctester(srcdir + "/test/data", "bitcoin-util-test.json", buildenv)
+    bctest.bctester(srcdir + "/test/data", "bitcoin-util-test.json", buildenv, jobs)